@@ -1,10 +1,17 @@
-import glob
+import argparse
 import pandas as pd
 from pathlib import Path
 import logging
 import os
 import sys
 
+# Make the shared pipeline package importable when the script is run from this folder
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from pipeline.dedupe import dedupe_out_of_core
+from pipeline.incremental import incremental_merge
+from pipeline.ingestion import concat_with_schema, find_exports, read_exports, stream_merge
+from pipeline.join import join_in_memory, join_out_of_core
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -26,26 +33,117 @@ def save_data(path, data):
     logging.info(f'Data saved to {path}\n')
 
 
-def not_clean_data():
+def not_clean_data(workers=None):
     try:
         logging.info('Creating merged unclean data')
-        df_caroc = pd.concat(map(pd.read_csv, glob.glob('Caroc/*.csv')))
-        df_frax = pd.concat(map(pd.read_csv, glob.glob('Frax/*.csv')))
+        df_caroc = read_exports(find_exports('Caroc'), workers)
+        df_frax = read_exports(find_exports('Frax'), workers)
         frames = [df_caroc, df_frax]
-        df_merged = pd.concat(frames)
+        df_merged = concat_with_schema(frames)
 
         save_data("merging_results/Raw_Not_Cleaned_CAROC_Data.csv", df_caroc)
-        save_data("merging_results/Raw_Not_Cleaned_FRAX_Data.csv", df_caroc)
+        save_data("merging_results/Raw_Not_Cleaned_FRAX_Data.csv", df_frax)
         save_data("merging_results/Raw_Not_Cleaned_Data.csv", df_merged)
 
     except ValueError as er:
         logging.error('Error making unclean data')
 
 
+# Same outputs as not_clean_data, but the exports are read in chunks of chunk_rows rows and appended to
+# the merged files as they are read, so memory stays bounded no matter how large the exports are
+def stream_not_clean_data(chunk_rows):
+    try:
+        logging.info(f'Creating merged unclean data in chunks of {chunk_rows} rows')
+        sources = {
+            "merging_results/Raw_Not_Cleaned_CAROC_Data.csv": find_exports('Caroc'),
+            "merging_results/Raw_Not_Cleaned_FRAX_Data.csv": find_exports('Frax'),
+        }
+        stream_merge(sources, "merging_results/Raw_Not_Cleaned_Data.csv", chunk_rows)
+
+    except ValueError as er:
+        logging.error(str(er))
+        logging.error('Error making unclean data')
+
+
+# Only the exports that were not merged by a previous run are read, their rows are upserted into the
+# merged files on BaselineId. The merged exports are tracked in merging_results/merge_manifest.json.
+def incremental_not_clean_data(chunk_rows):
+    try:
+        logging.info('Adding new exports to the merged unclean data')
+        sources = {
+            "merging_results/Raw_Not_Cleaned_CAROC_Data.csv": find_exports('Caroc'),
+            "merging_results/Raw_Not_Cleaned_FRAX_Data.csv": find_exports('Frax'),
+        }
+        incremental_merge(sources, "merging_results/Raw_Not_Cleaned_Data.csv",
+                          "merging_results/merge_manifest.json", chunk_rows)
+
+    except ValueError as er:
+        logging.error(str(er))
+        logging.error('Error making unclean data')
+
+
+# Remove the duplicate patients from the merged data without loading it, for registries that do not fit in RAM
+def dedupe_not_clean_data(partitions, chunk_rows, workers=None):
+    try:
+        logging.info(f'Removing duplicate patients from the merged unclean data using {partitions} partitions')
+        dedupe_out_of_core("merging_results/Raw_Not_Cleaned_Data.csv",
+                           "merging_results/Raw_Not_Cleaned_Deduplicated_Data.csv",
+                           partitions, chunk_rows, workers)
+
+    except ValueError as er:
+        logging.error(str(er))
+        logging.error('Error removing duplicates from unclean data')
+
+
+# One row per patient with both the CAROC and FRAX targets, instead of the two families stacked on each other.
+# The merged family files are joined in memory, or out of core in hash partitions when chunk_rows is given.
+def join_not_clean_data(chunk_rows=None, partitions=16, workers=None):
+    try:
+        logging.info('Joining the CAROC and FRAX unclean data on PatientId')
+        caroc_path = "merging_results/Raw_Not_Cleaned_CAROC_Data.csv"
+        frax_path = "merging_results/Raw_Not_Cleaned_FRAX_Data.csv"
+        joined_path = "merging_results/Raw_Joined_Patient_Data.csv"
+
+        if chunk_rows:
+            join_out_of_core(caroc_path, frax_path, joined_path, partitions, chunk_rows, workers)
+        else:
+            join_in_memory(caroc_path, frax_path, joined_path)
+
+    except ValueError as er:
+        logging.error(str(er))
+        logging.error('Error joining unclean data')
+
+
 def clean_data():
     pass
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merge the CAROC and FRAX exports into one raw data file')
+    parser.add_argument('--chunk-rows', type=int, default=None,
+                        help='Stream the exports in chunks of this many rows instead of loading them whole')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only merge the exports that are not in the merge manifest yet')
+    parser.add_argument('--dedupe-partitions', type=int, default=None,
+                        help='Also write a copy of the merged data without duplicate patients, '
+                             'deduplicated out of core in this many hash partitions')
+    parser.add_argument('--join', action='store_true',
+                        help='Also write one row per patient with both the CAROC and FRAX targets')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes used to parse the exports and dedupe the partitions '
+                             '(defaults to the number of cores)')
+    args = parser.parse_args()
+
     set_directory()
-    not_clean_data()
+    if args.incremental:
+        incremental_not_clean_data(args.chunk_rows or 100000)
+    elif args.chunk_rows:
+        stream_not_clean_data(args.chunk_rows)
+    else:
+        not_clean_data(args.workers)
+
+    if args.dedupe_partitions:
+        dedupe_not_clean_data(args.dedupe_partitions, args.chunk_rows or 100000, args.workers)
+
+    if args.join:
+        join_not_clean_data(args.chunk_rows, args.dedupe_partitions or 16, args.workers)
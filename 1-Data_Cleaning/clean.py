@@ -0,0 +1,88 @@
+import argparse
+import logging
+import sys
+from functools import partial
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.cleaning import pandas_backend, run_variants
+from pipeline.datasets import current_export_version
+from pipeline.dedupe import DEDUPE_POLICIES
+from pipeline.duckdb_engine import duckdb_backend
+from pipeline.instrumentation import StageRecorder
+from pipeline.parallel import parallel_backend
+from pipeline.reports import REPORT_MODES
+from pipeline.variants import VARIANTS
+
+# Use logging commands instead of print
+logging.basicConfig(level=logging.INFO)
+
+# The engines that can run the cleaning stages. duckdb runs them as queries on an embedded database, for
+# files larger than memory, and needs the duckdb package (see requirements.txt). parallel runs them on
+# partitions of the data in a process pool, with the same results as pandas.
+BACKENDS = {
+    'pandas': pandas_backend,
+    'duckdb': duckdb_backend,
+    'parallel': parallel_backend,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Clean a raw data file into the datasets of the cleaning '
+                                                 'variants, sharing the stages the variants have in common')
+    parser.add_argument('file_name', help='The raw data file, e.g. ../0-Merging_Raw_Data/merging_results/Raw_Not_Cleaned_Data.csv')
+    parser.add_argument('variants', nargs='*', default=list(VARIANTS),
+                        help=f'The variants to build, of {", ".join(VARIANTS)} '
+                             f'(defaults to every variant the file has the columns for)')
+    parser.add_argument('--reports', choices=REPORT_MODES, default='background',
+                        help='Make the sweetviz reports in a process pool while cleaning (background), between the '
+                             'cleaning stages (inline), or not at all (skip, for production runs)')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='pandas',
+                        help='Run the cleaning stages on pandas frames, as DuckDB queries, or on pandas frames '
+                             'split between processes (parallel)')
+    parser.add_argument('--workers', type=int,
+                        help='The processes of the parallel backend or the threads of the duckdb backend '
+                             '(defaults to one per core)')
+    parser.add_argument('--dedupe', choices=DEDUPE_POLICIES, default='first',
+                        help='Which row of a patient with several baselines to keep: the first in the file, the '
+                             'latest or earliest BaselineDateSurveyed, or the one with the most answers')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='Take the rows with implausible heights, weights, ages or T-scores out of the cleaned '
+                             'data and save them in <output>.quarantine.parquet with their reasons')
+    parser.add_argument('--knn', action='store_true',
+                        help='Fill the missing T-scores, heights and weights from the 5 most similar patients before '
+                             'the imputation, saving the neighbours in <output>.knn.pkl to fill new records the '
+                             'same way (pandas backend only, needs scipy)')
+    parser.add_argument('--parquet', action='store_true',
+                        help='Also save the cleaned data as a Parquet dataset split by export version and gender, '
+                             '<output>.parquet/, which the model scripts read instead of the CSV')
+    parser.add_argument('--export-version',
+                        help='The export version of the Parquet data (defaults to the version of the FSPP data '
+                             'dictionaries, see pipeline/dictionary.py)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record the time, rows and memory of every stage in <output>.stages.json')
+    parser.add_argument('--trace', help='Also save the stages of the whole run as a Chrome trace to this file')
+    parser.add_argument('--memory-audit', action='store_true',
+                        help='Record the stages as with --profile, with the bytes every stage copies, and log '
+                             'the copies against the size of the loaded data')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.variants if name not in VARIANTS]
+    if unknown:
+        parser.error(f'unknown variant {", ".join(unknown)}')
+    if args.workers is not None and args.backend == 'pandas':
+        parser.error('--workers needs the parallel or duckdb backend')
+
+    recorder = None
+    if args.profile or args.trace or args.memory_audit:
+        recorder = StageRecorder(audit_memory=args.memory_audit)
+    try:
+        options = {'workers': args.workers} if args.workers is not None else {}
+        backend = partial(BACKENDS[args.backend], validate=args.quarantine, knn=args.knn,
+                          dedupe=args.dedupe, **options)
+        export_version = (args.export_version or current_export_version()) if args.parquet else None
+        run_variants(args.variants, args.file_name, args.reports, backend, recorder, export_version)
+        if args.trace:
+            recorder.save_trace(args.trace)
+    except ValueError as er:
+        logging.error(str(er))
@@ -7,6 +7,11 @@ import matplotlib.pyplot as plt
 import pandas as pd
 # Load it
 import sweetviz as sv
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.datasets import read_cleaned
 
 logging.basicConfig(level=logging.INFO)
 
@@ -170,7 +175,7 @@ def gender_report(data):
 
 def perform_data_analysis(path):
     # Load the data from the CSV file and select the features
-    data = pd.read_csv(path)
+    data = read_cleaned(path)
     features = list(data.columns.values)
 
     create_description_from_data_frame(data)
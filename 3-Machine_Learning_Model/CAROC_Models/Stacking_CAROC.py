@@ -21,6 +21,11 @@ from yellowbrick.classifier import ROCAUC
 from yellowbrick.model_selection import FeatureImportances
 
 import warnings
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from pipeline.datasets import read_cleaned
 
 
 def set_directory():
@@ -109,7 +114,7 @@ def plot_high_probability_to_tscore(y_prob, tscore, gender, name):
 def build_run_and_plot(path, name):
 
     # read data
-    data = pd.read_csv(path)
+    data = read_cleaned(path)
 
     # choose features
     columns = ['PatientAge', 'PatientGender', 'bmdtest_height', 'bmdtest_weight',
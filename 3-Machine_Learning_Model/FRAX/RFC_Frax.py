@@ -22,6 +22,11 @@ import shap
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from pipeline.datasets import read_cleaned
+from pipeline.frax import risk_level_dtypes
+
 '''
 This script was created to be used with datasets that use the FRAX Risk Assessment tool that can be found here:
 https://www.sheffield.ac.uk/FRAX/tool.aspx?country=19 it only uses the features in our local dataset 
@@ -29,7 +34,8 @@ https://www.sheffield.ac.uk/FRAX/tool.aspx?country=19 it only uses the features
 
 
 def setup_data(path):
-    dataset = pd.read_csv(path)
+    # The risk levels are parsed straight into ordered categoricals rather than Python strings
+    dataset = read_cleaned(path, dtype=risk_level_dtypes())
 
     missing = pd.DataFrame(dataset.isnull().sum(), columns=['Total'])
     missing['%'] = (missing['Total'] / dataset.shape[0]) * 100
@@ -13,6 +13,11 @@ from pycaret.regression import *
 from pycaret.utils import check_metric
 from sklearn.inspection import permutation_importance
 from sklearn.metrics import mean_squared_error, make_scorer
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.datasets import read_cleaned
 
 
 def set_directory():
@@ -37,7 +42,7 @@ def set_directory():
 
 
 def setup_data(path):
-    dataset = pd.read_csv(path)
+    dataset = read_cleaned(path)
 
     missing = pd.DataFrame(dataset.isnull().sum(), columns=['Total'])
     missing['%'] = (missing['Total'] / dataset.shape[0]) * 100
@@ -15,10 +15,16 @@ from sklearn.metrics import make_scorer, mean_squared_error
 import shap
 import matplotlib.pyplot as plt
 from sklearn.inspection import permutation_importance
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from pipeline.datasets import read_cleaned
+from pipeline.flags import FLAGS_COLUMN, match_flags
 
 
 def setup_data(path):
-    dataset = pd.read_csv(path)
+    dataset = read_cleaned(path)
 
     missing = pd.DataFrame(dataset.isnull().sum(), columns=['Total'])
     missing['%'] = (missing['Total'] / dataset.shape[0]) * 100
@@ -47,7 +53,8 @@ def setup_data(path):
     # Drop the PatientID column as it is no longer needed
     # dataset.drop(['PatientId'], axis=1, inplace=True)
 
-    dataset.drop(dataset.index[dataset['ankle'] == 1], inplace=True)
+    # Drop the patients with an ankle fracture, one mask test on the packed flags (see pipeline/flags.py)
+    dataset.drop(dataset.index[match_flags(dataset[FLAGS_COLUMN], any_of=['ankle'])], inplace=True)
 
     print('Number of rows in the dataset after the rows with ankle were removed: {}.\n{} rows were removed.'
           .format(dataset.shape[0], size - dataset.shape[0]))
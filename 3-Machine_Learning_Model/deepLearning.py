@@ -14,6 +14,11 @@ from keras.wrappers.scikit_learn import KerasRegressor
 from sklearn import metrics
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.datasets import read_cleaned
 
 
 def set_directory():
@@ -48,7 +53,7 @@ def perform_deep_learning(path):
 
     try:
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
+        data = read_cleaned(path)
         features = list(data.columns.values)
         features.remove('bmdtest_tscore_fn')
         d = len(features)
@@ -16,6 +16,11 @@ from yellowbrick.classifier import ClassPredictionError, ConfusionMatrix, Classi
 from yellowbrick.model_selection import FeatureImportances
 import shap
 
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from pipeline.datasets import read_cleaned
+from pipeline.frax import risk_level_dtypes
+
 '''This code was used to load a saved model that has already been trained 
     and execute predictions on new data in the remote dataset.'''
 
@@ -33,7 +38,8 @@ def set_directory():
 
 
 def setup_data(path):
-    dataset = pd.read_csv(path)
+    # The risk levels are parsed straight into ordered categoricals rather than Python strings
+    dataset = read_cleaned(path, dtype=risk_level_dtypes())
 
     missing = pd.DataFrame(dataset.isnull().sum(), columns=['Total'])
     missing['%'] = (missing['Total'] / dataset.shape[0]) * 100
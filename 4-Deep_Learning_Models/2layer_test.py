@@ -21,6 +21,11 @@ from numpy.random import seed
 import io
 from sklearn.inspection import permutation_importance
 from sklearn.metrics import mean_squared_error, make_scorer
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.datasets import read_cleaned
 
 
 def set_directory():
@@ -72,11 +77,11 @@ def perform_deep_learning_control(path):
         initializer = tf.keras.initializers.RandomNormal(mean=0., stddev=1., seed=1)
 
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
-
-        # Ensure that all columns have a numerical value and drop any empty rows
         a = ['bmdtest_tscore_fn', 'PatientAge', "PatientGender", 'bmdtest_weight', 'bmdtest_height', "shoulder",
              "wrist", "heartdisease", "diabetes", "arthritis", "respdisease", "smoke"]
+        data = read_cleaned(path, columns=a)
+
+        # Ensure that all columns have a numerical value and drop any empty rows
         values = data[a]
         values = values.dropna()
         values = values.apply(pd.to_numeric, errors='coerce').dropna()
@@ -194,12 +199,12 @@ def perform_deep_learning_wrist(path):
         initializer = tf.keras.initializers.RandomNormal(mean=0., stddev=1., seed=1)
 
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
+        a = ['bmdtest_tscore_fn', 'PatientAge', "PatientGender", 'bmdtest_weight', 'bmdtest_height', "heartdisease",
+             "diabetes", "arthritis", "respdisease", "smoke"]
+        data = read_cleaned(path, columns=[*a, "wrist"])
         data = data[data["wrist"] == 1]
 
         # Ensure that all columns have a numerical value and drop any empty rows
-        a = ['bmdtest_tscore_fn', 'PatientAge', "PatientGender", 'bmdtest_weight', 'bmdtest_height', "heartdisease",
-             "diabetes", "arthritis", "respdisease", "smoke"]
         values = data[a]
         values = values.dropna()
         values = values.apply(pd.to_numeric, errors='coerce').dropna()
@@ -316,11 +321,10 @@ def perform_deep_learning_shoulder(path):
         initializer = tf.keras.initializers.RandomNormal(mean=0., stddev=1., seed=1)
 
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
-        data = data[data["shoulder"] == 1]
-
         a = ['bmdtest_tscore_fn', 'PatientAge', "PatientGender", 'bmdtest_weight', 'bmdtest_height', "heartdisease",
              "diabetes", "arthritis", "respdisease", "smoke"]
+        data = read_cleaned(path, columns=[*a, "shoulder"])
+        data = data[data["shoulder"] == 1]
         values = data[a]
         values = values.dropna()
         values = values.apply(pd.to_numeric, errors='coerce').dropna()
@@ -435,12 +439,10 @@ def perform_deep_learning_male(path):
         initializer = tf.keras.initializers.RandomNormal(mean=0., stddev=1., seed=1)
 
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
-        features = list(data.columns.values)
-        data = data[data["PatientGender"] == 2]
-
         a = ['bmdtest_tscore_fn', 'PatientAge', 'bmdtest_weight', 'bmdtest_height', "shoulder", "wrist", "heartdisease",
              "diabetes", "arthritis", "respdisease", "smoke"]
+        data = read_cleaned(path, columns=a, genders=[2])
+        features = list(data.columns.values)
         values = data[a]
         values = values.dropna()
         values = values.apply(pd.to_numeric, errors='coerce').dropna()
@@ -557,11 +559,9 @@ def perform_deep_learning_female(path):
         initializer = tf.keras.initializers.RandomNormal(mean=0., stddev=1., seed=1)
 
         # Load the data from the CSV file and select the features
-        data = pd.read_csv(path)
-        data = data[data["PatientGender"] == 1]
-
         a = ['bmdtest_tscore_fn', 'PatientAge', 'bmdtest_weight', 'bmdtest_height', "shoulder", "wrist", "heartdisease",
              "diabetes", "arthritis", "respdisease", "smoke"]
+        data = read_cleaned(path, columns=a, genders=[1])
         values = data[a]
         values = values.dropna()
         values = values.apply(pd.to_numeric, errors='coerce').dropna()
@@ -22,6 +22,11 @@ from sklearn.metrics import roc_curve
 from sklearn.metrics import confusion_matrix
 import shap
 import seaborn as sns
+from pathlib import Path
+
+# Make the shared pipeline package importable when the script is run from its own folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.datasets import read_cleaned
 
 print(tf.__version__)
 
@@ -168,7 +173,7 @@ if __name__ == "__main__":
         set_directory()
 
         # Get the Data
-        data = pd.read_csv(file_name)
+        data = read_cleaned(file_name)
 
         # One-hot Encode the Data
         data = encode_cat_data(data, ['parentbreak', 'alcohol',
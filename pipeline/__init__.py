@@ -0,0 +1,3 @@
+# Shared data pipeline helpers used by the merging, cleaning and modelling scripts.
+# The stage folders are run as plain scripts, so each script adds the repository root to sys.path
+# before importing from this package.
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+
+# fcntl is POSIX only, elsewhere the digest index is updated without a lock
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# pyarrow is optional, without it every read falls back to the CSV parser
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:
+    pa = None
+    feather = None
+
+# Cached copies live outside the stage folders so every stage shares them
+CACHE_DIR = Path(os.environ.get('OSTEOPOROSIS_CACHE_DIR',
+                                Path(__file__).resolve().parents[1] / '.cache' / 'columnar'))
+
+# Remembers the digest of a file for a given (size, mtime) so unchanged files are not re-hashed
+DIGEST_INDEX = 'digests.json'
+
+# Held while the index is updated, so processes reading files at the same time do not drop each other's digests
+INDEX_LOCK = 'digests.lock'
+
+
+# SHA-256 of the file content, read in blocks so large exports are never held in memory
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_index():
+    try:
+        with open(CACHE_DIR / DIGEST_INDEX) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _index_lock():
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(CACHE_DIR / INDEX_LOCK, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _save_index(index):
+    tmp_path = CACHE_DIR / f'{DIGEST_INDEX}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(tmp_path, CACHE_DIR / DIGEST_INDEX)
+
+
+# Content digest of the file, reusing the stored digest when size and mtime have not changed.
+# The file is hashed outside the lock, the index is re-read under it so other processes' entries are kept.
+def content_digest(path):
+    path = Path(path).resolve()
+    stat = path.stat()
+    stamp = [stat.st_size, stat.st_mtime_ns]
+
+    index = _load_index()
+    entry = index.get(str(path))
+    if entry and entry['stamp'] == stamp:
+        return entry['digest']
+
+    digest = file_digest(path)
+    with _index_lock():
+        index = _load_index()
+        index[str(path)] = {'stamp': stamp, 'digest': digest}
+        _save_index(index)
+    return digest
+
+
+# The cache key covers the file content and the read options, since usecols or dtype change the result.
+# Options that are not JSON go in by repr, so e.g. categorical dtypes with different categories get their own key.
+def cache_key(path, read_kwargs):
+    options = json.dumps(read_kwargs, sort_keys=True, default=repr)
+    options_digest = hashlib.sha256(options.encode()).hexdigest()[:16]
+    return f'{content_digest(path)}-{options_digest}'
+
+
+# Drop-in replacement for pd.read_csv. The first read of a file writes a typed, uncompressed Feather copy
+# keyed by the content hash; later reads load that copy instead of running the CSV parser. The copy is
+# memory-mapped, so the frame to_pandas builds from it is the only copy in memory, but it is still a copy:
+# the columns with missing values, most of them, cannot be used in place.
+def read_csv_cached(path, **read_kwargs):
+    if feather is None:
+        return pd.read_csv(path, **read_kwargs)
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cached_path = CACHE_DIR / f'{cache_key(path, read_kwargs)}.feather'
+
+    if cached_path.exists():
+        logging.info(f'Reading {path} from cache {cached_path.name}')
+        return feather.read_table(cached_path, memory_map=True).to_pandas()
+
+    data = pd.read_csv(path, **read_kwargs)
+    tmp_path = cached_path.with_name(f'{cached_path.name}.{os.getpid()}.tmp')
+    try:
+        feather.write_feather(data, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, cached_path)
+        logging.info(f'Cached {path} as {cached_path.name}')
+    except (pa.ArrowException, ValueError) as er:
+        # Mixed-type object columns or a custom index cannot be stored, the frame is still returned uncached
+        tmp_path.unlink(missing_ok=True)
+        logging.warning(f'Unable to cache {path}: {er}')
+    return data
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# CAROC 10 year fracture risk levels
+LOW = 0
+MODERATE = 1
+HIGH = 2
+
+# Lower edges of the age bands after the first: under 60, 60 - 64, ..., 80 - 84 and 85 and over
+CAROC_AGE_EDGES = [60, 65, 70, 75, 80, 85]
+
+# The femoral neck T-score limits of each age band, for women (PatientGender 1) and for men.
+# Above the high limit the risk is low, above the low limit it is moderate, otherwise it is high.
+CAROC_HIGH_LIMITS = {
+    'female': [-2.5, -2.3, -1.9, -1.7, -1.2, -0.5, 0.1],
+    'male': [-2.5, -2.5, -2.4, -2.3, -2.3, -2.1, -2.0],
+}
+CAROC_LOW_LIMITS = {
+    'female': [-3.8, -3.7, -3.5, -3.2, -2.9, -2.6, -2.2],
+    'male': [-3.9, -3.7, -3.7, -3.7, -3.8, -3.8, -3.8],
+}
+
+# A fragility fracture at one of these sites moves the risk up one level
+BUMP_FRACTURE_SITES = ['ankle', 'clavicle', 'elbow', 'femur', 'wrist', 'shoulder', 'tibfib']
+
+# A hip or spine fracture makes the risk high
+HIGH_FRACTURE_SITES = ['hip', 'spine']
+
+
+def _as_array(values, length):
+    if values is None:
+        return np.zeros(length)
+    return np.asarray(values)
+
+
+# The basal CAROC risk from age, gender and T-score, as float codes with NaN where the T-score is missing.
+# The limits are compared in the dtype of the T-scores, the same way the per-row version compared them.
+def basal_risk(age, gender, tscore):
+    age = np.asarray(age)
+    tscore = np.asarray(tscore)
+    if not np.issubdtype(tscore.dtype, np.floating):
+        tscore = tscore.astype('float64')
+
+    # Missing ages fall in the last band, like they did in the per-row version
+    band = np.searchsorted(CAROC_AGE_EDGES, age, side='right')
+    female = np.asarray(gender) == 1
+
+    high = np.where(female, np.array(CAROC_HIGH_LIMITS['female'], dtype=tscore.dtype)[band],
+                    np.array(CAROC_HIGH_LIMITS['male'], dtype=tscore.dtype)[band])
+    low = np.where(female, np.array(CAROC_LOW_LIMITS['female'], dtype=tscore.dtype)[band],
+                   np.array(CAROC_LOW_LIMITS['male'], dtype=tscore.dtype)[band])
+
+    return np.select([tscore > high, tscore > low, tscore <= low], [LOW, MODERATE, HIGH], np.nan)
+
+
+# The CAROC risk of a batch of patients: the basal risk, one level higher for steroid use or an earlier
+# fracture, and high for a hip or spine fracture. Fractures are a {site: 0/1 values} mapping, missing
+# sites and answers count as no. The T-scores can be measured or predicted by a model.
+def caroc_risk(age, gender, tscore, oralster=None, obreak=None, fractures=None):
+    risk = basal_risk(age, gender, tscore)
+    fractures = fractures or {}
+
+    bump = (_as_array(oralster, len(risk)) == 1) | (_as_array(obreak, len(risk)) > 1)
+    for site in BUMP_FRACTURE_SITES:
+        bump |= _as_array(fractures.get(site), len(risk)) == 1
+    risk = np.where(bump & (risk < HIGH), risk + 1, risk)
+
+    high = np.zeros(len(risk), dtype=bool)
+    for site in HIGH_FRACTURE_SITES:
+        high |= _as_array(fractures.get(site), len(risk)) == 1
+    return np.where(high, HIGH, risk)
+
+
+# The CAROC risk of every row of a cleaned frame, from its bmdtest_tscore_fn column or from the
+# given T-scores (e.g. the predictions of a T-score regression model for the same rows)
+def caroc_labels(df, tscore=None):
+    tscore = df['bmdtest_tscore_fn'] if tscore is None else tscore
+    fractures = {site: df[site] for site in BUMP_FRACTURE_SITES + HIGH_FRACTURE_SITES if site in df}
+    risk = caroc_risk(df['PatientAge'], df['PatientGender'], tscore,
+                      df['oralster'] if 'oralster' in df else None,
+                      df['obreak'] if 'obreak' in df else None, fractures)
+    return pd.Series(risk, index=df.index)
+
+
+# Fill in the missing values of a CAROC risk column, keeping the risks the export already had
+def fill_caroc_labels(df, column='bmdtest_10yr_caroc'):
+    missing = df[column].isna()
+    filled = df[column].copy()
+    filled[missing] = caroc_labels(df[missing]).astype(filled.dtype)
+    return filled
@@ -0,0 +1,337 @@
+import hashlib
+import logging
+import os
+import pandas as pd
+from pathlib import Path
+
+from pipeline.cache import read_csv_cached
+from pipeline.caroc import fill_caroc_labels
+from pipeline.datasets import dataset_path, write_dataset
+from pipeline.flags import FLAGS_COLUMN, encode_flags, present_flags
+from pipeline.dedupe import dedupe_rows, policy_columns
+from pipeline.frax import risk_levels
+from pipeline.imputation import IMPUTER_ATTR, apply_imputer, fit_imputer, merge_imputers, save_imputer
+from pipeline.instrumentation import run_recorded
+from pipeline.knn import KNN_ATTR, KNN_COLUMNS, knn_stage, save_knn
+from pipeline.reports import ReportPool
+from pipeline.schema import projected_read_options, schema_dtypes
+from pipeline.units import bmi, to_metric
+from pipeline.validation import validate_stage
+from pipeline.variants import OUTPUT_KEYS, VARIANTS
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def variant_columns(variant):
+    return list(dict.fromkeys([*variant['id_cols'], *variant['numerical_cols'], *variant['nominal_cols'],
+                               *variant['special_nominal_cols'], *variant['target_cols']]))
+
+
+def variant_read_options(variant):
+    return projected_read_options(variant['id_cols'], variant['numerical_cols'],
+                                  variant['nominal_cols'] + variant['special_nominal_cols'],
+                                  variant['target_cols'])
+
+
+# Read options that parse the columns of all the variants, and the extra columns, in one pass
+def merge_read_options(variants, extra_cols=()):
+    usecols = []
+    dtype = {}
+    for variant in variants:
+        options = variant_read_options(variant)
+        usecols += [column for column in options['usecols'] if column not in usecols]
+        dtype.update(options['dtype'])
+        na_values = options['na_values']
+    usecols += [column for column in extra_cols if column not in usecols]
+    dtype.update(schema_dtypes(extra_cols))
+    return {'usecols': usecols, 'dtype': dtype, 'na_values': na_values}
+
+
+# Each stage takes a frame and returns a new one, the frames of earlier stages are shared between
+# variants and must not be changed. New frames are made with assign and selections, which share the
+# columns a stage leaves as they are under copy-on-write; a stage only allocates the columns it changes
+# and the rows it keeps. Run with --memory-audit to see what each stage copies.
+def load_stage(file_name, read_options):
+    return read_csv_cached(file_name, **read_options)
+
+
+# Remove the duplicates using the Patient ID, keeping the row the policy picks (see DEDUPE_POLICIES in
+# pipeline/dedupe.py). most_complete counts the answered columns of the given columns.
+def dedupe_stage(df, id_cols, policy='first', columns=()):
+    return dedupe_rows(df, id_cols, policy, columns).reset_index(drop=True)
+
+
+def metric_stage(df):
+    height, weight = to_metric(df['bmdtest_height'], df['bmdtest_weight'])
+    return df.assign(bmdtest_height=height, bmdtest_weight=weight)
+
+
+# The frame is put together from the columns one by one: df[columns] copies every column of a block
+# whose columns it reorders, where single columns are views
+def select_stage(df, columns):
+    selected = pd.DataFrame({column: df[column] for column in columns}, copy=False)
+    selected.attrs = dict(df.attrs)
+    return selected
+
+
+# The measurements of the variant filled from their nearest neighbours by the knn stage, and the columns
+# the neighbours are found on: the measurements and the yes/no answers
+def knn_columns(variant):
+    return [column for column in KNN_COLUMNS if column in variant['numerical_cols']]
+
+
+def knn_features(variant):
+    return list(dict.fromkeys([*variant['numerical_cols'], *variant['special_nominal_cols']]))
+
+
+# Fill the variant's columns with statistics computed on this data, see pipeline/imputation.py
+def impute_stage(df, steps):
+    return apply_imputer(df, fit_imputer(df, steps))
+
+
+def add_risk_levels(df, level_columns):
+    return df.assign(**{column: risk_levels(df[percentage_column])
+                        for column, percentage_column in level_columns.items()})
+
+
+# How the variants with bmi_fill fill the BMI
+BMI_STEPS = [('zero_then_mean', ['bmi'])]
+
+
+# Fill the BMIs, keeping the imputer of the earlier fills together with the BMI imputer
+def fill_bmi(df, bmi_imputer):
+    imputer = df.attrs.get(IMPUTER_ATTR)
+    df = apply_imputer(df, bmi_imputer)
+    if imputer is not None:
+        df.attrs[IMPUTER_ATTR] = merge_imputers(imputer, bmi_imputer)
+    return df
+
+
+# The risk levels, the BMI and the yes/no answers packed into FLAGS_COLUMN, for cohort selection with one
+# integer mask (see pipeline/flags.py). The answers are packed once imputed, so a missing one is a no.
+def derive_stage(df, level_columns, bmi_fill):
+    df = add_risk_levels(df, level_columns)
+    df = df.assign(bmi=bmi(df['bmdtest_height'], df['bmdtest_weight']))
+    if bmi_fill:
+        df = fill_bmi(df, fit_imputer(df, BMI_STEPS))
+    return df.assign(**{FLAGS_COLUMN: encode_flags(df, present_flags(df.columns))})
+
+
+# Fill in the missing CAROC risks from the T-score, see pipeline/caroc.py
+def caroc_label(df, target_cols):
+    for column in target_cols:
+        df = df.assign(**{column: fill_caroc_labels(df, column)})
+
+        # Drops any rows with possible misinput/miscalculation
+        df = df[df[column] != 0]
+    return df
+
+
+# How a variant fills in its targets
+LABELLERS = {
+    'caroc': caroc_label,
+}
+
+
+def label_stage(df, label, target_cols):
+    if label is None:
+        return df
+    return LABELLERS[label](df, target_cols)
+
+
+# The stages of a cleaning run after load, and their parameters. Every variant is the same chain of stages
+# (load, dedupe, metric, select, impute, derive, label, write) with its own parameters, and a stage is only
+# run once for a given input and parameters, whichever variant asks for it first. The raw file is loaded
+# once with the columns of every variant in the run, and the variant's columns are selected after dedupe
+# and metric, which do not depend on them, so those two are shared too.
+# With validate the rows with implausible values of the variant's columns are quarantined after dedupe
+# (see pipeline/validation.py); metric is then only shared by variants that check the same columns.
+# The validate stage gives the kept rows, which the next stages run on, and the quarantined rows.
+# With knn the missing measurements are filled from their nearest neighbours before the imputation
+# (see pipeline/knn.py), which then only fills what knn could not. dedupe is the policy that picks the
+# row of a patient with several; most_complete compares the variant's columns, so it is not shared.
+def variant_stages(variant, validate=False, knn=False, dedupe='first'):
+    completeness = variant_columns(variant) if dedupe == 'most_complete' else []
+    checks = [('validate', validate_stage, (variant_columns(variant),))] if validate else []
+    neighbours = [('knn', knn_stage, (knn_columns(variant), knn_features(variant)))] if knn else []
+    return [
+        ('dedupe', dedupe_stage, (variant['id_cols'], dedupe, completeness)),
+        *checks,
+        ('metric', metric_stage, ()),
+        ('select', select_stage, (variant_columns(variant),)),
+        *neighbours,
+        ('impute', impute_stage, (variant['impute'],)),
+        ('derive', derive_stage, (variant['risk_levels'], variant['bmi_fill'])),
+        ('label', label_stage, (variant['label'], variant['target_cols'])),
+    ]
+
+
+def _stage_key(previous_key, stage_name, params):
+    return hashlib.sha256(repr((previous_key, stage_name, params)).encode()).hexdigest()[:16]
+
+
+# Run a stage unless a variant already ran it on the same input with the same parameters,
+# recording it when the run has a recorder (see pipeline/instrumentation.py)
+def run_stage(cache, key, stage_name, stage, *args, recorder=None):
+    if key in cache:
+        logging.info(f'Reusing {stage_name} stage\n')
+        if recorder is not None:
+            recorder.reused(stage_name)
+    else:
+        logging.info(f'Running {stage_name} stage\n')
+        cache[key] = run_recorded(recorder, stage_name, stage, *args)
+    return cache[key]
+
+
+# The variants whose columns, and the extra columns, are all in the header of the file, logging the ones
+# that are left out
+def loadable_variants(names, file_name, header, extra_cols=()):
+    loadable = []
+    for name in names:
+        missing = [column for column in [*variant_columns(VARIANTS[name]), *extra_cols] if column not in header]
+        if missing:
+            logging.error(f'Skipping {name}, {file_name} has no {", ".join(missing)} column')
+        else:
+            loadable.append(name)
+    return loadable
+
+
+# Load the columns every variant and the dedupe policy need, leaving out the variants the file does not
+# have the columns for
+def load_variants(names, file_name, cache, recorder=None, dedupe='first'):
+    extra_cols = policy_columns(dedupe)
+    loadable = loadable_variants(names, file_name, set(pd.read_csv(file_name, nrows=0).columns), extra_cols)
+    if not loadable:
+        return loadable, None, None
+
+    read_options = merge_read_options([VARIANTS[name] for name in loadable], extra_cols)
+    stat = os.stat(file_name)
+    key = _stage_key(None, 'load', (str(Path(file_name).resolve()), stat.st_size, stat.st_mtime_ns, read_options))
+    return loadable, key, run_stage(cache, key, 'load', load_stage, file_name, read_options, recorder=recorder)
+
+
+# The cleaned frame of a variant, built on the loaded frame, and the rows its validation quarantined
+# (None without validate)
+def clean_variant(variant, df, key, cache, recorder=None, validate=False, knn=False, dedupe='first'):
+    quarantined = None
+    for stage_name, stage, params in variant_stages(variant, validate, knn, dedupe):
+        key = _stage_key(key, stage_name, params)
+        df = run_stage(cache, key, stage_name, stage, df, *params, recorder=recorder)
+        if stage_name == 'validate':
+            df, quarantined = df
+    return df, quarantined
+
+
+# Clean the named variants of one file, sharing the stages they have in common. Returns {name: frame}.
+def clean_variants(names, file_name, cache=None):
+    cache = {} if cache is None else cache
+    loadable, key, df = load_variants(names, file_name, cache)
+    return {name: clean_variant(VARIANTS[name], df, key, cache)[0] for name in loadable}
+
+
+def variant_folder(variant):
+    return ROOT / variant['folder']
+
+
+# The rows a validated run took out, as Parquet when pyarrow is installed
+def write_quarantine(quarantined, path):
+    try:
+        quarantine_path = path.with_suffix('.quarantine.parquet')
+        quarantined.to_parquet(quarantine_path, index=False)
+    except ImportError:
+        quarantine_path = path.with_suffix('.quarantine.csv')
+        quarantined.to_csv(quarantine_path, index=False)
+    logging.info(f'{len(quarantined)} quarantined rows saved to {quarantine_path}\n')
+
+
+# Write the cleaned data, and next to it the statistics it was imputed with so new records can be
+# imputed the same way (pipeline/imputation.py) and the neighbours of the knn stage (pipeline/knn.py),
+# and the rows validation took out when there are quarantined rows. With an export version
+# the data is also written as that version of a Parquet dataset, see pipeline/datasets.py.
+def write_stage(df, path, export_version=None, quarantined=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False)
+    logging.info(f'Data saved to {path}\n')
+
+    if export_version is not None:
+        write_dataset(df, dataset_path(path), export_version)
+
+    if IMPUTER_ATTR in df.attrs:
+        imputer_path = path.with_suffix('.imputer.json')
+        save_imputer(df.attrs[IMPUTER_ATTR], imputer_path)
+        logging.info(f'Imputation statistics saved to {imputer_path}\n')
+
+    if KNN_ATTR in df.attrs:
+        knn_path = path.with_suffix('.knn.pkl')
+        save_knn(df.attrs[KNN_ATTR], knn_path)
+        logging.info(f'Nearest neighbour index saved to {knn_path}\n')
+
+    if quarantined is not None:
+        write_quarantine(quarantined, path)
+
+
+# The data of a run on one file: the names of the variants the file can build, functions that give a
+# variant's columns before cleaning and its cleaned data with the rows validation quarantined, and the
+# function that writes them.
+# This one runs the stages above in pandas, see
+# pipeline/duckdb_engine.py for the same run on DuckDB. With validate the implausible rows are quarantined,
+# with knn the missing measurements are filled from their nearest neighbours, and dedupe is the policy
+# that picks the row of a returning patient.
+def pandas_backend(names, file_name, recorder=None, validate=False, knn=False, dedupe='first'):
+    cache = {}
+    loadable, key, df = load_variants(names, file_name, cache, recorder, dedupe)
+
+    def unclean(variant):
+        return add_risk_levels(select_stage(df, variant_columns(variant)), variant['risk_levels'])
+
+    def clean(variant):
+        return clean_variant(variant, df, key, cache, recorder, validate, knn, dedupe)
+
+    return loadable, unclean, clean, write_stage
+
+
+# The cleaned data as a frame, for the reports. The duckdb backend cleans into a query (see CleanedQuery in
+# pipeline/duckdb_engine.py), whose rows are only fetched here.
+def cleaned_frame(cleaned):
+    return cleaned if isinstance(cleaned, pd.DataFrame) else cleaned.df()
+
+
+# Build the named variants from one raw file: the cleaned CSVs and the reports on the data before and
+# after cleaning, made as set by reports (see REPORT_MODES in pipeline/reports.py). With a recorder the
+# records of each variant's stages are saved next to its output as <output>.stages.json, with an export
+# version the cleaned data is also saved as Parquet. outputs replaces the folder, output and report_dir of
+# the variants, for the scripts that wrote their copy of a variant somewhere else. A variant that fails is
+# logged and the others are still built.
+def run_variants(names, file_name, reports='background', backend=pandas_backend, recorder=None,
+                 export_version=None, outputs=None):
+    unknown = [key for key in outputs or {} if key not in OUTPUT_KEYS]
+    if unknown:
+        raise ValueError(f'Unknown output setting {", ".join(unknown)}, expected one of {", ".join(OUTPUT_KEYS)}')
+    with ReportPool(reports) as report_pool:
+        loadable, unclean, clean, write = backend(names, file_name, recorder)
+
+        for name in loadable:
+            variant = {**VARIANTS[name], **(outputs or {})}
+            logging.info(f'Cleaning {name}\n')
+            if recorder is not None:
+                recorder.start_variant(name)
+            try:
+                if variant['report_dir'] is not None:
+                    logging.info(f'Performing analysis on the unclean data\n')
+                    report_pool.submit(unclean(variant),
+                                       variant_folder(variant) / variant['report_dir'] / 'pre_cleaning_results',
+                                       'pre_analysis')
+
+                output = variant_folder(variant) / variant['output']
+                cleaned, quarantined = clean(variant)
+                run_recorded(recorder, 'write', write, cleaned, output, export_version, quarantined)
+                if recorder is not None:
+                    recorder.save(output.with_suffix('.stages.json'), recorder.variant_records(name))
+
+                if variant['report_dir'] is not None:
+                    logging.info('Performing Analysis on all the Data\n')
+                    report_pool.submit(cleaned_frame(cleaned),
+                                       variant_folder(variant) / variant['report_dir'] / 'analysis_results',
+                                       'analysis')
+            except ValueError as er:
+                logging.error(f'{name}: {er}')
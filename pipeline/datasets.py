@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from pathlib import Path
+
+from pipeline.cache import read_csv_cached
+from pipeline.dictionary import load_schema
+from pipeline.flags import FLAGS_COLUMN, encode_flags, present_flags
+
+# pyarrow is optional, without it the cleaned data is only written and read as CSV
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+# The cleaned data of a variant is also written as a Parquet dataset, a folder next to its CSV
+# (Clean_Data_Main.csv -> Clean_Data_Main.parquet/), split into one folder per export version and gender:
+#   Clean_Data_Main.parquet/export_version=<version>/PatientGender=1/part-0.parquet
+# so a model trained on one gender only reads the files of that gender. The export version is the version
+# of the FSPP data dictionaries the raw export was read with (see pipeline/dictionary.py), so a run on
+# exports of a new survey version adds a version rather than replacing the data of the old one.
+VERSION_COLUMN = 'export_version'
+GENDER_COLUMN = 'PatientGender'
+PARTITION_COLUMNS = [VERSION_COLUMN, GENDER_COLUMN]
+
+# The position of every row in the cleaned frame, so the rows are read back in the order of the CSV,
+# which the seeded train/test splits of the model scripts depend on
+ROW_COLUMN = '_row'
+
+# zstd makes the files several times smaller than the CSVs and is about as fast to read as no compression
+COMPRESSION = 'zstd'
+
+# The schema of every file keeps the dtypes of the columns, categorical risk levels included, as pandas
+# metadata. The columns in their order and the dtypes of the partition columns, which are folder names
+# rather than values in the files, are kept under this key.
+METADATA_KEY = b'osteoporosis'
+
+
+def dataset_path(csv_path):
+    return Path(csv_path).with_suffix('.parquet')
+
+
+# The export version of the data a cleaning run reads now
+def current_export_version():
+    return load_schema()['version']
+
+
+def _partitioning(gender_type):
+    return ds.partitioning(pa.schema([(VERSION_COLUMN, pa.string()), (GENDER_COLUMN, gender_type)]),
+                           flavor='hive')
+
+
+# Write the cleaned frame as the given export version of the dataset at path, replacing that version
+# only. The files are written to a temporary folder first, so readers never see half a version.
+def write_dataset(df, path, version):
+    if pa is None:
+        raise ValueError('Parquet output needs the pyarrow package, install it with pip install pyarrow')
+    path = Path(path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {'columns': list(df.columns), 'dtypes': {GENDER_COLUMN: str(df[GENDER_COLUMN].dtype)}}
+    table = table.replace_schema_metadata({**table.schema.metadata, METADATA_KEY: json.dumps(metadata).encode()})
+    table = table.append_column(ROW_COLUMN, pa.array(np.arange(len(df), dtype='int64')))
+    table = table.append_column(VERSION_COLUMN, pa.array([version] * len(df), pa.string()))
+
+    path.mkdir(parents=True, exist_ok=True)
+    tmp_dir = path / f'.{os.getpid()}.tmp'
+    version_dir = path / f'{VERSION_COLUMN}={version}'
+    try:
+        ds.write_dataset(table, tmp_dir, format='parquet',
+                         partitioning=_partitioning(table.schema.field(GENDER_COLUMN).type),
+                         file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION),
+                         basename_template='part-{i}.parquet')
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.replace(tmp_dir / version_dir.name, version_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logging.info(f'Data saved to {version_dir}\n')
+
+
+def dataset_versions(path):
+    return sorted(folder.name.split('=', 1)[1] for folder in Path(path).glob(f'{VERSION_COLUMN}=*'))
+
+
+# The version read when none is asked for: the only one, or the one a cleaning run would write now
+def _default_version(path):
+    versions = dataset_versions(path)
+    if len(versions) == 1:
+        return versions[0]
+    current = current_export_version()
+    if current not in versions:
+        raise ValueError(f'{path} has export versions {", ".join(versions) or "none"}, pick one of them')
+    return current
+
+
+# Read the given columns (all by default) of the given genders (all by default) of one export version.
+# Only the files of those genders are opened, and only the columns asked for are read from them.
+def read_dataset(path, columns=None, genders=None, version=None):
+    if ds is None:
+        raise ValueError('Reading Parquet needs the pyarrow package, install it with pip install pyarrow')
+    version = version or _default_version(path)
+    version_dir = Path(path) / f'{VERSION_COLUMN}={version}'
+    files = sorted(str(file) for file in version_dir.glob('*/*.parquet'))
+    if not files:
+        raise ValueError(f'{path} has no data for export version {version}')
+
+    schema = ds.dataset(files[0], format='parquet').schema
+    metadata = json.loads(schema.metadata[METADATA_KEY])
+    gender_type = pa.from_numpy_dtype(metadata['dtypes'][GENDER_COLUMN])
+    dataset = ds.dataset(files, format='parquet', partitioning=_partitioning(gender_type),
+                         partition_base_dir=str(path))
+
+    columns = list(columns) if columns is not None else metadata['columns']
+    row_filter = ds.field(GENDER_COLUMN).isin(pa.array(genders, gender_type)) if genders is not None else None
+    table = dataset.to_table(columns=[*columns, ROW_COLUMN], filter=row_filter)
+    return table.sort_by(ROW_COLUMN).drop_columns([ROW_COLUMN]).to_pandas()
+
+
+# Read a cleaned dataset for a model: the Parquet dataset next to the CSV when there is one, otherwise the CSV
+# (through the columnar cache) with the same columns and genders. read_kwargs only apply to the CSV.
+# Data cleaned before the flags were packed gets its FLAGS_COLUMN from the flag columns.
+def read_cleaned(csv_path, columns=None, genders=None, **read_kwargs):
+    parquet_path = dataset_path(csv_path)
+    if ds is not None and parquet_path.is_dir() and dataset_versions(parquet_path):
+        logging.info(f'Reading {parquet_path}')
+        data = read_dataset(parquet_path, columns, genders)
+    else:
+        if columns is not None:
+            read_kwargs['usecols'] = list(dict.fromkeys([*columns, *([GENDER_COLUMN] if genders is not None else [])]))
+        data = read_csv_cached(csv_path, **read_kwargs)
+        if genders is not None:
+            data = data[data[GENDER_COLUMN].isin(genders)].reset_index(drop=True)
+        if columns is not None:
+            data = data[list(columns)]
+    if columns is None and FLAGS_COLUMN not in data:
+        data = data.assign(**{FLAGS_COLUMN: encode_flags(data, present_flags(data.columns))})
+    return data
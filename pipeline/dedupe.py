@@ -0,0 +1,141 @@
+import csv
+import heapq
+import logging
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pipeline.ingestion import XLSX_DATE_FORMAT, iter_csv_chunks, peak_rss_mb, read_header
+
+# Position of each row in the input, carried through the buckets so the output keeps the input order
+ROW_COLUMN = '_row'
+
+# Which of a patient's rows is kept. Patients who come back have a baseline for every visit.
+#   first          the first row in file order, as drop_duplicates keeps
+#   latest         the baseline with the latest BaselineDateSurveyed
+#   earliest       the baseline with the earliest BaselineDateSurveyed
+#   most_complete  the row with the most answered columns
+# Rows without a date lose to the rows with one, and ties go to the first row in file order.
+DEDUPE_POLICIES = ['first', 'latest', 'earliest', 'most_complete']
+DATE_POLICIES = ['latest', 'earliest']
+DATE_COLUMN = 'BaselineDateSurveyed'
+
+
+# The columns a policy reads besides the id columns
+def policy_columns(policy):
+    return [DATE_COLUMN] if policy in DATE_POLICIES else []
+
+
+# The survey dates as nanoseconds, the lowest value for missing or unreadable dates. A file holds a few
+# thousand distinct dates, so each is parsed once and mapped onto the rows.
+def date_ranks(dates):
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=XLSX_DATE_FORMAT, errors='coerce')
+    values = np.where(parsed.isna(), np.iinfo('int64').min, parsed.to_numpy(dtype='datetime64[ns]').view('int64'))
+    return np.where(codes < 0, np.iinfo('int64').min, values[codes])
+
+
+# How good each row is under the policy, higher is better
+def policy_scores(df, policy, columns):
+    if policy == 'latest':
+        return date_ranks(df[DATE_COLUMN])
+    if policy == 'earliest':
+        ranks = date_ranks(df[DATE_COLUMN])
+        return np.where(ranks == np.iinfo('int64').min, ranks, -ranks)
+    return df[list(columns)].notna().sum(axis=1).to_numpy()
+
+
+# The best row of every patient under the policy, in file order and with the index of the frame.
+# The rows are grouped on a hash of the id columns and the best row of each group is found with one
+# groupby idxmax, which keeps the first row of a tie, so the work grows with the rows rather than
+# with a sort of them.
+def dedupe_rows(df, id_cols, policy='first', columns=()):
+    if policy not in DEDUPE_POLICIES:
+        raise ValueError(f'Unknown dedupe policy {policy}, use one of {", ".join(DEDUPE_POLICIES)}')
+    if policy == 'first':
+        return df.drop_duplicates(subset=id_cols)
+    missing = [column for column in policy_columns(policy) if column not in df]
+    if missing:
+        raise ValueError(f'The {policy} dedupe policy needs the {", ".join(missing)} column')
+
+    scores = pd.Series(policy_scores(df, policy, columns))
+    best = scores.groupby([df[column].to_numpy() for column in id_cols], sort=False, dropna=False).idxmax()
+    keep = np.zeros(len(df), dtype=bool)
+    keep[best.to_numpy()] = True
+    return df[keep]
+
+
+def bucket_file_path(bucket_dir, bucket):
+    return Path(bucket_dir) / f'bucket-{bucket:04d}.csv'
+
+
+# Split the input into buckets on disk by a hash of the key, so every row of a patient lands in the same bucket.
+# pd.util.hash_pandas_object is deterministic, so the split is the same on every run and in every process.
+def partition_by_key(in_path, bucket_dir, partitions, chunk_rows, key='PatientId'):
+    columns = [ROW_COLUMN, *read_header(in_path)]
+    bucket_files = [open(bucket_file_path(bucket_dir, bucket), 'w', newline='') for bucket in range(partitions)]
+    try:
+        for bucket_file in bucket_files:
+            pd.DataFrame(columns=columns).to_csv(bucket_file, index=False)
+
+        row = 0
+        for chunk in iter_csv_chunks(in_path, chunk_rows):
+            chunk.insert(0, ROW_COLUMN, range(row, row + len(chunk)))
+            row += len(chunk)
+            buckets = pd.util.hash_pandas_object(chunk[key], index=False) % partitions
+            for bucket, rows in chunk.groupby(buckets.to_numpy(), sort=False):
+                rows.to_csv(bucket_files[bucket], index=False, header=False)
+    finally:
+        for bucket_file in bucket_files:
+            bucket_file.close()
+    return row
+
+
+# Keep the first row of every key in one bucket. Rows were appended in input order, so "first" here is
+# the same row drop_duplicates would keep on the whole frame.
+def dedupe_bucket(bucket_path, key='PatientId'):
+    rows = pd.read_csv(bucket_path, dtype=str, keep_default_na=False)
+    rows = rows.drop_duplicates(subset=[key], keep='first')
+    rows.to_csv(bucket_path, index=False)
+    return len(rows)
+
+
+def _iter_bucket_rows(bucket_path):
+    with open(bucket_path, newline='') as bucket_file:
+        reader = csv.reader(bucket_file)
+        next(reader)
+        for row in reader:
+            yield int(row[0]), row[1:]
+
+
+# Out-of-core equivalent of df.drop_duplicates(subset=[key]) for files that do not fit in memory.
+# The input is hash-partitioned on the key into on-disk buckets, each bucket is deduplicated on its own
+# in a process pool, and the buckets are merged back on the original row position, which gives exactly
+# the rows, and the order, of the in-memory path.
+def dedupe_out_of_core(in_path, out_path, partitions=16, chunk_rows=100000, max_workers=None, key='PatientId'):
+    header = read_header(in_path)
+    bucket_root = Path(out_path).resolve().parent
+
+    with tempfile.TemporaryDirectory(prefix='dedupe-', dir=bucket_root) as bucket_dir:
+        rows_in = partition_by_key(in_path, bucket_dir, partitions, chunk_rows, key)
+        bucket_paths = [bucket_file_path(bucket_dir, bucket) for bucket in range(partitions)]
+
+        max_workers = min(max_workers or os.cpu_count() or 1, partitions)
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                rows_out = sum(executor.map(dedupe_bucket, bucket_paths, [key] * partitions))
+        else:
+            rows_out = sum(dedupe_bucket(bucket_path, key) for bucket_path in bucket_paths)
+
+        with open(out_path, 'w', newline='') as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(header)
+            for _, row in heapq.merge(*[_iter_bucket_rows(path) for path in bucket_paths], key=lambda item: item[0]):
+                writer.writerow(row)
+
+    logging.info(f'Removed {rows_in - rows_out} duplicate rows on {key}, {rows_out} rows written to {out_path} '
+                 f'(peak RSS {peak_rss_mb():.1f} MB)')
+    return rows_out
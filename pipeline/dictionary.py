@@ -0,0 +1,284 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import pandas as pd
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# The FSPP data dictionaries the schema is compiled from, one per survey version
+DICTIONARIES = {
+    'V3': ROOT / 'Onboard' / 'Columns_FSPP3DataDictionary_Rev1_2021-04-06.xlsx',
+    'V4': ROOT / 'Onboard' / 'Columns_FSPP4VariableMapping_2021-03-12.xlsx',
+}
+
+# The compiled schema, committed next to this module so readers do not need the workbooks
+SCHEMA_PATH = Path(__file__).resolve().parent / 'fspp_schema.json'
+
+# Bump when the layout of the compiled schema changes
+SCHEMA_FORMAT = 1
+
+# The exports write missing answers as empty cells or as the literal NULL. This is a convention of the
+# exports, the dictionaries only list the coded answers (their NumValue is NULL for answers without a code).
+NA_VALUES = ['', 'NULL']
+
+# Question types that are answered with one of the listed codes
+CODE_TYPES = ['RADIOBUTTONS', 'MULTISELECT', 'DROPDOWNLIST']
+
+# Survey answers and measurements are parsed as float32, see the note in pipeline/schema.py
+# Ids are nullable Int32 so an export with a blank id still parses, the blank is kept as missing.
+KIND_DTYPES = {
+    'id': 'Int32',
+    'numeric': 'float32',
+    'code': 'float32',
+    'label': 'str',
+    'date': 'str',
+    'text': 'str',
+}
+
+# Columns described on the OtherVariables sheet. The sheet only documents them in prose,
+# so their kinds and codes are spelled out here.
+OTHER_VARIABLES = {
+    'BaselineId': ('id', []),
+    'PatientId': ('id', []),
+    'BMDDataCollectionFormId': ('id', []),
+    # Age is mean imputed by the cleaning scripts, so it needs a float dtype to hold NaN
+    'PatientAge': ('numeric', []),
+    'PatientGender': ('code', [1, 2, 3]),
+    'BaselineDateSurveyed': ('date', []),
+    'BMDDateSurveyed': ('date', []),
+    'FraxRiskPercentage': ('numeric', []),
+    'FraxRiskLevel': ('label', ['Low', 'Moderate', 'High']),
+    'CarocBasalRiskLevel': ('label', ['Low', 'Moderate', 'High']),
+    'CarocWithCF': ('label', ['Moderate', 'High']),
+    'CarocWithSQ': ('label', ['Moderate', 'High']),
+}
+
+# Child task flags are 1 (fired) or 2 (refused), parent checklist items are 1 (yes) or 0 (no)
+TASK_CODES = {'Chld_': [1, 2], 'Prnt_': [0, 1]}
+
+# The column of a multiselect response holds its code when the response is ticked and 0 (or nothing) when not
+UNTICKED_CODE = 0
+
+# V3 columns whose question was kept in V4 under a new column name, read under the V4 name so the exports
+# of both versions merge into one column. Each pair was checked by hand against the two dictionaries: the
+# question and response text are the same. Differences:
+#   nodo            V4 dropped the "Other" answer (4), V3 exports can still hold it
+#   othedumats_3    "Fact Sheets" was an answer of "Other Education Materials" in V3 and is one of the
+#                   materials of I1 in V4; its fs_* answers are the same
+# find_renames lists the candidates that are not reviewed yet when the schema is compiled.
+V3_RENAMES = {
+    'eligible': 'able2complete',
+    'nodo': 'able2complete_no',
+    'materials_1': 'pt_info_brochure',
+    'materials_2': 'other_edu_mats',
+    'othedumats_2': 'oedu_myfbyl',
+    'othedumats_3': 'fact_sheets',
+    'othedumats_3_1': 'fs_nutrition',
+    'othedumats_3_2': 'fs_diagnosis',
+    'othedumats_3_4': 'fs_drug_txs',
+    'othedumats_3_5': 'fs_OPandOA',
+    'othedumats_3_6': 'fs_2ndaryOP',
+    'othedumats_3_7': 'fs_yg2sb',
+    'othedumats_3_8': 'fs_menOP',
+    'postalcode': 'PostalCode',
+    'survey_baseline': 'screeningmode',
+}
+
+
+# Read the survey variables sheet, whose header row is preceded by a highlighting legend in V3
+def read_survey_variables(path):
+    sheet = pd.read_excel(path, sheet_name='SurveyVariables', header=None, dtype=str,
+                          keep_default_na=False, engine='openpyxl')
+    header_row = sheet.index[sheet[0] == 'VariableName'][0]
+    sheet.columns = sheet.iloc[header_row]
+    return sheet.iloc[header_row + 1:].reset_index(drop=True)
+
+
+# Variable names listed in the tables of the OtherVariables sheet
+def read_other_variables(path):
+    sheet = pd.read_excel(path, sheet_name='OtherVariables', header=None, dtype=str,
+                          keep_default_na=False, engine='openpyxl')
+    names = []
+    in_table = False
+    for name in sheet[0]:
+        if name == 'Variable Name':
+            in_table = True
+        elif not name:
+            in_table = False
+        elif in_table:
+            names.append(name)
+    return names
+
+
+# The export column a dictionary row is written to. Multiselect answers get one column per response,
+# and the "Other" textboxes are exported as <response>_text.
+def export_column(row):
+    if row['ResponseText'] == 'Other Textbox' and row['ResponseTag'].endswith('_other'):
+        return row['ResponseTag'][:-len('_other')] + '_text'
+    if row['QuestionTypeId'] == 'MULTISELECT':
+        return row['ResponseTag']
+    return row['VariableName']
+
+
+def _question_kind(question_type):
+    if question_type in CODE_TYPES:
+        return 'code'
+    if question_type == 'NUMERIC':
+        return 'numeric'
+    if question_type == 'DATE':
+        return 'date'
+    return 'text'
+
+
+# Question and response text without the survey numbering (e.g. "B3. ") or punctuation,
+# so the same question can be recognised across the two survey versions
+def _normalise(text):
+    text = re.sub(r'^\s*[A-Z]{1,2}\s?\d+(\.\d+)*\.?\s*', '', text)
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+
+# Describe every export column of one survey version: kind, the codes it can hold and its question
+def compile_version(path):
+    survey = read_survey_variables(path)
+    columns = {}
+
+    for _, row in survey.iterrows():
+        column = export_column(row)
+        is_textbox = column.endswith('_text') and row['ResponseText'] == 'Other Textbox'
+        kind = 'text' if is_textbox else _question_kind(row['QuestionTypeId'])
+        entry = columns.setdefault(column, {'kind': kind, 'codes': set(),
+                                            'question': _normalise(row['QuestionText']),
+                                            'response': _normalise(row['ResponseText']),
+                                            'type': row['QuestionTypeId']})
+        if kind == 'code' and row['NumValue'].isdigit():
+            entry['codes'].add(int(row['NumValue']))
+        if kind == 'code' and row['QuestionTypeId'] == 'MULTISELECT':
+            entry['codes'].add(UNTICKED_CODE)
+
+    for name in read_other_variables(path):
+        kind, codes = OTHER_VARIABLES.get(name, ('code', []))
+        for prefix, task_codes in TASK_CODES.items():
+            if name.startswith(prefix):
+                codes = task_codes
+        columns[name] = {'kind': kind, 'codes': set(codes), 'question': '', 'response': '', 'type': ''}
+
+    return columns
+
+
+# V3 columns that look renamed in V4: the same question (or, for multiselect answers, the same
+# response) under a new column name. Only unambiguous one to one matches are listed.
+def find_renames(v3_columns, v4_columns):
+    renames = {}
+    for column, entry in v3_columns.items():
+        if column in v4_columns or not entry['question']:
+            continue
+        if entry['type'] == 'MULTISELECT':
+            matches = [name for name, other in v4_columns.items()
+                       if other['type'] == 'MULTISELECT' and other['response'] == entry['response']]
+        else:
+            matches = [name for name, other in v4_columns.items()
+                       if other['type'] != 'MULTISELECT' and other['kind'] == entry['kind']
+                       and other['question'] == entry['question']]
+        matches = [name for name in matches if name not in v3_columns]
+        if len(matches) == 1:
+            renames[column] = matches[0]
+    return renames
+
+
+# The reviewed renames, checked against the dictionaries. A candidate of find_renames that is not in
+# V3_RENAMES is logged, so a new dictionary revision shows what is left to review.
+def checked_renames(v3_columns, v4_columns):
+    for column, v4_column in V3_RENAMES.items():
+        if column not in v3_columns:
+            raise ValueError(f'V3_RENAMES renames {column}, which the V3 dictionary does not describe')
+        if v4_column not in v4_columns or v4_column in v3_columns:
+            raise ValueError(f'V3_RENAMES renames {column} to {v4_column}, which is not a new column of the '
+                             f'V4 dictionary')
+    for column, v4_column in find_renames(v3_columns, v4_columns).items():
+        if V3_RENAMES.get(column) != v4_column:
+            logging.warning(f'{column} may have been renamed to {v4_column} in V4, it is not in V3_RENAMES')
+    return dict(V3_RENAMES)
+
+
+def _dictionary_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# Compile the data dictionaries into one schema covering the columns of both survey versions.
+# The V3 columns of V3_RENAMES are described under their V4 name.
+def compile_schema(dictionaries=None):
+    dictionaries = dictionaries or DICTIONARIES
+    versions = {version: compile_version(path) for version, path in dictionaries.items()}
+    renames = checked_renames(versions['V3'], versions['V4'])
+
+    columns = {}
+    for version, version_columns in versions.items():
+        for column, entry in version_columns.items():
+            column = renames.get(column, column) if version == 'V3' else column
+            merged = columns.setdefault(column, {'kind': entry['kind'], 'codes': set(), 'versions': []})
+            if merged['kind'] != entry['kind']:
+                logging.warning(f'{column} is {merged["kind"]} in one survey version and {entry["kind"]} in '
+                                f'{version}, it is read as text')
+                merged['kind'] = 'text'
+            merged['codes'] |= entry['codes']
+            merged['versions'].append(version)
+
+    for entry in columns.values():
+        entry['dtype'] = KIND_DTYPES[entry['kind']]
+        entry['codes'] = sorted(entry['codes'], key=str)
+
+    return {
+        'format': SCHEMA_FORMAT,
+        'version': _dictionary_digest(dictionaries.values())[:12],
+        'sources': {version: path.name for version, path in dictionaries.items()},
+        'na_values': NA_VALUES,
+        'renames': {'V3': renames},
+        'columns': dict(sorted(columns.items())),
+    }
+
+
+def write_schema(schema, path=SCHEMA_PATH):
+    tmp_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(schema, file, indent=1)
+        file.write('\n')
+    os.replace(tmp_path, path)
+
+
+_loaded = {}
+
+
+# The compiled schema, compiled from the dictionaries the first time if the artifact is missing
+def load_schema(path=SCHEMA_PATH):
+    path = Path(path)
+    if path not in _loaded:
+        if not path.exists():
+            logging.info(f'Compiling {path.name} from the FSPP data dictionaries')
+            write_schema(compile_schema(), path)
+        with open(path) as file:
+            schema = json.load(file)
+        if schema.get('format') != SCHEMA_FORMAT:
+            raise ValueError(f'{path} has schema format {schema.get("format")}, expected {SCHEMA_FORMAT}. '
+                             f'Recompile it with: python pipeline/dictionary.py')
+        _loaded[path] = schema
+    return _loaded[path]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        out_path = Path(sys.argv[1]) if len(sys.argv) > 1 else SCHEMA_PATH
+        schema = compile_schema()
+        write_schema(schema, out_path)
+        logging.info(f'Wrote schema {schema["version"]} with {len(schema["columns"])} columns and '
+                     f'{len(schema["renames"]["V3"])} V3 renames to {out_path}')
+    except ValueError as er:
+        logging.error(str(er))
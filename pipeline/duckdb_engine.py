@@ -0,0 +1,467 @@
+import logging
+import os
+from pathlib import Path
+
+from pipeline.caroc import (BUMP_FRACTURE_SITES, CAROC_AGE_EDGES, CAROC_HIGH_LIMITS, CAROC_LOW_LIMITS, HIGH,
+                            HIGH_FRACTURE_SITES, LOW, MODERATE)
+from pipeline.cleaning import BMI_STEPS, add_risk_levels, loadable_variants, merge_read_options, variant_columns
+from pipeline.datasets import dataset_path, write_dataset
+from pipeline.flags import FLAG_BITS, FLAGS_COLUMN, FLAGS_DTYPE, present_flags
+from pipeline.frax import FRAX_RISK_DTYPE, HIGH_CUT_POINT, LOW_CUT_POINT, RISK_LEVELS
+from pipeline.imputation import (GROUP_COLUMN, GROUPS, IMPUTER_ATTR, column_methods, imputer_from_statistics,
+                                 merge_imputers, save_imputer, sum_statistics)
+from pipeline.instrumentation import run_recorded
+from pipeline.units import LBS_TO_KG
+from pipeline.variants import VARIANTS
+
+# duckdb is optional, only the duckdb backend of the cleaning run needs it
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Runs the cleaning stages as queries on an embedded DuckDB database instead of pandas frames.
+# The raw file is read into a table in file order, then deduplicated and converted to metric units by DuckDB,
+# on every core and spilling to disk when it does not fit in memory, into one table the variants share.
+# The selection, imputation, risk levels, BMI and CAROC labels of a variant are then a chain of lazy queries
+# on that table, which DuckDB writes to the cleaned CSV itself with COPY, so the cleaned data is never
+# brought into pandas. The fill statistics are SQL aggregates turned into an imputer by the reducer of the
+# pandas path (imputer_from_statistics), and the cleaned CSVs are the same as the pandas ones.
+
+# Where DuckDB spills to disk, outside the stage folders like the read cache
+TEMP_DIR = Path(os.environ.get('OSTEOPOROSIS_DUCKDB_TEMP_DIR',
+                               Path(__file__).resolve().parents[1] / '.cache' / 'duckdb'))
+
+# Memory DuckDB may use before spilling, e.g. '16GB', DuckDB's own default when not set
+MEMORY_LIMIT = os.environ.get('OSTEOPOROSIS_DUCKDB_MEMORY_LIMIT')
+
+# Position of each row in the raw file, so the rows come out in the order of the pandas path
+ROW_COLUMN = '_row'
+
+# The table the rows of the raw file are read into, in file order, and the table the deduplicated,
+# metric rows are kept in
+RAW_TABLE = 'raw'
+BASE_TABLE = 'base'
+
+# The SQL types of the dtypes the read options use
+SQL_TYPES = {
+    'float32': 'FLOAT',
+    'float64': 'DOUBLE',
+    'int32': 'INTEGER',
+    'Int32': 'INTEGER',
+    'int64': 'BIGINT',
+    'uint16': 'USMALLINT',
+    'uint32': 'UINTEGER',
+    'str': 'VARCHAR',
+}
+
+# The dtypes pandas gives the SQL types of the filled columns, for the statistics of the imputer
+NUMPY_DTYPES = {
+    'FLOAT': 'float32',
+    'DOUBLE': 'float64',
+    'INTEGER': 'int32',
+    'BIGINT': 'int64',
+    'VARCHAR': 'object',
+}
+
+
+def _name(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# A float constant in the given type, rounded the way numpy rounds a Python float into that dtype.
+# Parsing the repr as DOUBLE first keeps SQL from reading it as a DECIMAL.
+def _float(value, sql_type='DOUBLE'):
+    return f'CAST(CAST({_string(repr(float(value)))} AS DOUBLE) AS {sql_type})'
+
+
+def _sql_type(dtype):
+    if str(dtype) not in SQL_TYPES:
+        raise ValueError(f'The duckdb backend cannot read columns of dtype {dtype}')
+    return SQL_TYPES[str(dtype)]
+
+
+def connect(threads=None):
+    if duckdb is None:
+        raise ValueError('The duckdb backend needs the duckdb package, install it with pip install duckdb')
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    config = {'temp_directory': str(TEMP_DIR), 'preserve_insertion_order': True}
+    if threads:
+        config['threads'] = threads
+    if MEMORY_LIMIT:
+        config['memory_limit'] = MEMORY_LIMIT
+    return duckdb.connect(config=config)
+
+
+# The columns of the raw file, CSV or Parquet
+def read_header(con, file_name):
+    return con.sql(f'SELECT * FROM {source_scan(file_name)} LIMIT 0').columns
+
+
+def source_scan(file_name, read_options=None):
+    if Path(file_name).suffix == '.parquet':
+        return f'read_parquet({_string(file_name)}, file_row_number = true)'
+    if read_options is None:
+        return f'read_csv({_string(file_name)}, header = true)'
+    types = ', '.join(f'{_string(column)}: {_string(_sql_type(dtype))}'
+                      for column, dtype in read_options['dtype'].items())
+    nullstr = ', '.join(_string(value) for value in read_options['na_values'])
+    return f'read_csv({_string(file_name)}, header = true, types = {{{types}}}, nullstr = [{nullstr}])'
+
+
+# The read options' columns of the raw file in their dtypes. The types of the CSV columns are set by the scan,
+# Parquet columns are cast to them and put in file order.
+def source_query(file_name, read_options):
+    if Path(file_name).suffix == '.parquet':
+        columns = [f'CAST({_name(column)} AS {_sql_type(read_options["dtype"][column])}) AS {_name(column)}'
+                   if column in read_options['dtype'] else _name(column) for column in read_options['usecols']]
+        return f'SELECT {", ".join(columns)} FROM {source_scan(file_name, read_options)} ORDER BY file_row_number'
+    columns = [_name(column) for column in read_options['usecols']]
+    return f'SELECT {", ".join(columns)} FROM {source_scan(file_name, read_options)}'
+
+
+# Read the raw file into a table. The connection keeps the insertion order, so the rows are stored in file
+# order and the rowid of a row is its position in the file; a window over the scan (row_number() OVER ())
+# has no order DuckDB guarantees.
+def create_raw_table(con, file_name, read_options):
+    con.sql(f'CREATE OR REPLACE TEMP TABLE {RAW_TABLE} AS {source_query(file_name, read_options)}')
+
+
+# The rows of the raw table, numbered in file order
+def raw_rows():
+    return f'SELECT rowid AS {ROW_COLUMN}, * FROM {RAW_TABLE}'
+
+
+# Height in cm and weight in kg, with the same unit ranges and float32 arithmetic as to_metric in
+# pipeline/units.py. Heights that match no range, and missing heights, become 0.
+def metric_columns(height='bmdtest_height', weight='bmdtest_weight'):
+    h, w = _name(height), _name(weight)
+    is_meters = f'({h} > {_float(1, "FLOAT")} AND {h} < {_float(2.2, "FLOAT")})'
+    is_inches = f'({h} > {_float(50, "FLOAT")} AND {h} < {_float(84, "FLOAT")})'
+    is_cm = f'({h} > {_float(125, "FLOAT")})'
+    height_cm = (f'CASE WHEN {is_meters} THEN {h} * {_float(100, "FLOAT")} '
+                 f'WHEN {is_inches} THEN {h} * {_float(2.54, "FLOAT")} '
+                 f'WHEN {is_cm} THEN {h} ELSE {_float(0, "FLOAT")} END')
+    weight_kg = f'CASE WHEN {is_inches} THEN {w} * {_float(LBS_TO_KG, "FLOAT")} ELSE {w} END'
+    matched = f'coalesce({is_meters} OR {is_inches} OR {is_cm}, false)'
+    return height_cm, weight_kg, matched
+
+
+# Load, dedupe and metric: the rows of the raw file with the columns of every variant in the run, the first
+# row of every patient kept and the heights and weights in metric units, as one table on disk or in memory.
+# Like to_metric the heights stay float32 only when every height matched a unit range.
+def create_base_table(con, file_name, read_options, id_cols):
+    create_raw_table(con, file_name, read_options)
+    height_cm, weight_kg, matched = metric_columns()
+    columns = [height_cm + ' AS "bmdtest_height"' if column == 'bmdtest_height' else
+               weight_kg + ' AS "bmdtest_weight"' if column == 'bmdtest_weight' else _name(column)
+               for column in read_options['usecols']]
+    ids = ', '.join(_name(column) for column in id_cols)
+
+    con.sql(f'CREATE OR REPLACE TEMP TABLE {BASE_TABLE} AS '
+            f'SELECT {ROW_COLUMN}, {", ".join(columns)}, {matched} AS _matched '
+            f'FROM ({raw_rows()}) '
+            f'QUALIFY row_number() OVER (PARTITION BY {ids} ORDER BY {ROW_COLUMN}) = 1')
+
+    if con.sql(f'SELECT bool_and(_matched) FROM {BASE_TABLE}').fetchone()[0] is False:
+        con.sql(f'ALTER TABLE {BASE_TABLE} ALTER "bmdtest_height" TYPE DOUBLE')
+    con.sql(f'ALTER TABLE {BASE_TABLE} DROP _matched')
+    logging.info(f'Loaded {con.sql(f"SELECT count(*) FROM {BASE_TABLE}").fetchone()[0]} rows of {file_name} '
+                 f'into DuckDB')
+
+
+def column_types(con, query):
+    relation = con.sql(f'SELECT * FROM ({query}) LIMIT 0')
+    return {column: str(sql_type) for column, sql_type in zip(relation.columns, relation.types)}
+
+
+def _present(column, sql_type):
+    c = _name(column)
+    return f'{c} IS NOT NULL AND NOT isnan({c})' if sql_type in ('FLOAT', 'DOUBLE') else f'{c} IS NOT NULL'
+
+
+# The sum statistics of a column from the value counts of its present values, grouped by the group column
+# when one is given: the sums are exact, as sum_statistics in pipeline/imputation.py takes them, so only
+# the distinct values and their counts come into Python
+def _value_counts(con, query, column, sql_type, group_column=None):
+    groups = f'{_name(group_column)}, ' if group_column else ''
+    return con.sql(f'SELECT {groups}CAST({_name(column)} AS DOUBLE) AS value, count(*) AS rows FROM ({query}) '
+                   f'WHERE {_present(column, sql_type)} GROUP BY ALL').fetchnumpy()
+
+
+def _mean_dtype(sql_type):
+    return NUMPY_DTYPES[sql_type] if sql_type in ('FLOAT', 'DOUBLE') else 'float64'
+
+
+# Fit the (method, columns) steps of an imputation on the rows of the query. The statistics are SQL
+# aggregates: the value counts of each mean column, grouped by gender for the gender means, summed exactly
+# in Python, and the value counts of each mode column. Only the distinct values come into Python. They go
+# through the same reducer as the statistics of the pandas path, so the imputer is the same.
+def fit_query_imputer(con, query, steps):
+    methods = column_methods(steps)
+    types = column_types(con, query)
+    statistics = {column: {'dtype': NUMPY_DTYPES[types[column]]} for column in methods}
+
+    for column, method in methods.items():
+        if method in ('mean', 'mean_nan', 'zero_then_mean'):
+            counts = _value_counts(con, query, column, types[column])
+            statistics[column] = {'dtype': _mean_dtype(types[column]),
+                                  **sum_statistics(counts['value'], counts['rows'])}
+
+    gender_means = [column for column, method in methods.items() if method == 'gender_mean']
+    if gender_means:
+        groups = ', '.join(_float(group) for group in GROUPS)
+        rows = dict(con.sql(f'SELECT {_name(GROUP_COLUMN)}, count(*) FROM ({query}) '
+                            f'WHERE {_name(GROUP_COLUMN)} IN ({groups}) GROUP BY ALL').fetchall())
+        for column in gender_means:
+            counts = _value_counts(con, query, column, types[column], GROUP_COLUMN)
+            group_statistics = {}
+            for group in GROUPS:
+                in_group = counts[GROUP_COLUMN] == group
+                group_statistics[group] = {'rows': int(rows.get(group, 0)),
+                                           **sum_statistics(counts['value'][in_group], counts['rows'][in_group])}
+            statistics[column] = {'dtype': _mean_dtype(types[column]), 'groups': group_statistics}
+
+    for column, method in methods.items():
+        if method == 'mode':
+            counts = con.sql(f'SELECT {_name(column)}, count(*) FROM ({query}) '
+                             f'WHERE {_present(column, types[column])} GROUP BY {_name(column)}').fetchall()
+            statistics[column]['counts'] = dict(counts)
+
+    return imputer_from_statistics(statistics, steps)
+
+
+# The CASE that fills one column with an imputer entry, as apply_imputer does: missing values and zeros
+# are found on the column before it is filled, and group values only fill the rows of their group.
+def fill_expression(column, entry, group_column, sql_type):
+    c = _name(column)
+    is_missing = f'({c} IS NULL OR isnan({c}))' if sql_type in ('FLOAT', 'DOUBLE') else f'{c} IS NULL'
+    cases = []
+    for condition, value in [(is_missing, entry['nan']), (f'{c} = 0', entry['zero'])]:
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            cases += [f'WHEN {condition} AND {_name(group_column)} = {_float(group)} THEN {_float(group_value)}'
+                      for group, group_value in value.items() if group_value == group_value]
+        else:
+            cases.append(f'WHEN {condition} THEN {_float(value)}')
+    if not cases:
+        return c
+    return f'CAST(CASE {" ".join(cases)} ELSE {c} END AS {sql_type})'
+
+
+def apply_query_imputer(con, query, imputer):
+    types = column_types(con, query)
+    columns = [f'{fill_expression(column, imputer["columns"][column], imputer["group_column"], sql_type)} '
+               f'AS {_name(column)}' if column in imputer['columns'] else _name(column)
+               for column, sql_type in types.items()]
+    return f'SELECT {", ".join(columns)} FROM ({query})'
+
+
+# The FRAX risk level of a percentage, as risk_levels in pipeline/frax.py
+def risk_level_expression(percentage_column):
+    p = _name(percentage_column)
+    return (f'CASE WHEN {p} IS NULL OR isnan({p}) THEN NULL '
+            f'WHEN {p} > {HIGH_CUT_POINT} THEN {_string(RISK_LEVELS[2])} '
+            f'WHEN {p} >= {LOW_CUT_POINT} THEN {_string(RISK_LEVELS[1])} '
+            f'ELSE {_string(RISK_LEVELS[0])} END')
+
+
+# Height in cm and weight in kg, squared in the precision of the heights like bmi in pipeline/units.py
+def bmi_expression(height_type, height='bmdtest_height', weight='bmdtest_weight'):
+    h, w = _name(height), _name(weight)
+    if height_type == 'FLOAT':
+        return f'{w} / (({h} / {_float(100, "FLOAT")}) * ({h} / {_float(100, "FLOAT")}))'
+    return f'CAST({w} AS DOUBLE) / ((CAST({h} AS DOUBLE) / 100) * (CAST({h} AS DOUBLE) / 100))'
+
+
+def _is_missing(column, sql_type):
+    c = _name(column)
+    return f'({c} IS NULL OR isnan({c}))' if sql_type in ('FLOAT', 'DOUBLE') else f'{c} IS NULL'
+
+
+# A comparison that is false for missing values, as numpy compares NaN. DuckDB sorts NaN above every number.
+def _compare(column, sql_type, comparison):
+    return f'coalesce(NOT {_is_missing(column, sql_type)} AND {_name(column)} {comparison}, false)'
+
+
+# The T-score limit of the patient's age band, compared in the type of the T-scores. Missing ages fall in
+# the last band, as with np.searchsorted.
+def _band_limit(limits, age, tscore_type):
+    cases = ' '.join(f'WHEN {_name(age)} < {edge} THEN {_float(limit, tscore_type)}'
+                     for edge, limit in zip(CAROC_AGE_EDGES, limits))
+    return f'CASE {cases} ELSE {_float(limits[-1], tscore_type)} END'
+
+
+# The CAROC risk of every row, as caroc_risk in pipeline/caroc.py: the basal risk from age, gender and
+# T-score, one level higher for steroid use or an earlier fracture, high for a hip or spine fracture.
+# Only the answers among the columns are used, as caroc_labels does.
+def caroc_risk_expression(types, age='PatientAge', gender='PatientGender', tscore='bmdtest_tscore_fn'):
+    t, tscore_type = _name(tscore), types[tscore]
+    female = f'{_name(gender)} = 1'
+    high = (f'CASE WHEN {female} THEN {_band_limit(CAROC_HIGH_LIMITS["female"], age, tscore_type)} '
+            f'ELSE {_band_limit(CAROC_HIGH_LIMITS["male"], age, tscore_type)} END')
+    low = (f'CASE WHEN {female} THEN {_band_limit(CAROC_LOW_LIMITS["female"], age, tscore_type)} '
+           f'ELSE {_band_limit(CAROC_LOW_LIMITS["male"], age, tscore_type)} END')
+    basal = (f'CASE WHEN {_is_missing(tscore, tscore_type)} THEN NULL WHEN {t} > {high} THEN {LOW} '
+             f'WHEN {t} > {low} THEN {MODERATE} ELSE {HIGH} END')
+
+    bumps = []
+    if 'oralster' in types:
+        bumps.append(_compare('oralster', types['oralster'], '= 1'))
+    if 'obreak' in types:
+        bumps.append(_compare('obreak', types['obreak'], '> 1'))
+    bumps += [_compare(site, types[site], '= 1') for site in BUMP_FRACTURE_SITES if site in types]
+    highs = [_compare(site, types[site], '= 1') for site in HIGH_FRACTURE_SITES if site in types]
+
+    risk = f'({basal})'
+    if bumps:
+        risk = f'CASE WHEN ({" OR ".join(bumps)}) AND {risk} < {HIGH} THEN {risk} + 1 ELSE {risk} END'
+    if highs:
+        risk = f'CASE WHEN {" OR ".join(highs)} THEN {HIGH} ELSE {risk} END'
+    return risk
+
+
+# Fill in the missing CAROC risks of the target columns and drop the rows whose risk is 0, as caroc_label
+# in pipeline/cleaning.py
+def caroc_label_query(con, query, target_cols):
+    for column in target_cols:
+        types = column_types(con, query)
+        filled = (f'CAST(CASE WHEN {_is_missing(column, types[column])} THEN {caroc_risk_expression(types)} '
+                  f'ELSE {_name(column)} END AS {types[column]})')
+        query = (f'SELECT * REPLACE ({filled} AS {_name(column)}) FROM ({query}) '
+                 f'WHERE {filled} IS DISTINCT FROM 0')
+    return query
+
+
+# The flags packed into one integer, as encode_flags in pipeline/flags.py packs them: a flag's bit is set
+# where its column is 1
+def flags_expression(flags):
+    bits = ' + '.join(f'CASE WHEN {_name(flag)} = 1 THEN {FLAG_BITS[flag]} ELSE 0 END' for flag in flags)
+    return f'CAST({bits or 0} AS {_sql_type(FLAGS_DTYPE)})'
+
+
+# How a variant fills in its targets, as LABELLERS in pipeline/cleaning.py
+LABEL_QUERIES = {
+    'caroc': caroc_label_query,
+}
+
+
+# The text pandas writes for a float32 value. DuckDB writes the shortest text that reads back as the value,
+# except when two texts one digit shorter are equally close, where it writes the exact value (27.4609375)
+# and numpy the one with the even last digit (27.460938), which printf rounds to.
+def float32_text(column):
+    c = _name(column)
+    text = f'CAST({c} AS VARCHAR)'
+    decimals = f'length(split_part({text}, \'.\', 2))'
+    shorter = f'printf(\'%.*f\', {decimals} - 1, CAST({c} AS DOUBLE))'
+    return (f'CASE WHEN {text} LIKE \'%5\' AND NOT contains({text}, \'e\') AND {decimals} > 1 '
+            f'AND CAST({shorter} AS FLOAT) = {c} THEN {shorter} ELSE {text} END')
+
+
+# The query of the text of a cleaned CSV, as pandas writes the columns of the frame
+def csv_query(con, query):
+    columns = [f'{float32_text(column)} AS {_name(column)}' if sql_type == 'FLOAT' else _name(column)
+               for column, sql_type in column_types(con, query).items()]
+    return f'SELECT {", ".join(columns)} FROM ({query})'
+
+
+# A cleaned variant as the query that gives its rows, in file order, and the imputer of its fills.
+# The rows are only fetched into a frame for the reports, the cleaned CSV is written by DuckDB.
+class CleanedQuery:
+    def __init__(self, con, query, imputer, risk_levels):
+        self.con = con
+        self.query = query
+        self.imputer = imputer
+        self.risk_levels = risk_levels
+
+    def df(self):
+        df = self.con.sql(self.query).df()
+        for column in self.risk_levels:
+            df[column] = df[column].astype(FRAX_RISK_DTYPE)
+        df.attrs[IMPUTER_ATTR] = self.imputer
+        return df
+
+
+# The cleaned query of a variant, from the base table
+def clean_variant(con, variant):
+    selected = (f'SELECT {ROW_COLUMN}, {", ".join(_name(column) for column in variant_columns(variant))} '
+                f'FROM {BASE_TABLE}')
+
+    imputer = fit_query_imputer(con, selected, variant['impute'])
+    imputed = apply_query_imputer(con, selected, imputer)
+
+    derived_columns = [f'{risk_level_expression(percentage_column)} AS {_name(column)}'
+                       for column, percentage_column in variant['risk_levels'].items()]
+    derived_columns.append(f'{bmi_expression(column_types(con, imputed)["bmdtest_height"])} AS "bmi"')
+    derived = f'SELECT *, {", ".join(derived_columns)} FROM ({imputed})'
+
+    if variant['bmi_fill']:
+        bmi_imputer = fit_query_imputer(con, derived, BMI_STEPS)
+        derived = apply_query_imputer(con, derived, bmi_imputer)
+        imputer = merge_imputers(imputer, bmi_imputer)
+
+    if variant['label'] is not None:
+        derived = LABEL_QUERIES[variant['label']](con, derived, variant['target_cols'])
+
+    # NaN is written as an empty cell, as pandas writes it
+    types = column_types(con, derived)
+    columns = [f'CASE WHEN isnan({_name(column)}) THEN NULL ELSE {_name(column)} END AS {_name(column)}'
+               if types[column] in ('FLOAT', 'DOUBLE') else _name(column)
+               for column in [*variant_columns(variant), *variant['risk_levels'], 'bmi']]
+    columns.append(f'{flags_expression(present_flags(variant_columns(variant)))} AS {_name(FLAGS_COLUMN)}')
+    query = f'SELECT {", ".join(columns)} FROM ({derived}) ORDER BY {ROW_COLUMN}'
+    return CleanedQuery(con, query, imputer, variant['risk_levels'])
+
+
+# Write a cleaned variant with COPY, and next to it the statistics it was imputed with, as write_stage in
+# pipeline/cleaning.py does. The Parquet dataset of an export version is written from the fetched frame.
+# The backend does not quarantine rows, so there are never quarantined rows to write.
+def write_query(cleaned, path, export_version=None, quarantined=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cleaned.con.sql(f'COPY ({csv_query(cleaned.con, cleaned.query)}) TO {_string(path)} (FORMAT csv, HEADER)')
+    logging.info(f'Data saved to {path}\n')
+
+    if export_version is not None:
+        write_dataset(cleaned.df(), dataset_path(path), export_version)
+
+    imputer_path = path.with_suffix('.imputer.json')
+    save_imputer(cleaned.imputer, imputer_path)
+    logging.info(f'Imputation statistics saved to {imputer_path}\n')
+
+
+# The same run as pandas_backend in pipeline/cleaning.py, on DuckDB. The queries of a variant run as one,
+# so a recorder sees a load stage, one clean stage per variant and the write of each variant, where its
+# queries run.
+def duckdb_backend(names, file_name, recorder=None, validate=False, workers=None, knn=False, dedupe='first'):
+    if validate:
+        raise ValueError('The duckdb backend does not quarantine rows, run the validation with the pandas backend')
+    if knn:
+        raise ValueError('The duckdb backend does not run the knn stage, run it with the pandas backend')
+    if dedupe != 'first':
+        raise ValueError('The duckdb backend keeps the first row of a patient, run other dedupe policies with the '
+                         'pandas or parallel backend')
+    con = connect(workers)
+    loadable = loadable_variants(names, file_name, set(read_header(con, file_name)))
+    if not loadable:
+        return loadable, None, None, None
+
+    variants = [VARIANTS[name] for name in loadable]
+    if len({tuple(variant['id_cols']) for variant in variants}) > 1:
+        raise ValueError('The duckdb backend needs the variants of a run to share their id columns')
+    read_options = merge_read_options(variants)
+    run_recorded(recorder, 'load', create_base_table, con, file_name, read_options, variants[0]['id_cols'])
+
+    def unclean(variant):
+        df = con.sql(f'SELECT {", ".join(_name(column) for column in variant_columns(variant))} '
+                     f'FROM ({raw_rows()}) ORDER BY {ROW_COLUMN}').df()
+        return add_risk_levels(df, variant['risk_levels'])
+
+    def clean(variant):
+        return run_recorded(recorder, 'clean', clean_variant, con, variant), None
+
+    return loadable, unclean, clean, write_query
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from pipeline.schema import CODE_DTYPE
+
+# The yes/no answers packed into one integer column, one bit each. The bit of a flag is its position in
+# FLAGS, the same in every dataset, so masks built for one dataset work on the others. New flags go at the end.
+FRACTURE_SITES = ['hip', 'ankle', 'clavicle', 'elbow', 'femur', 'spine', 'wrist', 'shoulder', 'tibfib']
+COMORBIDITIES = ['arthritis', 'cancer', 'diabetes', 'heartdisease', 'respdisease']
+FLAGS = FRACTURE_SITES + COMORBIDITIES
+
+FLAG_BITS = {flag: 1 << bit for bit, flag in enumerate(FLAGS)}
+
+# 2 bytes a row for the 14 flags, against 4 bytes a flag for the float32 columns
+FLAGS_DTYPE = 'uint16' if len(FLAGS) <= 16 else 'uint32'
+
+# The packed column of pack_flags
+FLAGS_COLUMN = 'flags'
+
+
+# The flags among the columns, in the order of FLAGS. The cleaned data of a variant packs the flags it
+# has; the bits of the others are never set.
+def present_flags(columns):
+    return [flag for flag in FLAGS if flag in columns]
+
+
+# The bits of the named flags, e.g. flag_mask(FRACTURE_SITES) for any fracture
+def flag_mask(names):
+    unknown = [name for name in names if name not in FLAG_BITS]
+    if unknown:
+        raise ValueError(f'Unknown flag {", ".join(unknown)}, the flags are {", ".join(FLAGS)}')
+    return sum(FLAG_BITS[name] for name in set(names))
+
+
+# The flags of every row as one integer. A flag is set where its column is 1, as pipeline/caroc.py reads
+# the answers; 0, missing and any other answer leave it unset.
+def encode_flags(df, flags=FLAGS):
+    missing = [flag for flag in flags if flag not in df]
+    if missing:
+        raise ValueError(f'The data has no {", ".join(missing)} column')
+    flag_mask(flags)
+    codes = np.zeros(len(df), dtype=FLAGS_DTYPE)
+    for flag in flags:
+        codes[df[flag].to_numpy() == 1] |= FLAG_BITS[flag]
+    return codes
+
+
+# The flag columns of the codes, 0/1 in the dtype of the cleaned data so the one-hot column names of the
+# model scripts (e.g. 'ankle_1.0') stay the same
+def decode_flags(codes, flags=FLAGS, index=None):
+    flag_mask(flags)
+    codes = np.asarray(codes)
+    return pd.DataFrame({flag: ((codes & FLAG_BITS[flag]) != 0).astype(CODE_DTYPE) for flag in flags},
+                        index=index)
+
+
+# The rows whose codes have any of, all of and none of the named flags, each check with one mask
+def match_flags(codes, any_of=(), all_of=(), none_of=()):
+    codes = np.asarray(codes)
+    matched = np.ones(len(codes), dtype=bool)
+    if any_of:
+        matched &= (codes & flag_mask(any_of)) != 0
+    if all_of:
+        matched &= (codes & flag_mask(all_of)) == flag_mask(all_of)
+    if none_of:
+        matched &= (codes & flag_mask(none_of)) == 0
+    return matched
+
+
+# The same selection on a frame with the flag columns, e.g. the patients with a fracture other than
+# the ankle: df[flag_filter(df, any_of=FRACTURE_SITES, none_of=['ankle'])]. Only the named flags are encoded.
+def flag_filter(df, any_of=(), all_of=(), none_of=()):
+    flags = [flag for flag in FLAGS if flag in {*any_of, *all_of, *none_of}]
+    flag_mask([*any_of, *all_of, *none_of])
+    return match_flags(encode_flags(df, flags), any_of, all_of, none_of)
+
+
+# Replace the flag columns of the frame with the packed FLAGS_COLUMN, at the place of the first of them
+def pack_flags(df, flags=FLAGS):
+    codes = encode_flags(df, flags)
+    position = min(df.columns.get_loc(flag) for flag in flags)
+    packed = df.drop(columns=flags)
+    packed.insert(position, FLAGS_COLUMN, codes)
+    return packed
+
+
+# Put the flag columns back, one after the other, in place of the packed column
+def unpack_flags(df, flags=FLAGS):
+    position = df.columns.get_loc(FLAGS_COLUMN)
+    decoded = decode_flags(df[FLAGS_COLUMN], flags, df.index)
+    unpacked = df.drop(columns=[FLAGS_COLUMN])
+    for offset, flag in enumerate(flags):
+        unpacked.insert(position + offset, flag, decoded[flag])
+    return unpacked
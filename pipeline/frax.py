@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+# FRAX 10 year major osteoporotic fracture risk levels, in increasing order of risk
+RISK_LEVELS = ['Low', 'Moderate', 'High']
+
+# Percentages below the low cut point are low risk, above the high cut point high risk,
+# and moderate in between, both cut points included
+LOW_CUT_POINT = 10
+HIGH_CUT_POINT = 20
+
+# Risk levels are stored as an ordered categorical, one byte per row instead of a Python string
+FRAX_RISK_DTYPE = pd.CategoricalDtype(RISK_LEVELS, ordered=True)
+
+# The risk level columns of the cleaned FRAX datasets
+FRAX_RISK_COLUMNS = ['FraxRiskLevel', 'Frax_BMD_RiskLevel', 'Frax_No_BMD_RiskLevel']
+
+# Code of a missing risk level, as in pandas categoricals
+MISSING_CODE = -1
+
+
+# The int8 risk level codes of FRAX percentages: 0 low, 1 moderate, 2 high and -1 where the percentage is missing
+def risk_level_codes(percentage, low=LOW_CUT_POINT, high=HIGH_CUT_POINT):
+    percentage = np.asarray(percentage)
+    codes = (percentage >= low).astype('int8') + (percentage > high)
+    codes[np.isnan(percentage)] = MISSING_CODE
+    return codes
+
+
+# The risk levels of FRAX percentages as an ordered categorical, keeping the index of a Series
+def risk_levels(percentage, low=LOW_CUT_POINT, high=HIGH_CUT_POINT):
+    levels = pd.Categorical.from_codes(risk_level_codes(percentage, low, high), dtype=FRAX_RISK_DTYPE)
+    if isinstance(percentage, pd.Series):
+        return pd.Series(levels, index=percentage.index, name=percentage.name)
+    return levels
+
+
+# read_csv dtypes that parse the risk level columns of a cleaned FRAX dataset straight into categoricals
+def risk_level_dtypes():
+    return {column: FRAX_RISK_DTYPE for column in FRAX_RISK_COLUMNS}
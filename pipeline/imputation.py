@@ -0,0 +1,325 @@
+import json
+import logging
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+from fractions import Fraction
+from pathlib import Path
+
+# Bump when the layout of a saved imputer changes
+IMPUTER_FORMAT = 1
+
+# Group means are taken per gender, and only used for women (1) and men (2).
+# Rows of any other gender keep their missing values.
+GROUP_COLUMN = 'PatientGender'
+GROUPS = [1, 2]
+
+# How each method fills a column: whether missing values and zeros are replaced, and with which statistic
+#   mean            missing values and zeros with the mean
+#   mean_nan        missing values with the mean
+#   zero_then_mean  zeros with the mean, then missing values with the mean once the zeros are replaced
+#   gender_mean     missing values and zeros with the mean of the patient's gender
+#   mode            missing values with the most common value
+#   zero            missing values with 0
+METHODS = ['mean', 'mean_nan', 'zero_then_mean', 'gender_mean', 'mode', 'zero']
+
+# The frames returned by apply_imputer keep the imputer they were filled with under this attrs key,
+# so it can be saved with the cleaned data
+IMPUTER_ATTR = 'imputer'
+
+
+# Statistics are stored as plain Python values so the imputer can be saved as JSON
+def _number(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# The method of every column. A column is filled by the first step that lists it, the steps
+# after it would find nothing left to fill.
+def column_methods(steps):
+    methods = {}
+    for method, columns in steps:
+        if method not in METHODS:
+            raise ValueError(f'Unknown imputation method {method}, expected one of {", ".join(METHODS)}')
+        for column in columns:
+            methods.setdefault(column, method)
+    return methods
+
+
+# Every value is an integer mantissa times a power of two, so sums are kept exactly, as integers per power of
+# two: {exponent: n} is the sum of n * 2**exponent. An exact sum does not depend on the order the values are
+# added in, so the statistics of any split of the rows merge into the same sums, which are rounded once
+# at the end.
+
+# Mantissas are summed in limbs of 24 bits, and the values in chunks small enough that np.bincount keeps
+# the sums of the limbs exact in float64
+LIMB_BITS = 24
+CHUNK_ROWS = 1 << 28
+
+
+# The exact sum of the finite values, each counted counts times (once by default), and the sum of the
+# infinite ones (0.0 when there are none). The counts of a chunk must add up to less than CHUNK_ROWS.
+def exact_sum(values, counts=None):
+    values = np.asarray(values)
+    if values.dtype not in (np.float32, np.float64):
+        values = values.astype('float64')
+    counts = np.ones(len(values), dtype='int64') if counts is None else np.asarray(counts, dtype='int64')
+    finite = np.isfinite(values)
+    special = 0.0
+    if not finite.all():
+        with np.errstate(invalid='ignore'):
+            special = float(np.sum(values[~finite] * counts[~finite]))
+        values, counts = values[finite], counts[finite]
+
+    bits = np.finfo(values.dtype).nmant + 1
+    shifts = range(0, bits, LIMB_BITS)
+    mask = (1 << LIMB_BITS) - 1
+    sums = {}
+    for start in range(0, len(values), CHUNK_ROWS):
+        mantissa, exponent = np.frexp(values[start:start + CHUNK_ROWS])
+        mantissas = (mantissa * 2.0 ** bits).astype(np.int64)
+        offsets = exponent - exponent.min()
+        total = 0
+        for shift in shifts:
+            # The top limb keeps the sign
+            limbs = mantissas >> shift if shift == shifts[-1] else (mantissas >> shift) & mask
+            limb_sums = np.bincount(offsets, weights=limbs * counts[start:start + CHUNK_ROWS])
+            for offset in np.flatnonzero(limb_sums):
+                total += int(limb_sums[offset]) << (int(offset) + shift)
+        if total:
+            base = int(exponent.min()) - bits
+            sums[base] = sums.get(base, 0) + total
+    return sums, special
+
+
+# The sum, count and number of zeros of the values, or of the distinct values with their counts, see exact_sum
+def sum_statistics(values, counts=None):
+    present = ~np.isnan(values)
+    values = values[present]
+    counts = None if counts is None else np.asarray(counts, dtype='int64')[present]
+    sums, special = exact_sum(values, counts)
+    zeros = values == 0
+    return {'sums': sums, 'special': special,
+            'count': len(values) if counts is None else int(counts.sum()),
+            'zeros': int(np.count_nonzero(zeros) if counts is None else counts[zeros].sum())}
+
+
+# The exact sum of the statistics and the extra values, rounded once to a float64. Sums too large for a
+# float64 overflow to infinity as np.sum does.
+def _total(statistics, extra=()):
+    special = statistics['special'] + sum(value for value in extra if not math.isfinite(value))
+    if special != 0:
+        return special
+    total = sum((Fraction(n) * Fraction(2) ** exponent for exponent, n in statistics['sums'].items()), Fraction(0))
+    total += sum(Fraction(value) for value in extra)
+    try:
+        return float(total)
+    except OverflowError:
+        return math.inf if total > 0 else -math.inf
+
+
+# The mean of summed statistics in the dtype pandas gives the mean of the column
+def _mean(statistics, dtype, extra=()):
+    dtype = np.dtype(dtype)
+    if not statistics['count']:
+        return dtype.type(np.nan)
+    return dtype.type(_total(statistics, extra) / statistics['count'])
+
+
+# How many times each value occurs. Survey codes are small whole numbers, whose counts np.bincount
+# takes without hashing.
+def _histogram(series):
+    values = series.to_numpy()
+    if pd.api.types.is_float_dtype(values.dtype):
+        values = values[~np.isnan(values)]
+        if len(values) and values.min() >= 0 and values.max() < 256 and (values == values.astype('uint8')).all():
+            counts = np.bincount(values.astype('uint8'))
+            return {float(value): int(counts[value]) for value in np.flatnonzero(counts)}
+    return {_number(value): int(count) for value, count in series.value_counts().items()}
+
+
+def _float_values(series):
+    if pd.api.types.is_float_dtype(series.dtype):
+        return series.to_numpy()
+    return series.to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _mean_dtype(series):
+    return str(series.dtype) if pd.api.types.is_float_dtype(series.dtype) else 'float64'
+
+
+# The statistics the (method, columns) steps are fitted from, per column: sums and counts for the means,
+# per gender for the gender means, and value counts for the modes. The statistics of parts of the data are
+# combined with merge_statistics, so the rows can be split between processes (see pipeline/parallel.py).
+def partial_statistics(df, steps):
+    statistics = {}
+    groups = None
+    for column, method in column_methods(steps).items():
+        series = df[column]
+        if method in ('mean', 'mean_nan', 'zero_then_mean'):
+            statistics[column] = {'dtype': _mean_dtype(series),
+                                  **sum_statistics(_float_values(series))}
+        elif method == 'gender_mean':
+            if groups is None:
+                gender = df[GROUP_COLUMN].to_numpy()
+                groups = {group: gender == float(group) for group in GROUPS}
+            values = _float_values(series)
+            statistics[column] = {'dtype': _mean_dtype(series), 'groups': {
+                group: {'rows': int(np.count_nonzero(rows)), **sum_statistics(values[rows])}
+                for group, rows in groups.items()}}
+        elif method == 'mode':
+            statistics[column] = {'dtype': str(series.dtype), 'counts': _histogram(series)}
+        else:
+            statistics[column] = {'dtype': str(series.dtype)}
+    return statistics
+
+
+# Add up the statistics of two parts of the data
+def merge_statistics(first, second):
+    merged = dict(first)
+    for key, value in second.items():
+        if key not in merged:
+            merged[key] = value
+        elif key == 'dtype':
+            merged[key] = str(np.result_type(merged[key], value))
+        elif isinstance(value, dict):
+            merged[key] = merge_statistics(merged[key], value)
+        else:
+            merged[key] = merged[key] + value
+    return merged
+
+
+# The fill values of the (method, columns) steps from the statistics of all the data. Only zero_then_mean
+# needs a second mean, over its columns with the zeros replaced, which is the sum plus the mean once per zero.
+def imputer_from_statistics(statistics, steps):
+    columns = {}
+    for column, method in column_methods(steps).items():
+        column_statistics = statistics[column]
+        dtype = column_statistics['dtype']
+        if method == 'mean':
+            mean = _mean(column_statistics, dtype)
+            entry = {'nan': mean, 'zero': mean}
+        elif method == 'mean_nan':
+            entry = {'nan': _mean(column_statistics, dtype), 'zero': None}
+        elif method == 'zero_then_mean':
+            mean = _mean(column_statistics, dtype)
+            replaced = _mean(column_statistics, dtype, [column_statistics['zeros'] * float(mean)]) \
+                if column_statistics['zeros'] and np.isfinite(mean) else mean
+            entry = {'nan': replaced, 'zero': mean}
+        elif method == 'gender_mean':
+            # mean[1] for female avg, mean[2] for male avg
+            values = {group: _number(_mean(group_statistics, dtype))
+                      for group, group_statistics in column_statistics['groups'].items() if group_statistics['rows']}
+            entry = {'nan': values, 'zero': values}
+        elif method == 'mode':
+            counts = column_statistics['counts']
+            # Ties go to the smallest value, as with Series.mode
+            entry = {'nan': min(counts, key=lambda value: (-counts[value], value)) if counts else np.nan,
+                     'zero': None}
+        else:
+            entry = {'nan': 0, 'zero': None}
+        columns[column] = {'method': method,
+                           **{key: value if isinstance(value, dict) or value is None else _number(value)
+                              for key, value in entry.items()}}
+
+    return {'format': IMPUTER_FORMAT, 'group_column': GROUP_COLUMN, 'columns': columns}
+
+
+# Compute the fill values of the (method, columns) steps on the frame
+def fit_imputer(df, steps):
+    return imputer_from_statistics(partial_statistics(df, steps), steps)
+
+
+# The fill value of every row: a scalar, or per group the value of the row's group (NaN for other groups)
+def _row_values(value, group_rows, length):
+    if not isinstance(value, dict):
+        return value
+    values = np.full(length, np.nan)
+    for group, group_value in value.items():
+        values[group_rows(group)] = group_value
+    return values
+
+
+def _fill(series, mask, values):
+    if not mask.any():
+        return series
+    if pd.api.types.is_float_dtype(series.dtype):
+        # Fill values are cast to the column dtype so float32 columns stay float32
+        values = np.asarray(values, dtype=series.dtype)
+        return pd.Series(np.where(mask, values, series.to_numpy()), index=series.index, name=series.name, copy=False)
+    return series.mask(mask, values)
+
+
+# Fill the columns of the imputer that the frame has, returning a new frame. Every mask is taken on the
+# data before any fill, so the columns are filled in one pass and assigned together.
+def apply_imputer(df, imputer):
+    group_column = imputer['group_column']
+    masks = {}
+
+    # The rows of each group, found once for all the columns filled by group
+    def group_rows(group):
+        if group not in masks:
+            masks[group] = df[group_column].to_numpy() == float(group)
+        return masks[group]
+
+    filled = {}
+    for column, entry in imputer['columns'].items():
+        if column not in df:
+            continue
+        series = df[column]
+        nan_values = _row_values(entry['nan'], group_rows, len(df))
+        is_nan = series.isna().to_numpy()
+        if isinstance(entry['nan'], dict):
+            is_nan = is_nan & ~np.isnan(nan_values)
+        series = _fill(series, is_nan, nan_values)
+
+        if entry['zero'] is not None:
+            zero_values = nan_values if entry['zero'] == entry['nan'] else \
+                _row_values(entry['zero'], group_rows, len(df))
+            is_zero = (df[column] == 0).to_numpy()
+            if isinstance(entry['zero'], dict):
+                is_zero = is_zero & ~np.isnan(zero_values)
+            series = _fill(series, is_zero, zero_values)
+        filled[column] = series
+
+    df = df.assign(**filled)
+    df.attrs[IMPUTER_ATTR] = imputer
+    return df
+
+
+# The imputer of both frames' fills, the second one's columns taking precedence
+def merge_imputers(first, second):
+    return {**first, 'columns': {**first['columns'], **second['columns']}}
+
+
+def save_imputer(imputer, path):
+    tmp_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(imputer, file, indent=1)
+        file.write('\n')
+    os.replace(tmp_path, path)
+
+
+def load_imputer(path):
+    with open(path) as file:
+        imputer = json.load(file)
+    if imputer.get('format') != IMPUTER_FORMAT:
+        raise ValueError(f'{path} has imputer format {imputer.get("format")}, expected {IMPUTER_FORMAT}')
+    return imputer
+
+
+# Impute new records with the statistics saved by a cleaning run, e.g. before batch scoring:
+# python pipeline/imputation.py <imputer.json> <records.csv> <imputed.csv>
+if __name__ == "__main__":
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+    from pipeline.schema import na_values
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        imputer = load_imputer(sys.argv[1])
+        records = pd.read_csv(sys.argv[2], na_values=na_values())
+        apply_imputer(records, imputer).to_csv(sys.argv[3], index=False)
+        logging.info(f'Imputed {len(records)} records into {sys.argv[3]}')
+    except ValueError as er:
+        logging.error(str(er))
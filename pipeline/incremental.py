@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from pipeline.cache import content_digest
+from pipeline.ingestion import iter_csv_chunks, iter_export_chunks, read_header, stream_concat, union_columns
+from pipeline.schema import schema_dtypes
+
+# Rows are upserted on the baseline id, a patient can have several baselines
+KEY_COLUMN = 'BaselineId'
+
+
+# The manifest records every export already merged, with the digest of its content when it was merged
+def load_manifest(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'files': {}}
+
+
+def save_manifest(path, manifest):
+    tmp_path = Path(f'{path}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Exports that were never merged, or whose content changed since they were merged
+def new_exports(paths, manifest):
+    return [path for path in paths if manifest['files'].get(path, {}).get('digest') != content_digest(path)]
+
+
+# The columns the data dictionary parses as integer ids
+def id_columns(columns):
+    return [column for column, dtype in schema_dtypes(columns).items() if pd.api.types.is_integer_dtype(dtype)]
+
+
+# The ids as the CSV exports write them. An XLSX cell of an integer column can come out as '123.0',
+# which would not match the '123' already merged.
+def normalise_ids(chunk):
+    ids = {}
+    for column in id_columns(chunk.columns):
+        numbers = pd.to_numeric(chunk[column], errors='coerce')
+        whole = numbers.notna() & (numbers % 1 == 0)
+        ids[column] = chunk[column].mask(whole, numbers[whole].astype('int64').astype(str))
+    return chunk.assign(**ids)
+
+
+def iter_new_chunks(paths, chunk_rows):
+    for path in paths:
+        for chunk in iter_export_chunks(path, chunk_rows):
+            yield normalise_ids(chunk)
+
+
+# The position of the last row of every baseline in the given exports, read chunk by chunk.
+# When a baseline appears twice the later row wins. Only the ids are kept in memory.
+def last_positions(paths, chunk_rows):
+    last = {}
+    position = 0
+    for chunk in iter_new_chunks(paths, chunk_rows):
+        last.update(zip(chunk[KEY_COLUMN], range(position, position + len(chunk))))
+        position += len(chunk)
+    return last
+
+
+# The rows of the given exports as raw strings, one per baseline (see last_positions), chunk by chunk
+def iter_new_rows(paths, chunk_rows, last):
+    position = 0
+    for chunk in iter_new_chunks(paths, chunk_rows):
+        positions = np.arange(position, position + len(chunk))
+        position += len(chunk)
+        yield chunk[chunk[KEY_COLUMN].map(last).to_numpy() == positions]
+
+
+def _write_rows(chunks, out_file, columns):
+    rows = 0
+    for chunk in chunks:
+        chunk.reindex(columns=columns).to_csv(out_file, index=False, header=False)
+        rows += len(chunk)
+    return rows
+
+
+# The baselines of a merged CSV that are also among the new rows, reading only its id column
+def replaced_ids(out_path, last, chunk_rows):
+    new_ids = pd.Index(list(last))
+    replaced = set()
+    with pd.read_csv(out_path, usecols=[KEY_COLUMN], dtype=str, keep_default_na=False,
+                     chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            ids = normalise_ids(chunk)[KEY_COLUMN]
+            replaced.update(ids[ids.isin(new_ids)])
+    return replaced
+
+
+# Upsert the rows of the given exports into a merged CSV. New baselines are appended to the file as it is.
+# If some baselines are already in the file, or the rows bring new columns, the file is rewritten once,
+# chunk by chunk, without the superseded rows. Returns True when the file was rewritten.
+def upsert_csv(out_path, paths, last, chunk_rows):
+    out_path = Path(out_path)
+    new_columns = union_columns(paths)
+    if not out_path.exists():
+        with open(out_path, 'w', newline='') as out_file:
+            pd.DataFrame(columns=new_columns).to_csv(out_file, index=False)
+            rows = _write_rows(iter_new_rows(paths, chunk_rows, last), out_file, new_columns)
+        logging.info(f'{rows} rows written to new file {out_path}')
+        return True
+
+    header = read_header(out_path)
+    columns = list(dict.fromkeys([*header, *new_columns]))
+    replaced = replaced_ids(out_path, last, chunk_rows)
+
+    if columns == header and not replaced:
+        with open(out_path, 'a', newline='') as out_file:
+            rows = _write_rows(iter_new_rows(paths, chunk_rows, last), out_file, header)
+        logging.info(f'{rows} rows appended to {out_path}')
+        return False
+
+    tmp_path = Path(f'{out_path}.tmp')
+    with open(tmp_path, 'w', newline='') as out_file:
+        pd.DataFrame(columns=columns).to_csv(out_file, index=False)
+        kept = (chunk[~chunk[KEY_COLUMN].isin(replaced)]
+                for chunk in map(normalise_ids, iter_csv_chunks(out_path, chunk_rows)))
+        _write_rows(kept, out_file, columns)
+        rows = _write_rows(iter_new_rows(paths, chunk_rows, last), out_file, columns)
+    os.replace(tmp_path, out_path)
+    logging.info(f'{rows - len(replaced)} rows added and {len(replaced)} rows updated in {out_path}')
+    return True
+
+
+# Merge only the exports that are not in the manifest yet.
+# `sources` maps each family output (CAROC, FRAX) to its export files, as in stream_merge. The merged file
+# is appended to when the families were only appended to, otherwise it is rebuilt from the family outputs,
+# which is still much cheaper than parsing every export again. Every file is read and written in chunks of
+# chunk_rows rows; only the ids of the new rows are held in memory.
+# An export that changed since it was merged has its rows upserted again, but the baselines that were taken
+# out of it are not: they stay in the merged files until the exports are merged again without --incremental.
+def incremental_merge(sources, merged_path, manifest_path, chunk_rows):
+    manifest = load_manifest(manifest_path)
+    merged_path = Path(merged_path)
+    rebuild_merged = not merged_path.exists()
+    appended = []
+
+    for out_path, paths in sources.items():
+        paths = new_exports(paths, manifest)
+        if not paths:
+            logging.info(f'No new exports for {out_path}')
+            continue
+
+        changed = [path for path in paths if path in manifest['files']]
+        if changed:
+            logging.warning(f'Exports changed since they were merged: {", ".join(changed)}. Their rows are updated, '
+                            f'but baselines removed from them stay in {out_path}; merge without --incremental '
+                            f'to drop them')
+        logging.info(f'Merging new exports into {out_path}: {paths}')
+        last = last_positions(paths, chunk_rows)
+        rebuild_merged |= upsert_csv(out_path, paths, last, chunk_rows)
+        appended.append((paths, last))
+
+        for path in paths:
+            manifest['files'][path] = {'digest': content_digest(path), 'output': str(out_path)}
+
+    if rebuild_merged:
+        stream_concat([path for path in sources if Path(path).exists()], merged_path, chunk_rows)
+    elif appended:
+        header = read_header(merged_path)
+        with open(merged_path, 'a', newline='') as merged_file:
+            rows = sum(_write_rows(iter_new_rows(paths, chunk_rows, last), merged_file, header)
+                       for paths, last in appended)
+        logging.info(f'{rows} rows appended to {merged_path}')
+
+    save_manifest(manifest_path, manifest)
@@ -0,0 +1,245 @@
+import datetime
+import logging
+import os
+import resource
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from pipeline.schema import na_values, rename_v3_columns, schema_dtypes
+
+# openpyxl is only needed when the exports are the .xlsx workbooks
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+# Dates in the workbooks are written with the same layout the CSV exports use (e.g. 01-Dec-14)
+XLSX_DATE_FORMAT = '%d-%b-%y'
+
+
+# Peak resident set size of the current process in MB (ru_maxrss is reported in KB on Linux)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# All the CSV and XLSX exports in a folder. When an export ships in both formats the CSV is used,
+# it parses faster and holds the same rows.
+def find_exports(folder):
+    folder = Path(folder)
+    csv_stems = {path.stem for path in folder.glob('*.csv')}
+    paths = list(folder.glob('*.csv'))
+    for path in folder.glob('*.xlsx'):
+        if path.stem in csv_stems:
+            logging.info(f'Skipping {path}, the CSV copy of this export is used instead')
+        else:
+            paths.append(path)
+    return [str(path) for path in sorted(paths)]
+
+
+def is_xlsx(path):
+    return Path(path).suffix.lower() == '.xlsx'
+
+
+def _open_workbook(path):
+    if load_workbook is None:
+        raise ValueError(f'openpyxl is required to read {path}')
+    # read_only streams the sheet XML row by row instead of building the whole workbook in memory
+    return load_workbook(path, read_only=True, data_only=True)
+
+
+# Cell values as the text the CSV exports would hold for them
+def _cell_to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime(XLSX_DATE_FORMAT)
+    return str(value)
+
+
+def _raw_header(path):
+    if is_xlsx(path):
+        workbook = _open_workbook(path)
+        try:
+            header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True))
+        finally:
+            workbook.close()
+        return [_cell_to_text(value) for value in header]
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+# Read only the header row of an export, this is cheap even for multi-GB files.
+# V3 columns that were renamed in V4 are reported under their V4 name, like every other reader does.
+def read_header(path):
+    return rename_v3_columns(_raw_header(path))
+
+
+# Union of the columns of every file, in order of first appearance (the same order pd.concat gives)
+def union_columns(paths):
+    columns = {}
+    for path in paths:
+        for column in read_header(path):
+            columns.setdefault(column, None)
+    return list(columns)
+
+
+# Yield the rows of an export in fixed-size chunks. Values are kept as the raw strings from the file,
+# so the merged output is a faithful copy of the input and no dtype inference is done per chunk.
+def iter_csv_chunks(path, chunk_rows):
+    with pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False) as reader:
+        for chunk in reader:
+            chunk.columns = rename_v3_columns(chunk.columns)
+            yield chunk
+
+
+# Yield the rows of the first sheet of a workbook in fixed-size chunks of raw strings, like iter_csv_chunks
+def iter_xlsx_chunks(path, chunk_rows):
+    workbook = _open_workbook(path)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = rename_v3_columns(_cell_to_text(value) for value in next(rows))
+        batch = []
+        for row in rows:
+            batch.append([_cell_to_text(value) for value in row])
+            if len(batch) == chunk_rows:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+# Chunks of any export, whether it is a CSV file or an XLSX workbook
+def iter_export_chunks(path, chunk_rows):
+    if is_xlsx(path):
+        return iter_xlsx_chunks(path, chunk_rows)
+    return iter_csv_chunks(path, chunk_rows)
+
+
+# Stream every group of exports into its own output file and into one merged file.
+# `sources` maps an output path to the list of export files that belong to it. Only one chunk is
+# held in memory at a time, so peak memory depends on chunk_rows and not on the size of the exports.
+def stream_merge(sources, merged_path, chunk_rows):
+    all_paths = [path for paths in sources.values() for path in paths]
+    merged_columns = union_columns(all_paths)
+    merged_path = Path(merged_path)
+    merged_rows = 0
+
+    with open(merged_path, 'w', newline='') as merged_file:
+        pd.DataFrame(columns=merged_columns).to_csv(merged_file, index=False)
+
+        for out_path, paths in sources.items():
+            out_path = Path(out_path)
+            columns = union_columns(paths)
+            rows = 0
+
+            with open(out_path, 'w', newline='') as out_file:
+                pd.DataFrame(columns=columns).to_csv(out_file, index=False)
+
+                for path in paths:
+                    for chunk in iter_export_chunks(path, chunk_rows):
+                        chunk.reindex(columns=columns).to_csv(out_file, index=False, header=False)
+                        chunk.reindex(columns=merged_columns).to_csv(merged_file, index=False, header=False)
+                        rows += len(chunk)
+
+            merged_rows += rows
+            logging.info(f'{rows} rows streamed to {out_path} (peak RSS {peak_rss_mb():.1f} MB)')
+
+    logging.info(f'{merged_rows} rows streamed to {merged_path} (peak RSS {peak_rss_mb():.1f} MB)')
+    return merged_rows
+
+
+# Concatenate CSV files into one output chunk by chunk, aligning every chunk to the combined header
+def stream_concat(paths, out_path, chunk_rows):
+    columns = union_columns(paths)
+    rows = 0
+    with open(out_path, 'w', newline='') as out_file:
+        pd.DataFrame(columns=columns).to_csv(out_file, index=False)
+        for path in paths:
+            for chunk in iter_csv_chunks(path, chunk_rows):
+                chunk.reindex(columns=columns).to_csv(out_file, index=False, header=False)
+                rows += len(chunk)
+    logging.info(f'{rows} rows streamed to {out_path} (peak RSS {peak_rss_mb():.1f} MB)')
+    return rows
+
+
+# Text cells of a workbook as the CSV exports hold them, dates included
+def _xlsx_cell_to_text(value):
+    text = _cell_to_text(value)
+    return None if text in na_values() else text
+
+
+# Parse one export in full, used as the worker of the process pool. Every column the data dictionary
+# describes is parsed straight into its compiled dtype, so the frames of all exports already agree
+# on those dtypes and nothing has to be converted after parsing.
+def read_export(path):
+    dtype = schema_dtypes(_raw_header(path))
+    if is_xlsx(path):
+        text_columns = [column for column, column_dtype in dtype.items() if column_dtype == 'str']
+        frame = pd.read_excel(path, engine='openpyxl', na_values=na_values(),
+                              dtype={column: dtype[column] for column in dtype if column not in text_columns},
+                              converters={column: _xlsx_cell_to_text for column in text_columns})
+    else:
+        frame = pd.read_csv(path, low_memory=False, dtype=dtype, na_values=na_values())
+    frame.columns = rename_v3_columns(frame.columns)
+    return frame
+
+
+# Work out one dtype per column that every frame can be cast to without losing values.
+# Columns missing from some of the frames are filled with NaN, so integer columns become float64
+# and boolean columns become object, the same result pd.concat gives but decided once up front.
+# Nullable integer columns (the ids) hold the missing values as they are.
+def reconcile_dtypes(frames, columns):
+    dtypes = {}
+    for column in columns:
+        found = [frame[column].dtype for frame in frames if column in frame.columns]
+        if all(dtype == found[0] for dtype in found):
+            dtype = found[0]
+        elif all(isinstance(dtype, np.dtype) and pd.api.types.is_numeric_dtype(dtype) and
+                 not pd.api.types.is_bool_dtype(dtype) for dtype in found):
+            dtype = np.result_type(*found)
+        else:
+            dtype = np.dtype(object)
+
+        if len(found) < len(frames):
+            if pd.api.types.is_bool_dtype(dtype):
+                dtype = np.dtype(object)
+            elif isinstance(dtype, np.dtype) and pd.api.types.is_integer_dtype(dtype):
+                dtype = np.dtype('float64')
+        dtypes[column] = dtype
+    return dtypes
+
+
+# Give a frame exactly the combined columns (in order) and dtypes of the schema
+def coerce_to_schema(frame, columns, dtypes):
+    frame = frame.reindex(columns=columns)
+    mismatched = {column: dtype for column, dtype in dtypes.items() if frame[column].dtype != dtype}
+    if mismatched:
+        frame = frame.astype(mismatched)
+    return frame
+
+
+# Concatenate frames whose column sets differ, after coercing all of them to one combined schema
+def concat_with_schema(frames, columns=None):
+    if columns is None:
+        columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    dtypes = reconcile_dtypes(frames, columns)
+    return pd.concat([coerce_to_schema(frame, columns, dtypes) for frame in frames], ignore_index=True)
+
+
+# Parse every export in a process pool and combine them into one frame.
+# The combined column list comes from a header only scan, so it is known before any file is parsed.
+def read_exports(paths, max_workers=None):
+    paths = list(paths)
+    columns = union_columns(paths)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(paths) or 1)
+
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(read_export, paths))
+    else:
+        frames = [read_export(path) for path in paths]
+
+    logging.info(f'Parsed {len(paths)} exports with {max_workers} worker(s), {len(columns)} combined columns')
+    return concat_with_schema(frames, columns)
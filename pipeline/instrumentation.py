@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from pipeline.ingestion import peak_rss_mb
+
+# pyarrow is optional, without it the nullable columns are converted to numpy and so count as copies
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Rows of the output whose values differ from the input in the columns both have, and the columns
+# with values that were missing or zero in the input and were filled in. Rows can only be matched when the
+# stage kept the index, so for stages that drop or reorder rows only the row counts are recorded.
+def frame_changes(before, after):
+    if not isinstance(before, pd.DataFrame) or not isinstance(after, pd.DataFrame) \
+            or not before.index.equals(after.index):
+        return None, []
+
+    changed = np.zeros(len(after), dtype=bool)
+    imputed = []
+    for column in after.columns:
+        if column not in before.columns or before[column] is after[column]:
+            continue
+        old, new = before[column], after[column]
+        try:
+            differs = ~((old == new) | (old.isna() & new.isna())).to_numpy()
+        except TypeError:
+            # e.g. categoricals with other categories, every row counts as changed
+            differs = np.ones(len(after), dtype=bool)
+        changed |= differs
+        filled = (old.isna() | (old == 0)).to_numpy() & new.notna().to_numpy() & differs
+        if filled.any():
+            imputed.append(column)
+    return int(changed.sum()), imputed
+
+
+def _rows(frame):
+    return len(frame) if isinstance(frame, pd.DataFrame) else None
+
+
+# The memory a column keeps its values in, as numpy arrays and Arrow buffers: the array of numpy columns,
+# the codes of categoricals (their categories are small and shared), and the Arrow buffers of Arrow-backed
+# columns, such as the string columns, and of nullable columns such as the Int32 ids. Arrow shares the
+# values of a nullable column but makes its validity bitmap from the mask, so the mask counts as copied,
+# at an eighth of its size, or not at all when nothing is missing. The values of nullable booleans, which
+# Arrow packs into bits, count as copied too. Other extension arrays are converted to numpy and so count
+# as copies.
+def column_memory(series):
+    array = series.array
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return [array.codes]
+    if pa is not None and hasattr(array, '__arrow_array__'):
+        arrow = array.__arrow_array__()
+        # Arrow-backed columns give a chunked array, nullable ones a single array
+        chunks = getattr(arrow, 'chunks', [arrow])
+        return [buffer for chunk in chunks for buffer in chunk.buffers() if buffer is not None]
+    return [np.asarray(array)]
+
+
+# The (address, bytes) range of a numpy array or an Arrow buffer
+def _range(values):
+    if isinstance(values, np.ndarray):
+        return values.__array_interface__['data'][0], values.nbytes
+    return values.address, values.size
+
+
+def _frame_memory(df):
+    return [values for column in df.columns for values in column_memory(df[column])]
+
+
+def _shares(buffer, buffers):
+    address, size = buffer
+    return any(address < other + other_size and other < address + size for other, other_size in buffers)
+
+
+# Bytes held by the input and output frames of a stage, and the bytes of the output's column memory that
+# the stage allocated rather than shared with the input: copies, filtered rows and new columns alike.
+# Under copy-on-write a stage that leaves a column as it is shares its memory, so the copies add up
+# to what the stage really allocated for the frames.
+def frame_copies(before, after):
+    if not isinstance(after, pd.DataFrame):
+        return {}
+    # The memory of both frames is held until the ranges are compared, so the arrays and buffers made for
+    # the comparison are not freed and their addresses reused by the next ones
+    after_memory = _frame_memory(after)
+    before_memory = _frame_memory(before) if isinstance(before, pd.DataFrame) else []
+    after_buffers = {_range(values) for values in after_memory}
+    before_buffers = {_range(values) for values in before_memory}
+    return {
+        'bytes_in': sum(size for _, size in before_buffers) if isinstance(before, pd.DataFrame) else None,
+        'bytes_out': sum(size for _, size in after_buffers),
+        'bytes_copied': sum(size for address, size in after_buffers if not _shares((address, size), before_buffers)),
+    }
+
+
+# Records every stage of a cleaning run: wall and CPU time, rows in and out, rows changed, the columns
+# imputed and how much the peak memory of the process grew. Comparing the frames costs about as much as
+# the stages, so it is only done when a run asks for the records. With audit_memory every stage also
+# records the bytes it copied, see frame_copies.
+class StageRecorder:
+    def __init__(self, audit_memory=False):
+        self.records = []
+        self.variant = None
+        self.audit_memory = audit_memory
+        self.started = time.perf_counter()
+
+    # Stages run after this are recorded for the named variant, None for stages the variants share
+    def start_variant(self, name):
+        self.variant = name
+
+    def run(self, stage_name, stage, *args):
+        peak_before = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = stage(*args)
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+
+        before = args[0] if args and isinstance(args[0], pd.DataFrame) else None
+        rows_changed, columns_imputed = frame_changes(before, result)
+        self.records.append({
+            'stage': stage_name,
+            'variant': self.variant,
+            'reused': False,
+            'start_s': round(wall_start - self.started, 6),
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'rows_in': _rows(before),
+            'rows_out': _rows(result),
+            'rows_changed': rows_changed,
+            'columns_imputed': columns_imputed,
+            'peak_rss_delta_mb': round(peak_rss_mb() - peak_before, 1),
+            **(frame_copies(before, result) if self.audit_memory else {}),
+        })
+        return result
+
+    # A stage another variant already ran, taken from the stage cache
+    def reused(self, stage_name):
+        self.records.append({'stage': stage_name, 'variant': self.variant, 'reused': True,
+                             'start_s': round(time.perf_counter() - self.started, 6)})
+
+    # The records of a variant's own stages and of the shared stages before them
+    def variant_records(self, name):
+        return [record for record in self.records if record['variant'] in (None, name)]
+
+    def save(self, path, records):
+        with open(path, 'w') as file:
+            json.dump({'peak_rss_mb': round(peak_rss_mb(), 1), 'stages': records}, file, indent=2)
+            file.write('\n')
+        logging.info(f'Stage records saved to {path}\n')
+        if self.audit_memory:
+            self.log_copies(records)
+
+    # The bytes the stages copied, against the size of the first frame recorded, the loaded data
+    def log_copies(self, records):
+        audited = [record for record in records if record.get('bytes_out') is not None]
+        if not audited:
+            return
+        loaded = audited[0]['bytes_out']
+        for record in audited:
+            logging.info(f'{record["stage"]}: copied {record["bytes_copied"] / 2 ** 20:.1f} MB')
+        copied = sum(record['bytes_copied'] for record in audited[1:])
+        logging.info(f'The stages after {audited[0]["stage"]} copied {copied / 2 ** 20:.1f} MB, '
+                     f'{copied / loaded if loaded else 0:.2f} times the {loaded / 2 ** 20:.1f} MB loaded\n')
+
+    # The whole run in the Chrome trace event format, for chrome://tracing or https://ui.perfetto.dev.
+    # Every variant gets its own row, reused stages are left out.
+    def save_trace(self, path):
+        variants = list(dict.fromkeys(record['variant'] or 'shared' for record in self.records))
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': variant}}
+                  for tid, variant in enumerate(variants)]
+        for record in self.records:
+            if record['reused']:
+                continue
+            events.append({
+                'name': record['stage'],
+                'ph': 'X',
+                'ts': record['start_s'] * 1e6,
+                'dur': record['wall_s'] * 1e6,
+                'pid': os.getpid(),
+                'tid': variants.index(record['variant'] or 'shared'),
+                'args': {key: value for key, value in record.items() if key not in ('stage', 'start_s', 'wall_s')},
+            })
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        logging.info(f'Chrome trace saved to {path}\n')
+
+
+# Run a stage, recording it when the run has a recorder
+def run_recorded(recorder, stage_name, stage, *args):
+    if recorder is None:
+        return stage(*args)
+    return recorder.run(stage_name, stage, *args)
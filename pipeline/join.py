@@ -0,0 +1,149 @@
+import csv
+import heapq
+import logging
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pipeline.dedupe import ROW_COLUMN, bucket_file_path, partition_by_key
+from pipeline.ingestion import concat_with_schema, peak_rss_mb, read_header
+from pipeline.schema import schema_dtypes
+
+KEY_COLUMN = 'PatientId'
+
+# The target columns of each risk tool are only taken from that tool's export. Every other column is taken
+# from the CAROC row and filled in from the FRAX row where the CAROC row is missing a value.
+CAROC_TARGETS = ['bmdtest_10yr_caroc', 'CarocBasalRiskLevel', 'CarocWithCF', 'CarocWithSQ']
+FRAX_TARGETS = ['bmdtest_10yr_frax', 'FraxRiskPercentage', 'FraxRiskLevel', 'CalcFraxWithBMD', 'CalcFraxNoBMD']
+
+# 0 for rows that come from a CAROC export, 1 for FRAX-only patients. Together with the input row position
+# it gives the order of the joined table: CAROC patients first, then FRAX-only patients, each in input order.
+SOURCE_COLUMN = '_source'
+
+
+# The nullable dtype of an integer dtype, e.g. int32 -> Int32. Nullable dtypes are returned as they are.
+def _nullable(dtype):
+    dtype = pd.api.types.pandas_dtype(dtype)
+    return pd.api.types.pandas_dtype(dtype.name.replace('int', 'Int').replace('uInt', 'UInt'))
+
+
+# Hash join of the CAROC and FRAX frames on PatientId, giving one row per patient with both target families.
+# Only the first row of a patient in each family is used, the same row remove_duplicates_with_id keeps.
+def hash_join(caroc, frax, key=KEY_COLUMN):
+    caroc = caroc.drop_duplicates(subset=[key])
+    frax = frax.drop_duplicates(subset=[key])
+    columns = list(dict.fromkeys([*caroc.columns, *frax.columns]))
+
+    # Build the hash table on the FRAX rows and probe it with the CAROC keys
+    frax_by_key = frax.set_index(key)
+    matched = frax_by_key.reindex(caroc[key].to_numpy())
+    matched.index = caroc.index
+
+    targets = CAROC_TARGETS + FRAX_TARGETS
+    shared = [column for column in frax_by_key.columns if column not in targets]
+    frax_targets = [column for column in FRAX_TARGETS if column in frax_by_key.columns]
+
+    # Integer columns pick up NaN from the patients the other family does not have, which makes them float
+    # (1652.0). They are put back to nullable integers so the ids are written as the exports hold them:
+    # the columns the data dictionary gives an integer dtype, when they were read as numbers, and the
+    # columns both frames read as integers.
+    schema_integers = {column: dtype for column, dtype in schema_dtypes(columns).items()
+                       if pd.api.types.is_integer_dtype(dtype)}
+    integer_dtypes = {}
+    for column in columns:
+        dtypes = [frame[column].dtype for frame in (caroc, frax) if column in frame.columns]
+        if all(pd.api.types.is_integer_dtype(dtype) for dtype in dtypes):
+            integer_dtypes[column] = _nullable(schema_integers.get(column) or np.result_type(*dtypes))
+        elif column in schema_integers and all(pd.api.types.is_float_dtype(dtype) or
+                                               pd.api.types.is_integer_dtype(dtype) for dtype in dtypes):
+            integer_dtypes[column] = _nullable(schema_integers[column])
+
+    joined = caroc.reindex(columns=columns)
+    joined[shared] = joined[shared].combine_first(matched[shared])
+    joined[frax_targets] = matched[frax_targets]
+
+    frax_only = frax[~frax[key].isin(caroc[key])].reindex(columns=columns)
+    caroc_targets = [column for column in CAROC_TARGETS if column in columns]
+    frax_only[caroc_targets] = np.nan
+
+    joined = concat_with_schema([joined, frax_only], columns)
+    return joined.astype(integer_dtypes)
+
+
+# A family file as the joins read it: raw strings, with only the empty cells missing, so the joined file
+# holds the values as the exports wrote them
+def read_family(path):
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+
+
+# Join the family files in memory. Gives the same file, to the byte, as join_out_of_core.
+def join_in_memory(caroc_path, frax_path, out_path, key=KEY_COLUMN):
+    joined = hash_join(read_family(caroc_path), read_family(frax_path), key)
+    joined.to_csv(out_path, index=False)
+    logging.info(f'{len(joined)} patients written to {out_path}')
+    return len(joined)
+
+
+# Join one pair of buckets and write the result sorted on its position in the joined table
+def join_bucket(caroc_path, frax_path, out_path, columns, key=KEY_COLUMN):
+    caroc = read_family(caroc_path)
+    frax = read_family(frax_path)
+    caroc[SOURCE_COLUMN] = 0
+    frax[SOURCE_COLUMN] = 1
+
+    joined = hash_join(caroc, frax, key)
+    joined = joined.astype({SOURCE_COLUMN: 'int64', ROW_COLUMN: 'int64'})
+    joined = joined.sort_values([SOURCE_COLUMN, ROW_COLUMN])
+    joined[[SOURCE_COLUMN, ROW_COLUMN, *columns]].to_csv(out_path, index=False)
+    return len(joined)
+
+
+def _iter_joined_rows(path):
+    with open(path, newline='') as joined_file:
+        reader = csv.reader(joined_file)
+        next(reader)
+        for row in reader:
+            yield (int(row[0]), int(row[1])), row[2:]
+
+
+# Join for inputs that do not fit in memory. Both families are hash-partitioned on PatientId into matching
+# on-disk buckets, each pair of buckets is joined in memory in a process pool, and the joined buckets are
+# merged back in the same row order hash_join gives on the whole frames.
+def join_out_of_core(caroc_path, frax_path, out_path, partitions=16, chunk_rows=100000, max_workers=None,
+                     key=KEY_COLUMN):
+    columns = list(dict.fromkeys([*read_header(caroc_path), *read_header(frax_path)]))
+    bucket_root = Path(out_path).resolve().parent
+
+    with tempfile.TemporaryDirectory(prefix='join-', dir=bucket_root) as bucket_dir:
+        caroc_dir = Path(bucket_dir) / 'caroc'
+        frax_dir = Path(bucket_dir) / 'frax'
+        joined_dir = Path(bucket_dir) / 'joined'
+        for folder in (caroc_dir, frax_dir, joined_dir):
+            folder.mkdir()
+
+        partition_by_key(caroc_path, caroc_dir, partitions, chunk_rows, key)
+        partition_by_key(frax_path, frax_dir, partitions, chunk_rows, key)
+
+        caroc_paths = [bucket_file_path(caroc_dir, bucket) for bucket in range(partitions)]
+        frax_paths = [bucket_file_path(frax_dir, bucket) for bucket in range(partitions)]
+        joined_paths = [bucket_file_path(joined_dir, bucket) for bucket in range(partitions)]
+        bucket_args = (caroc_paths, frax_paths, joined_paths, [columns] * partitions, [key] * partitions)
+
+        max_workers = min(max_workers or os.cpu_count() or 1, partitions)
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                rows = sum(executor.map(join_bucket, *bucket_args))
+        else:
+            rows = sum(map(join_bucket, *bucket_args))
+
+        with open(out_path, 'w', newline='') as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(columns)
+            for _, row in heapq.merge(*[_iter_joined_rows(path) for path in joined_paths], key=lambda item: item[0]):
+                writer.writerow(row)
+
+    logging.info(f'{rows} patients written to {out_path} (peak RSS {peak_rss_mb():.1f} MB)')
+    return rows
@@ -0,0 +1,190 @@
+import logging
+import os
+import pickle
+import sys
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# scipy is optional, only the knn stage needs it
+try:
+    from scipy.spatial import KDTree
+except ImportError:
+    KDTree = None
+
+# Bump when the layout of a saved model changes
+KNN_FORMAT = 1
+
+# The measurements filled from their nearest neighbours, and the ones where 0 means not measured
+KNN_COLUMNS = ['bmdtest_tscore_fn', 'bmdtest_height', 'bmdtest_weight']
+ZERO_MISSING = ['bmdtest_height', 'bmdtest_weight']
+
+# A missing value is filled with the mean of this many neighbours
+NEIGHBOURS = 5
+
+# Rows are looked up in batches so the neighbour arrays of millions of rows are never held at once;
+# every batch is spread over all the cores (workers=-1)
+BATCH_ROWS = 1 << 16
+WORKERS = -1
+
+# The frames returned by apply_knn keep the model they were filled with under this attrs key,
+# so it can be saved with the cleaned data
+KNN_ATTR = 'knn'
+
+
+# A fitted model: how the features are standardised, and per filled column a KD-tree over the features
+# of the rows that have a value (the donors). The answers are mostly yes/no, so many donors share their
+# features; the tree only holds the distinct points, with the number of donors at each and the mean of
+# their values, as a query among thousands of equal points is as slow as a scan. Frames keep it in their attrs,
+# which pandas deep-copies on every operation; a fitted model is never changed, so copies share it.
+class KnnModel:
+    def __init__(self, features, means, scales, neighbours, columns):
+        self.format = KNN_FORMAT
+        self.features = features
+        self.means = means
+        self.scales = scales
+        self.neighbours = neighbours
+        self.columns = columns
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _missing(series):
+    missing = series.isna().to_numpy()
+    if series.name in ZERO_MISSING:
+        missing = missing | (series == 0).to_numpy()
+    return missing
+
+
+def _values(df, column):
+    values = df[column].to_numpy(dtype='float64', na_value=np.nan)
+    return np.where(_missing(df[column]), np.nan, values)
+
+
+# The rows' features standardised with the fitted means and scales. A missing feature is put at the mean,
+# so it does not pull the row towards any neighbour.
+def feature_matrix(df, features, means, scales):
+    matrix = np.empty((len(df), len(features)))
+    for index, column in enumerate(features):
+        matrix[:, index] = (_values(df, column) - means[column]) / scales[column]
+    return np.nan_to_num(matrix, nan=0.0)
+
+
+# The distinct rows of a matrix, and the number of the distinct row of each row. The rows are compared as
+# bytes, which is exact and much faster than np.unique(axis=0), which sorts them column by column.
+def distinct_rows(matrix):
+    matrix = np.ascontiguousarray(matrix)
+    index, _ = pd.factorize(matrix.view(np.dtype((np.void, matrix.itemsize * matrix.shape[1]))).ravel())
+    _, first = np.unique(index, return_index=True)
+    return matrix[first], index
+
+
+# Fit the model on the frame: the neighbours of a row are found on the standardised features other than
+# the column being filled (the numeric measurements and the yes/no answers, see knn_features)
+def fit_knn(df, columns, features, neighbours=NEIGHBOURS):
+    if KDTree is None:
+        raise ValueError('The knn stage needs the scipy package, install it with pip install scipy')
+    means, scales = {}, {}
+    for column in features:
+        values = _values(df, column)
+        means[column] = float(np.nanmean(values)) if np.isfinite(values).any() else 0.0
+        scale = float(np.nanstd(values)) if np.isfinite(values).any() else 0.0
+        scales[column] = scale if scale > 0 else 1.0
+
+    model = KnnModel(features, means, scales, neighbours, {})
+    rows, row_index = distinct_rows(feature_matrix(df, features, means, scales))
+    for column in columns:
+        column_features = [feature for feature in features if feature != column]
+        donors = ~_missing(df[column])
+        values = df[column].to_numpy(dtype='float64', na_value=np.nan)[donors]
+        # The donors of each distinct row, then of each distinct point once the column is left out
+        row_counts = np.bincount(row_index[donors], minlength=len(rows))
+        row_sums = np.bincount(row_index[donors], weights=values, minlength=len(rows))
+        points, point_index = distinct_rows(rows[:, [features.index(feature) for feature in column_features]])
+        counts = np.bincount(point_index, weights=row_counts, minlength=len(points)).astype('int64')
+        sums = np.bincount(point_index, weights=row_sums, minlength=len(points))
+        has_donors = counts > 0
+        model.columns[column] = {
+            'features': column_features,
+            'tree': KDTree(points[has_donors]) if has_donors.any() else None,
+            'counts': counts[has_donors],
+            'values': sums[has_donors] / counts[has_donors],
+        }
+    return model
+
+
+# The mean value of the nearest donors of every row. The nearest distinct points are taken in order of
+# distance, each with as many of its donors as are still needed, so a point shared by many donors counts
+# as many neighbours. Equal rows are looked up once, BATCH_ROWS distinct rows at a time.
+def _neighbour_means(entry, matrix, neighbours, workers):
+    rows, row_index = distinct_rows(matrix)
+    k = min(neighbours, len(entry['counts']))
+    wanted = min(neighbours, int(entry['counts'].sum()))
+    means = np.empty(len(rows))
+    for start in range(0, len(rows), BATCH_ROWS):
+        batch = rows[start:start + BATCH_ROWS]
+        _, indices = entry['tree'].query(batch, k=k, workers=workers)
+        indices = indices.reshape(len(batch), k)
+        counts = entry['counts'][indices]
+        taken = np.clip(wanted - (np.cumsum(counts, axis=1) - counts), 0, counts)
+        means[start:start + BATCH_ROWS] = (taken * entry['values'][indices]).sum(axis=1) / wanted
+    return means[row_index]
+
+
+# Fill the model's columns that the frame has, returning a new frame. Columns without donors are left
+# as they are, for the imputation to fill.
+def apply_knn(df, model, workers=WORKERS):
+    filled = {}
+    for column, entry in model.columns.items():
+        if column not in df or entry['tree'] is None:
+            continue
+        missing = _missing(df[column])
+        if not missing.any():
+            continue
+        matrix = feature_matrix(df[missing], entry['features'], model.means, model.scales)
+        values = df[column].to_numpy(copy=True)
+        values[missing] = _neighbour_means(entry, matrix, model.neighbours, workers).astype(values.dtype)
+        filled[column] = pd.Series(values, index=df.index, name=column)
+        logging.info(f'Filled {int(missing.sum())} values of {column} from their {model.neighbours} nearest neighbours')
+
+    df = df.assign(**filled)
+    df.attrs[KNN_ATTR] = model
+    return df
+
+
+def knn_stage(df, columns, features, neighbours=NEIGHBOURS):
+    return apply_knn(df, fit_knn(df, columns, features, neighbours))
+
+
+# The model is saved as a plain dict with the trees, so it loads without this module on the path
+def save_knn(model, path):
+    tmp_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(vars(model), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_knn(path):
+    with open(path, 'rb') as file:
+        saved = pickle.load(file)
+    if saved.get('format') != KNN_FORMAT:
+        raise ValueError(f'{path} has knn format {saved.get("format")}, expected {KNN_FORMAT}')
+    return KnnModel(saved['features'], saved['means'], saved['scales'], saved['neighbours'], saved['columns'])
+
+
+# Fill new records, in the columns and units of the cleaned data, from the neighbours saved by a cleaning run,
+# e.g. before batch scoring:
+# python pipeline/knn.py <model.knn.pkl> <records.csv> <imputed.csv>
+if __name__ == "__main__":
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+    from pipeline.schema import na_values
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        model = load_knn(sys.argv[1])
+        records = pd.read_csv(sys.argv[2], na_values=na_values())
+        apply_knn(records, model).to_csv(sys.argv[3], index=False)
+        logging.info(f'Imputed {len(records)} records into {sys.argv[3]}')
+    except ValueError as er:
+        logging.error(str(er))
@@ -0,0 +1,137 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from itertools import repeat
+
+from pipeline.cleaning import (add_risk_levels, derive_stage, fill_bmi, label_stage, load_variants, metric_stage,
+                               select_stage, variant_columns, write_stage, BMI_STEPS)
+from pipeline.dedupe import dedupe_rows
+from pipeline.imputation import (IMPUTER_ATTR, apply_imputer, imputer_from_statistics, merge_statistics,
+                                 partial_statistics)
+from pipeline.instrumentation import run_recorded
+from pipeline.validation import validate_stage
+
+# The partitions of the loaded frame in a worker, set by the pool initializer. With the fork start method
+# the workers share the parent's frames instead of being sent a copy with every task.
+_partitions = None
+
+
+def _set_partitions(partitions):
+    global _partitions
+    _partitions = partitions
+
+
+# Split the rows by a hash of the id columns, so every duplicate of a patient is in the same partition and
+# the partitions can be deduplicated on their own. The rows keep their position in the frame as index.
+# pd.util.hash_pandas_object is deterministic, so the split is the same on every run.
+def partition_frame(df, id_cols, partitions):
+    buckets = pd.util.hash_pandas_object(df[id_cols], index=False).to_numpy() % partitions
+    return [rows for _, rows in df.groupby(buckets, sort=True)]
+
+
+# The stages before the imputation, on one partition. They work row by row, or on the rows of one patient,
+# so they give the rows of the serial path, with the index of the rows in the loaded frame.
+def _prepare(index, variant, validate, dedupe):
+    completeness = variant_columns(variant) if dedupe == 'most_complete' else []
+    df = dedupe_rows(_partitions[index], variant['id_cols'], dedupe, completeness)
+    quarantined = None
+    if validate:
+        df, quarantined = validate_stage(df, variant_columns(variant))
+    df = select_stage(metric_stage(df), variant_columns(variant))
+    return df, quarantined
+
+
+# Map: the imputation statistics and the column dtypes of one partition
+def _partition_statistics(index, variant, validate, dedupe):
+    df, _ = _prepare(index, variant, validate, dedupe)
+    return partial_statistics(df, variant['impute']), df.dtypes.astype(str).to_dict()
+
+
+# Map: one partition cleaned with the imputer of all the data. The columns are cast to the dtypes of the
+# whole frame first, e.g. heights that are float32 in one partition and float64 in another. Returns the
+# partition before the BMI fill, the rows it quarantined and the BMI statistics.
+def _clean_partition(index, variant, validate, dedupe, imputer, dtypes):
+    df, quarantined = _prepare(index, variant, validate, dedupe)
+    df = df.astype({column: dtype for column, dtype in dtypes.items() if str(df[column].dtype) != dtype})
+    df = derive_stage(apply_imputer(df, imputer), variant['risk_levels'], False)
+    bmi_statistics = partial_statistics(df, BMI_STEPS) if variant['bmi_fill'] else None
+    df = label_stage(df, variant['label'], variant['target_cols'])
+    return df, quarantined, bmi_statistics
+
+
+def _merge_dtypes(first, second):
+    return {column: dtype if dtype == second[column] else str(np.result_type(dtype, second[column]))
+            for column, dtype in first.items()}
+
+
+def _concat(frames):
+    frames = [df for df in frames if len(df)] or frames[:1]
+    return pd.concat(frames).sort_index(kind='stable')
+
+
+def _map(executor, function, count, *args):
+    if executor is None:
+        return [function(index, *args) for index in range(count)]
+    return list(executor.map(function, range(count), *[repeat(arg) for arg in args]))
+
+
+# Clean a variant in two map phases over the partitions, with a reduce in this process after each:
+# the partitions' statistics are merged into the imputer of all the data, which every partition is then
+# cleaned with. The statistics are exact sums and counts (see pipeline/imputation.py), which add up to the
+# statistics of the serial path however the rows are split, so the imputer is the serial one. The cleaned
+# rows are put back in the order of the loaded frame.
+def clean_partitions(partitions, variant, validate=False, workers=1, dedupe='first'):
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_set_partitions, initargs=(partitions,))
+    else:
+        _set_partitions(partitions)
+    try:
+        results = _map(executor, _partition_statistics, len(partitions), variant, validate, dedupe)
+        statistics = reduce(merge_statistics, [result[0] for result in results])
+        dtypes = reduce(_merge_dtypes, [result[1] for result in results])
+        imputer = imputer_from_statistics(statistics, variant['impute'])
+
+        results = _map(executor, _clean_partition, len(partitions), variant, validate, dedupe, imputer, dtypes)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _set_partitions(None)
+
+    df = _concat([result[0] for result in results])
+    df.attrs = {IMPUTER_ATTR: imputer}
+    if variant['bmi_fill']:
+        bmi_statistics = reduce(merge_statistics, [result[2] for result in results])
+        df = fill_bmi(df, imputer_from_statistics(bmi_statistics, BMI_STEPS))
+    df = df.reset_index(drop=True)
+    quarantined = _concat([result[1] for result in results]) if validate else None
+    return df, quarantined
+
+
+# Run the cleaning stages of each variant on hash partitions of the loaded frame in a process pool of
+# workers, one per core by default. More partitions than workers evens out partitions of different sizes.
+# The knn stage needs the donors of all the data in one tree, so it only runs on the pandas backend.
+def parallel_backend(names, file_name, recorder=None, validate=False, workers=None, partitions=None, knn=False,
+                     dedupe='first'):
+    if knn:
+        raise ValueError('The parallel backend does not run the knn stage, run it with the pandas backend')
+    cache = {}
+    loadable, key, df = load_variants(names, file_name, cache, recorder, dedupe)
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers
+    split = {}
+
+    def unclean(variant):
+        return add_risk_levels(select_stage(df, variant_columns(variant)), variant['risk_levels'])
+
+    def clean(variant):
+        id_cols = tuple(variant['id_cols'])
+        if id_cols not in split:
+            split[id_cols] = run_recorded(recorder, 'partition', partition_frame, df, list(id_cols), partitions)
+            logging.info(f'Cleaning {len(split[id_cols])} partitions with {workers} workers')
+        return run_recorded(recorder, 'clean', clean_partitions, split[id_cols], variant, validate, workers, dedupe)
+
+    return loadable, unclean, clean, write_stage
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+import sweetviz
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# How the reports of a cleaning run are made
+#   background  in a process pool, while the cleaning stages go on
+#   inline      one after the other, between the cleaning stages
+#   skip        not at all, for production runs that only need the cleaned data
+REPORT_MODES = ['background', 'inline', 'skip']
+
+# The gender report compares the women (PatientGender 1) with the men (2)
+GENDER_COLUMN = 'PatientGender'
+GENDER_NAMES = ('Female', 'Male')
+
+# Bump when the reports change for the same data, so the reports made before are not reused
+REPORT_FORMAT = 1
+
+# Every report folder records the key each of its reports was made with, see report_key
+REPORT_KEYS = 'report_keys.json'
+
+
+# Lets create a report using sweetviz
+def create_html_report(data, save_path):
+    try:
+        logging.info(f'Creating sweetviz graph for {save_path}')
+        temp_analysis = sweetviz.analyze(data)
+        temp_analysis.show_html(str(save_path), open_browser=False)
+        return True
+
+    except ValueError as er:
+        logging.error(str(er))
+        return False
+
+
+# One report of the female data side by side with the male data. compare_intra profiles both halves in
+# one go, where separate female and male reports analysed the data twice and could not be compared.
+# The gender column is left out, it is the same on every row of each half. sweetviz raises a TypeError
+# when a column has a different type in the two halves.
+def create_gender_report(data, save_path):
+    try:
+        logging.info(f'Creating sweetviz gender comparison for {save_path}')
+        data = data[data[GENDER_COLUMN].isin([1, 2])]
+        temp_analysis = sweetviz.compare_intra(data, data[GENDER_COLUMN] == 1, GENDER_NAMES,
+                                               feat_cfg=sweetviz.FeatureConfig(skip=GENDER_COLUMN))
+        temp_analysis.show_html(str(save_path), open_browser=False)
+        return True
+
+    except (ValueError, TypeError) as er:
+        logging.error(str(er))
+        return False
+
+
+# The reports on a frame: all the data, and the female data compared to the male data
+def report_jobs(report_dir, name):
+    return [
+        (create_html_report, report_dir / f'{name}.html'),
+        (create_gender_report, report_dir / f'{name}_by_gender.html'),
+    ]
+
+
+# SHA-256 of the frame's columns, dtypes and values. hash_pandas_object hashes all the rows in one
+# vectorised pass, a fraction of a second where profiling the same frame takes minutes.
+def frame_fingerprint(df):
+    digest = hashlib.sha256()
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# A report is only made again when its key changes: the data, the kind of report or the sweetviz version
+def report_key(fingerprint, report):
+    config = repr((fingerprint, report.__name__, sweetviz.__version__, REPORT_FORMAT))
+    return hashlib.sha256(config.encode()).hexdigest()[:16]
+
+
+def load_report_keys(report_dir):
+    try:
+        with open(Path(report_dir) / REPORT_KEYS) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_report_key(report_dir, report_name, key):
+    keys = load_report_keys(report_dir)
+    keys[report_name] = key
+    tmp_path = Path(report_dir) / f'{REPORT_KEYS}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(keys, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, Path(report_dir) / REPORT_KEYS)
+
+
+# Makes the reports of a cleaning run in the given mode. In background mode the frames are sent to worker
+# processes as they are submitted, so the caller can go on cleaning; use it as a context manager, leaving
+# the block waits for the reports to be written. The frames must not be changed after they are submitted.
+# A report that exists and was made from the same data is kept as it is. Only this process saves the keys,
+# once a report is written, so a report that failed is made again on the next run. A report that raises is
+# logged and the others are still made: the reports come after the cleaned data, which is already written.
+class ReportPool:
+    def __init__(self, mode='background', max_workers=None):
+        if mode not in REPORT_MODES:
+            raise ValueError(f'Unknown report mode {mode}, expected one of {", ".join(REPORT_MODES)}')
+        self.mode = mode
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = {}
+        self.failed = []
+
+    def __enter__(self):
+        if self.mode == 'background':
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.wait()
+            self.executor.shutdown()
+            self.executor = None
+        if self.failed:
+            logging.error(f'{len(self.failed)} reports failed and will be made again on the next run: '
+                          f'{", ".join(str(path) for path in self.failed)}')
+
+    def submit(self, df, report_dir, name):
+        if self.mode == 'skip':
+            return
+        report_dir.mkdir(parents=True, exist_ok=True)
+        keys = load_report_keys(report_dir)
+        fingerprint = frame_fingerprint(df)
+        for report, save_path in report_jobs(report_dir, name):
+            key = report_key(fingerprint, report)
+            if save_path.exists() and keys.get(save_path.name) == key:
+                logging.info(f'Reusing {save_path}, made from the same data')
+            elif self.executor is None:
+                try:
+                    self._saved(report(df, save_path), save_path, key)
+                except Exception as er:
+                    self._failed(save_path, er)
+            else:
+                self.futures[self.executor.submit(report, df, save_path)] = (save_path, key)
+
+    # The report functions log their own errors and return False
+    def _saved(self, written, save_path, key):
+        if written:
+            save_report_key(save_path.parent, save_path.name, key)
+            logging.info(f'Report saved to {save_path}')
+        else:
+            self.failed.append(save_path)
+
+    def _failed(self, save_path, er):
+        logging.error(f'Report {save_path} failed: {type(er).__name__}: {er}')
+        self.failed.append(save_path)
+
+    # Wait for the reports submitted so far
+    def wait(self):
+        if self.futures:
+            logging.info(f'Waiting for {len(self.futures)} reports\n')
+        for future in as_completed(self.futures):
+            save_path, key = self.futures[future]
+            try:
+                self._saved(future.result(), save_path, key)
+            except Exception as er:
+                self._failed(save_path, er)
+        self.futures = {}
@@ -0,0 +1,52 @@
+from pipeline.dictionary import load_schema
+
+# Survey answers are small integer codes (0/1/2...), but they are parsed as float32 rather than int8 so that
+# the cleaned CSVs keep writing them as 1.0 / 2.0, which the one-hot column names used by the model scripts
+# (e.g. 'parentbreak_1.0') depend on. Either way they take half the memory of the float64 pandas infers.
+NUMERIC_DTYPE = 'float32'
+CODE_DTYPE = 'float32'
+
+
+# The V4 name of a column, for V3 exports whose variables were renamed in V4
+def v4_name(column):
+    return load_schema()['renames']['V3'].get(column, column)
+
+
+# Rename the V3 columns of a header to their V4 names. A column is left alone when the header
+# already holds its V4 name, so files that carry both are never given duplicate columns.
+def rename_v3_columns(columns):
+    columns = list(columns)
+    present = set(columns)
+    return [v4_name(column) if v4_name(column) not in present else column for column in columns]
+
+
+# The dtype the data dictionary gives each of the columns, for the columns it describes
+def schema_dtypes(columns):
+    described = load_schema()['columns']
+    return {column: described[v4_name(column)]['dtype'] for column in columns if v4_name(column) in described}
+
+
+# The codes the data dictionary allows in each of the columns, for the coded columns it describes
+def allowed_codes(columns):
+    described = load_schema()['columns']
+    return {column: described[v4_name(column)]['codes'] for column in columns
+            if v4_name(column) in described and described[v4_name(column)]['codes']}
+
+
+# The values the exports use for missing answers
+def na_values():
+    return load_schema()['na_values']
+
+
+# Options for pd.read_csv / read_csv_cached that parse only the columns a cleaning script keeps,
+# straight into the dtypes of the compiled data dictionary. Columns the dictionary does not describe
+# fall back to the dtype of their role, and target columns it does not describe keep the inferred
+# dtype (e.g. CalcFraxWithBMD).
+def projected_read_options(id_cols, numerical_cols, code_cols, target_cols=()):
+    usecols = list(dict.fromkeys([*id_cols, *numerical_cols, *code_cols, *target_cols]))
+
+    dtype = {column: NUMERIC_DTYPE for column in numerical_cols}
+    dtype.update({column: CODE_DTYPE for column in code_cols})
+    dtype.update(schema_dtypes(usecols))
+
+    return {'usecols': usecols, 'dtype': dtype, 'na_values': na_values()}
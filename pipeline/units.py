@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+LBS_TO_KG = 0.45359237
+
+# Weights at or above the top of the normal BMI range for a height band, plus this buffer,
+# are assumed to have been entered in pounds
+OVERWEIGHT_BUFFER = 30
+
+# Upper edges (cm) of the height bands, from 5ft0 to 6ft3 in one inch steps. A band includes its
+# upper edge, so np.searchsorted(..., side='left') gives the band of a height.
+HEIGHT_BAND_EDGES = [152.4, 154.9, 157.5, 160, 162.6, 165.1, 167.6, 170.2, 172.7, 175.3,
+                     177.8, 180.3, 182.9, 185.4, 188, 190.5]
+
+# Top of the normal weight range (kg) of each band, one more entry than there are edges:
+# the first is for heights up to 5ft0 and the last for heights above 6ft3
+HEIGHT_BAND_WEIGHTS = [56.7, 56.7, 59, 61.2, 63.5, 65.8, 68, 70.3, 72.6, 74.8,
+                       77.1, 79.4, 81.6, 83.9, 86.2, 88.5, 90.7]
+
+
+# The values of a column as a float array, keeping float32 columns in float32
+def _as_float_array(values):
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype('float64')
+    return values
+
+
+# Result of the same type as the input, so Series keep their index when assigned back to a frame
+def _like(values, result):
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return result
+
+
+def lbs_to_kg(weight):
+    return _like(weight, _as_float_array(weight) * LBS_TO_KG)
+
+
+# Convert the weights that look too heavy for their height band from pounds to kilograms.
+# The thresholds are compared in the dtype of the columns, the same way the scalar comparisons did.
+def overweight_to_kg(height, weight, buffer=OVERWEIGHT_BUFFER):
+    heights = _as_float_array(height)
+    weights = _as_float_array(weight)
+
+    edges = np.array(HEIGHT_BAND_EDGES, dtype=heights.dtype)
+    limits = np.array([limit + buffer for limit in HEIGHT_BAND_WEIGHTS], dtype=weights.dtype)
+
+    band = np.searchsorted(edges, heights, side='left')
+    overweight = ~np.isnan(heights) & (weights >= limits[band])
+    return _like(weight, np.where(overweight, weights * LBS_TO_KG, weights))
+
+
+# Height in cm and weight in kg for every row, guessing the units from the height:
+# 1 - 2.2 is meters, 50 - 84 is inches (the weight is then taken as pounds) and above 125 is cm.
+# Heights outside those ranges, and missing heights, become 0.
+# With overweight_check the weights of metric rows are also run through overweight_to_kg,
+# which like the per-row version looks up the band with the height as it was entered.
+def to_metric(height, weight, overweight_check=False):
+    heights = _as_float_array(height)
+    weights = _as_float_array(weight)
+
+    is_meters = (heights > 1) & (heights < 2.2)
+    is_inches = (heights > 50) & (heights < 84)
+    is_cm = heights > 125
+
+    height_cm = np.where(is_meters, heights * 100, np.where(is_inches, heights * 2.54, np.where(is_cm, heights, 0)))
+
+    # The per-row version gave the integer 0 for unmatched heights, which made pandas build the
+    # column as float64. Keep that dtype so the cleaned CSVs are written exactly as before.
+    if not (is_meters | is_inches | is_cm).all():
+        height_cm = height_cm.astype('float64')
+
+    weight_kg = weights
+    if overweight_check:
+        weight_kg = overweight_to_kg(heights, weights)
+    weight_kg = np.where(is_inches, weights * LBS_TO_KG, weight_kg)
+
+    return _like(height, height_cm), _like(weight, weight_kg)
+
+
+# Height in cm and weight in kg. np.square multiplies, where the per-row version used pow(), so a BMI
+# can differ from it in the last bit.
+def bmi(height, weight):
+    heights = _as_float_array(height) / 100
+    result = _as_float_array(weight) / np.square(heights)
+    if isinstance(height, pd.Series):
+        return pd.Series(result, index=height.index)
+    return result
@@ -0,0 +1,108 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from pipeline.knn import ZERO_MISSING
+from pipeline.schema import allowed_codes
+from pipeline.units import to_metric
+
+# Plausible values of the measurements, heights in cm and weights in kg once converted by to_metric.
+# Values outside these ranges are taken as data entry errors rather than as patients.
+PLAUSIBLE_RANGES = {
+    'PatientAge': (18, 110),
+    'bmdtest_height': (120, 220),
+    'bmdtest_weight': (25, 250),
+    'bmdtest_tscore_fn': (-8, 6),
+}
+
+# Reason codes of the rules, one bit each so a row keeps every rule it fails
+#   height_unit   a height in none of the units to_metric recognises, which it would turn into 0
+#   height_range  weight_range  age_range  tscore_range
+#                 a value outside PLAUSIBLE_RANGES
+#   unknown_code  an answer that is not one of the codes the data dictionary allows, see pipeline/dictionary.py
+REASONS = {
+    'height_unit': 1,
+    'height_range': 2,
+    'weight_range': 4,
+    'age_range': 8,
+    'tscore_range': 16,
+    'unknown_code': 32,
+}
+
+# The range rule of each checked column
+RANGE_REASONS = {
+    'PatientAge': 'age_range',
+    'bmdtest_height': 'height_range',
+    'bmdtest_weight': 'weight_range',
+    'bmdtest_tscore_fn': 'tscore_range',
+}
+
+# Columns added to the quarantined rows: the reason bits and their names
+CODE_COLUMN = 'quarantine_code'
+REASONS_COLUMN = 'quarantine_reasons'
+
+# Missing values pass, they are left to the imputation
+def _outside(values, low, high):
+    values = np.asarray(values)
+    return ~np.isnan(values) & ((values < low) | (values > high))
+
+
+# The values with the zeros of the columns that use 0 for missing as NaN, so they pass like NaN
+def _checked_values(column, values):
+    values = np.asarray(values)
+    if column in ZERO_MISSING:
+        return np.where(values == 0, np.nan, values)
+    return values
+
+
+# The reason code of every row, 0 for rows that pass, from whole-column masks: one pass per rule whatever
+# the number of rows. Heights and weights are checked in metric units, converted the way the metric stage
+# will convert them; only the columns given are checked. Heights and weights of 0 pass like missing ones.
+def validation_codes(df, columns=tuple(PLAUSIBLE_RANGES)):
+    codes = np.zeros(len(df), dtype='uint8')
+    values = {column: _checked_values(column, df[column].to_numpy()) for column in columns if column in df}
+
+    if 'bmdtest_height' in values and 'bmdtest_weight' in df:
+        height_cm, weight_kg = to_metric(df['bmdtest_height'], df['bmdtest_weight'])
+        unknown_unit = ~np.isnan(values['bmdtest_height']) & (np.asarray(height_cm) == 0)
+        codes[unknown_unit] |= REASONS['height_unit']
+        # to_metric gives 0 for missing heights as well, neither is checked against the range
+        values['bmdtest_height'] = np.where(np.asarray(height_cm) == 0, np.nan, height_cm)
+        if 'bmdtest_weight' in values:
+            values['bmdtest_weight'] = _checked_values('bmdtest_weight', weight_kg)
+
+    for column, column_values in values.items():
+        if column in PLAUSIBLE_RANGES:
+            codes[_outside(column_values, *PLAUSIBLE_RANGES[column])] |= REASONS[RANGE_REASONS[column]]
+
+    for column, column_codes in allowed_codes([column for column in columns if column in df]).items():
+        codes[(df[column].notna() & ~df[column].isin(column_codes)).to_numpy()] |= REASONS['unknown_code']
+    return codes
+
+
+# The names of the reasons in each code, joined with ';'. Rows share a handful of distinct codes,
+# so the names are built once per code and mapped onto the rows.
+def reason_names(codes):
+    names = {code: ';'.join(name for name, bit in REASONS.items() if code & bit) for code in np.unique(codes)}
+    return pd.Series(codes).map(names).to_numpy()
+
+
+def reason_counts(codes):
+    return {name: int(np.count_nonzero(codes & bit)) for name, bit in REASONS.items()}
+
+
+# Take the rows that fail a rule out of the frame. Returns the rows that pass and the failing rows, as
+# entered and with their reasons, both with the index of the frame. The failing rows are kept out of the
+# attrs of the frame, which pandas copies into every frame made from it.
+# One line is logged per stage, however many rows fail.
+def validate_stage(df, columns):
+    codes = validation_codes(df, columns)
+    failed = codes != 0
+
+    quarantined = df.loc[failed, columns]
+    quarantined[CODE_COLUMN] = codes[failed]
+    quarantined[REASONS_COLUMN] = reason_names(codes[failed])
+
+    counts = ', '.join(f'{name} {count}' for name, count in reason_counts(codes).items() if count)
+    logging.info(f'Quarantined {int(failed.sum())} of {len(df)} rows' + (f': {counts}' if counts else ''))
+    return df[~failed], quarantined
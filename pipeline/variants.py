@@ -0,0 +1,152 @@
+# The cleaning variants built by pipeline/cleaning.py, one per dataset the models are trained on.
+#
+# folder          where the outputs of the variant are written, relative to the repository root
+# id_cols         used when removing duplicate rows
+# numerical_cols  measurements, parsed as float32
+# nominal_cols    survey answers that are filled with their mode
+# special_nominal_cols
+#                 yes/no answers where a missing answer means no, filled with 0
+# target_cols     the columns the models predict
+# impute          (method, columns) steps, see METHODS in pipeline/imputation.py
+# bmi_fill        replace missing and zero BMIs with the mean BMI
+# risk_levels     {new column: FRAX percentage column} of Low/Moderate/High levels to add
+# label           how the target is filled in, see LABELLERS in pipeline/cleaning.py
+# output          the cleaned CSV
+# report_dir      where the sweetviz reports go, None for no reports, relative to the folder
+
+# The settings of where a variant is written, which run_variants can replace
+OUTPUT_KEYS = ['folder', 'output', 'report_dir']
+
+# We will fill null cells with mean
+NUMERICAL_COLS = ['PatientAge',
+                  'bmdtest_height',
+                  'bmdtest_weight',
+                  'bmdtest_tscore_fn']
+
+# We will fill null cells with mode
+NOMINAL_COLS = ['PatientGender',
+                'parentbreak',
+                'ptunsteady',
+                'alcohol',
+                'wasfractdue2fall',
+                'ptfall',
+                'oralster',
+                'smoke']
+
+# We will fill null cells with 0
+SPECIAL_NOMINAL_COLS = ['arthritis',
+                        'cancer',
+                        'diabetes',
+                        'heartdisease',
+                        'respdisease',
+                        'howbreak',
+                        'hip',
+                        'ankle',
+                        'clavicle',
+                        'elbow',
+                        'femur',
+                        'spine',
+                        'wrist',
+                        'shoulder',
+                        'tibfib']
+
+# The web calculator was run without the T-score
+FRAX_WEB_NUMERICAL_COLS = ['PatientAge',
+                           'bmdtest_height',
+                           'bmdtest_weight']
+
+# CAROC also counts other fractures, high blood pressure and cholesterol
+CAROC_SPECIAL_NOMINAL_COLS = ['arthritis',
+                              'cancer',
+                              'diabetes',
+                              'heartdisease',
+                              'respdisease',
+                              'howbreak',
+                              'obreak',
+                              'hbp',
+                              'cholesterol',
+                              'hip',
+                              'ankle',
+                              'clavicle',
+                              'elbow',
+                              'femur',
+                              'spine',
+                              'wrist',
+                              'shoulder',
+                              'tibfib']
+
+# The first version also asked about the patient's living situation
+OLD_NOMINAL_COLS = ['PatientGender',
+                    'parentbreak',
+                    'ptunsteady',
+                    'whereliv',
+                    'education',
+                    'alcohol',
+                    'wasfractdue2fall',
+                    'ptfall',
+                    'fxworried',
+                    'notworking',
+                    'marital',
+                    'oralster',
+                    'smoke']
+
+# The FRAX calculator only asks about these risk factors
+FRAX_NOMINAL_COLS = ['PatientGender',
+                     'parentbreak',
+                     'alcohol',
+                     'oralster',
+                     'smoke']
+
+FRAX_SPECIAL_NOMINAL_COLS = ['arthritis',
+                             'diabetes',
+                             'obreak']
+
+
+def _variant(folder, numerical_cols, nominal_cols, special_nominal_cols, target_cols, numerical_fill,
+             output, report_dir='Output', bmi_fill=True, risk_levels=None, label=None, impute_first=()):
+    return {
+        'folder': folder,
+        'id_cols': ['PatientId'],
+        'numerical_cols': numerical_cols,
+        'nominal_cols': nominal_cols,
+        'special_nominal_cols': special_nominal_cols,
+        'target_cols': target_cols,
+        'impute': [*impute_first,
+                   (numerical_fill, numerical_cols),
+                   ('mode', nominal_cols),
+                   ('zero', special_nominal_cols)],
+        'bmi_fill': bmi_fill,
+        'risk_levels': risk_levels or {},
+        'label': label,
+        'output': output,
+        'report_dir': report_dir,
+    }
+
+
+VARIANTS = {
+    # Main_Cleaning.py: every risk factor, no target
+    'main': _variant('1-Data_Cleaning', NUMERICAL_COLS, NOMINAL_COLS, SPECIAL_NOMINAL_COLS, [],
+                     'mean', 'Clean_Data_Main.csv'),
+
+    # Main_Cleaning_CAROC_v3.py: the CAROC 10 year risk, filled in from the T-score where it is missing
+    'caroc': _variant('1-Data_Cleaning/CAROC', NUMERICAL_COLS, NOMINAL_COLS, CAROC_SPECIAL_NOMINAL_COLS,
+                      ['bmdtest_10yr_caroc'], 'gender_mean', 'Output/Clean_Data_Main.csv', label='caroc'),
+
+    # FRAX_V1/V2: the risk level of the FRAX web calculator, which is run without the T-score
+    'frax_web': _variant('1-Data_Cleaning/FRAX/FRAX_V3', FRAX_WEB_NUMERICAL_COLS, FRAX_NOMINAL_COLS,
+                         FRAX_SPECIAL_NOMINAL_COLS, ['FraxRiskLevel'], 'gender_mean', 'FRAX_V3.csv',
+                         report_dir='.'),
+
+    # FRAX_V3/V4: the FRAX DLL percentages with and without the T-score, and their risk levels
+    'frax_dll': _variant('1-Data_Cleaning/FRAX/FRAX_V3', NUMERICAL_COLS, FRAX_NOMINAL_COLS,
+                         FRAX_SPECIAL_NOMINAL_COLS, ['CalcFraxWithBMD', 'CalcFraxNoBMD'], 'gender_mean',
+                         'Output/FRAX_V3.csv',
+                         risk_levels={'Frax_No_BMD_RiskLevel': 'CalcFraxNoBMD',
+                                      'Frax_BMD_RiskLevel': 'CalcFraxWithBMD'}),
+
+    # Old_Main_Cleaning.py: the first version, with the socio-economic answers and without reports.
+    # Height and weight have their zeros replaced before the BMI is calculated, the BMI is not filled.
+    'old': _variant('1-Data_Cleaning', NUMERICAL_COLS, OLD_NOMINAL_COLS, SPECIAL_NOMINAL_COLS, [],
+                    'mean_nan', 'Clean_Data_Old.csv', report_dir=None,
+                    bmi_fill=False, impute_first=[('zero_then_mean', ['bmdtest_height', 'bmdtest_weight'])]),
+}
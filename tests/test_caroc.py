@@ -0,0 +1,113 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from pipeline.caroc import caroc_labels, caroc_risk, fill_caroc_labels
+
+FRACTURE_COLUMNS = ['hip', 'ankle', 'clavicle', 'elbow', 'femur', 'spine', 'wrist', 'shoulder', 'tibfib']
+
+
+# The per-row CAROC table of Main_Cleaning_CAROC_v3.py the vectorized engine replaced, kept as the reference
+def caroc_risk_row(row):
+    age = row['PatientAge']
+    if row['PatientGender'] == 1:
+        if age < 60:
+            high_bmd, low_bmd = -2.5, -3.8
+        elif age < 65:
+            high_bmd, low_bmd = -2.3, -3.7
+        elif age < 70:
+            high_bmd, low_bmd = -1.9, -3.5
+        elif age < 75:
+            high_bmd, low_bmd = -1.7, -3.2
+        elif age < 80:
+            high_bmd, low_bmd = -1.2, -2.9
+        elif age < 85:
+            high_bmd, low_bmd = -0.5, -2.6
+        else:
+            high_bmd, low_bmd = 0.1, -2.2
+    else:
+        if age < 60:
+            high_bmd, low_bmd = -2.5, -3.9
+        elif age < 65:
+            high_bmd, low_bmd = -2.5, -3.7
+        elif age < 70:
+            high_bmd, low_bmd = -2.4, -3.7
+        elif age < 75:
+            high_bmd, low_bmd = -2.3, -3.7
+        elif age < 80:
+            high_bmd, low_bmd = -2.3, -3.8
+        elif age < 85:
+            high_bmd, low_bmd = -2.1, -3.8
+        else:
+            high_bmd, low_bmd = -2.0, -3.8
+
+    risk = np.nan
+    if row['bmdtest_tscore_fn'] > high_bmd:
+        risk = 0
+    elif row['bmdtest_tscore_fn'] > low_bmd:
+        risk = 1
+    elif row['bmdtest_tscore_fn'] <= low_bmd:
+        risk = 2
+
+    if (row['oralster'] == 1 or row['obreak'] > 1 or row['ankle'] == 1 or row['clavicle'] == 1 or
+            row['elbow'] == 1 or row['femur'] == 1 or row['wrist'] == 1 or row['shoulder'] == 1 or
+            row['tibfib'] == 1) and risk < 2:
+        risk += 1
+
+    if row['hip'] == 1 or row['spine'] == 1:
+        risk = 2
+    return risk
+
+
+# Every age band edge and its neighbours, missing age, both genders and an unknown one, and the T-scores
+# on and around every limit of the table
+AGES = [40, 59, 59.5, 60, 64, 65, 69.9, 70, 75, 79, 80, 84, 85, 99, np.nan]
+GENDERS = [1, 2, 0]
+LIMITS = [-3.9, -3.8, -3.7, -3.5, -3.2, -2.9, -2.6, -2.5, -2.4, -2.3, -2.2, -2.1, -2.0, -1.9, -1.7, -1.2, -0.5, 0.1]
+TSCORES = sorted({*LIMITS, *[limit - 0.05 for limit in LIMITS], *[limit + 0.05 for limit in LIMITS], -5, 2}) + [np.nan]
+
+
+def _patients(risk_factors):
+    rows = [dict(PatientAge=age, PatientGender=gender, bmdtest_tscore_fn=tscore, **risk_factors)
+            for age, gender, tscore in itertools.product(AGES, GENDERS, TSCORES)]
+    df = pd.DataFrame(rows)
+    return df.astype({column: 'float32' for column in df.columns})
+
+
+# No risk factor, steroids, an earlier fracture (obreak 1 is one, more than one bumps), every bump site
+# and both high sites, missing answers, and a bump together with a high site
+RISK_FACTORS = [{}, {'oralster': 1}, {'oralster': 0}, {'obreak': 1}, {'obreak': 2}, {'obreak': 3},
+                *[{site: 1} for site in FRACTURE_COLUMNS], {'ankle': 0, 'hip': 0}, {'oralster': 1, 'spine': 1},
+                {'oralster': np.nan, 'obreak': np.nan, 'hip': np.nan}]
+
+
+def test_caroc_labels_are_the_per_row_table():
+    for risk_factors in RISK_FACTORS:
+        df = _patients({'oralster': 0, 'obreak': 0, **{site: 0 for site in FRACTURE_COLUMNS}, **risk_factors})
+        expected = np.array([caroc_risk_row(row) for _, row in df.iterrows()], dtype='float64')
+
+        np.testing.assert_array_equal(caroc_labels(df).to_numpy(dtype='float64'), expected, err_msg=str(risk_factors))
+
+
+# Answers the frame does not have count as no
+def test_missing_risk_factor_columns_count_as_no():
+    df = _patients({})
+    full = df.assign(oralster=0, obreak=0, **{site: 0 for site in FRACTURE_COLUMNS})
+
+    pd.testing.assert_series_equal(caroc_labels(df), caroc_labels(full))
+    np.testing.assert_array_equal(caroc_risk(df['PatientAge'], df['PatientGender'], df['bmdtest_tscore_fn']),
+                                  caroc_labels(df).to_numpy())
+
+
+def test_fill_keeps_the_exported_risks():
+    df = _patients({'oralster': 1}).iloc[:6]
+    df = df.assign(bmdtest_10yr_caroc=np.array([np.nan, 0, np.nan, 2, np.nan, 1], dtype='float32'))
+
+    filled = fill_caroc_labels(df)
+
+    assert filled.dtype == 'float32'
+    assert list(filled[df['bmdtest_10yr_caroc'].notna()]) == [0, 2, 1]
+    np.testing.assert_array_equal(filled[df['bmdtest_10yr_caroc'].isna()],
+                                  [caroc_risk_row(row) for _, row in df[df['bmdtest_10yr_caroc'].isna()]
+                                   .assign(obreak=0, **{site: 0 for site in FRACTURE_COLUMNS}).iterrows()])
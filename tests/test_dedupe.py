@@ -0,0 +1,74 @@
+import io
+
+import pandas as pd
+import pytest
+
+from pipeline.dedupe import dedupe_rows
+
+# Returning patients with conflicting rows, in file order:
+#   1  three visits, the latest is in the middle of the file
+#   2  one visit without a date and one with an unreadable date around a dated one
+#   3  no readable date at all
+#   4  two visits on the same day, the second answered more of the survey
+#   5  two visits on the same day with as many answers, and a third with fewer answers
+#   6  a single row
+ROWS = """BaselineId,PatientId,BaselineDateSurveyed,PatientAge,smoke,alcohol
+10,1,01-Dec-14,70,,
+11,1,15-Mar-16,71,1,
+12,1,07-Nov-15,72,1,0
+20,2,,60,1,1
+21,2,02-Feb-15,61,,
+22,2,not a date,62,0,1
+30,3,,50,,
+31,3,,51,1,
+40,4,05-May-15,80,,
+41,4,05-May-15,81,1,1
+50,5,09-Sep-15,90,1,
+51,5,09-Sep-15,91,,0
+52,5,01-Jan-15,92,,
+60,6,03-Mar-15,,,
+"""
+
+COLUMNS = ['PatientAge', 'smoke', 'alcohol']
+
+
+def _rows():
+    return pd.read_csv(io.StringIO(ROWS))
+
+
+def _kept(policy, columns=()):
+    return list(dedupe_rows(_rows(), ['PatientId'], policy, columns)['BaselineId'])
+
+
+def test_first_keeps_the_first_row_in_file_order():
+    assert _kept('first') == [10, 20, 30, 40, 50, 60]
+
+
+def test_latest_keeps_the_latest_dated_row():
+    # Rows without a readable date lose, and a patient without any keeps the first row, as do date ties
+    assert _kept('latest') == [11, 21, 30, 40, 50, 60]
+
+
+def test_earliest_keeps_the_earliest_dated_row():
+    # Missing dates lose here too rather than counting as the earliest
+    assert _kept('earliest') == [10, 21, 30, 40, 52, 60]
+
+
+def test_most_complete_keeps_the_row_with_the_most_answers():
+    # 1 and 2 have a single most complete row, 3 and 4 the later row, and 5 ties on its first two rows
+    assert _kept('most_complete', COLUMNS) == [12, 20, 31, 41, 50, 60]
+
+
+def test_kept_rows_keep_their_index_and_file_order():
+    df = _rows().set_index(pd.RangeIndex(100, 100 + len(ROWS.splitlines()) - 1))
+    kept = dedupe_rows(df, ['PatientId'], 'latest')
+
+    assert list(kept.index) == [101, 104, 106, 108, 110, 113]
+    assert kept.index.is_monotonic_increasing
+
+
+def test_policies_check_their_input():
+    with pytest.raises(ValueError):
+        dedupe_rows(_rows(), ['PatientId'], 'newest')
+    with pytest.raises(ValueError):
+        dedupe_rows(_rows().drop(columns='BaselineDateSurveyed'), ['PatientId'], 'earliest')
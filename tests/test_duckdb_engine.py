@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pytest
+
+from pipeline import cache, duckdb_engine
+from pipeline.cleaning import pandas_backend
+from pipeline.variants import VARIANTS
+
+pytest.importorskip('duckdb')
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# The raw file each variant is built from
+RAW_FILES = {
+    'main': ROOT / '0-Merging_Raw_Data' / 'merging_results' / 'Raw_Not_Cleaned_Data.csv',
+    'caroc': ROOT / '0-Merging_Raw_Data' / 'merging_results' / 'Raw_Not_Cleaned_Data.csv',
+    'old': ROOT / '0-Merging_Raw_Data' / 'merging_results' / 'Raw_Not_Cleaned_Data.csv',
+    'frax_web': ROOT / '1-Data_Cleaning' / 'FRAX' / 'FRAX_V1' / 'FRAX_Web_With_BMDv1.csv',
+    'frax_dll': ROOT / '1-Data_Cleaning' / 'FRAX' / 'FRAX_DLL_Calculation_data.csv',
+}
+
+
+@pytest.mark.parametrize('name', list(RAW_FILES))
+def test_duckdb_backend_writes_the_pandas_output(name, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    monkeypatch.setattr(duckdb_engine, 'TEMP_DIR', tmp_path / 'duckdb')
+    variant = VARIANTS[name]
+
+    _, _, clean, write = pandas_backend([name], RAW_FILES[name])
+    write(clean(variant)[0], tmp_path / 'pandas' / 'out.csv')
+    _, _, clean, write = duckdb_engine.duckdb_backend([name], RAW_FILES[name])
+    write(clean(variant)[0], tmp_path / 'duckdb' / 'out.csv')
+
+    assert (tmp_path / 'duckdb' / 'out.csv').read_text() == (tmp_path / 'pandas' / 'out.csv').read_text()
+    assert ((tmp_path / 'duckdb' / 'out.imputer.json').read_text() ==
+            (tmp_path / 'pandas' / 'out.imputer.json').read_text())
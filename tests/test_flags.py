@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import cache
+from pipeline.cleaning import pandas_backend
+from pipeline.datasets import read_cleaned
+from pipeline.flags import (COMORBIDITIES, FLAGS, FLAGS_COLUMN, FLAGS_DTYPE, FRACTURE_SITES, decode_flags,
+                            encode_flags, flag_mask, match_flags, pack_flags, unpack_flags)
+from pipeline.variants import VARIANTS
+
+ROOT = Path(__file__).resolve().parents[1]
+RAW_FILE = ROOT / '0-Merging_Raw_Data' / 'merging_results' / 'Raw_Not_Cleaned_Data.csv'
+
+
+# Flag columns as the raw exports have them: 0, 1, missing and the odd other answer
+def _answers(rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    answers = rng.choice(np.array([0, 1, np.nan, 2], dtype='float32'), size=(rows, len(FLAGS)), p=[.5, .3, .15, .05])
+    return pd.DataFrame(answers, columns=FLAGS).assign(PatientId=np.arange(rows))
+
+
+def test_decode_gives_back_the_encoded_answers():
+    df = _answers()
+    codes = encode_flags(df)
+
+    assert codes.dtype == FLAGS_DTYPE
+    pd.testing.assert_frame_equal(decode_flags(codes), (df[FLAGS] == 1).astype('float32'))
+
+
+def test_unpack_gives_back_the_packed_columns():
+    df = _answers().fillna(0).replace(2, 0)
+    packed = pack_flags(df)
+
+    assert list(packed.columns) == [FLAGS_COLUMN, 'PatientId']
+    pd.testing.assert_frame_equal(unpack_flags(packed), df)
+
+
+def test_match_flags_is_the_column_selection():
+    df = _answers()
+    codes = encode_flags(df)
+    yes = df[FLAGS] == 1
+
+    assert (match_flags(codes) == np.ones(len(df), dtype=bool)).all()
+    assert (match_flags(codes, any_of=['ankle']) == yes['ankle']).all()
+    assert (match_flags(codes, any_of=FRACTURE_SITES, none_of=['ankle']) ==
+            (yes[FRACTURE_SITES].any(axis=1) & ~yes['ankle'])).all()
+    assert (match_flags(codes, all_of=['diabetes', 'hip']) == (yes['diabetes'] & yes['hip'])).all()
+    assert (match_flags(codes, none_of=COMORBIDITIES) == ~yes[COMORBIDITIES].any(axis=1)).all()
+
+
+def test_unknown_flags_are_rejected():
+    with pytest.raises(ValueError):
+        flag_mask(['hip', 'knee'])
+
+
+# The ankle filter of the model scripts on the packed column of the cleaned data drops the rows the
+# column filter dropped
+@pytest.mark.parametrize('name', ['main', 'caroc'])
+def test_cleaned_flags_select_the_rows_of_the_flag_columns(name, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    _, _, clean, write = pandas_backend([name], RAW_FILE)
+    write(clean(VARIANTS[name])[0], tmp_path / 'clean.csv')
+    dataset = read_cleaned(tmp_path / 'clean.csv')
+
+    packed = dataset.drop(dataset.index[match_flags(dataset[FLAGS_COLUMN], any_of=['ankle'])])
+    columns = dataset.drop(dataset.index[dataset['ankle'] == 1])
+
+    assert 0 < len(packed) < len(dataset)
+    pd.testing.assert_frame_equal(packed, columns)
+
+
+def test_data_cleaned_without_packed_flags_gets_them(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    df = _answers().fillna(0)
+    df.to_csv(tmp_path / 'clean.csv', index=False)
+
+    dataset = read_cleaned(tmp_path / 'clean.csv')
+
+    assert (dataset[FLAGS_COLUMN].to_numpy() == encode_flags(df)).all()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from pipeline.frax import FRAX_RISK_DTYPE, MISSING_CODE, risk_level_codes, risk_levels
+
+
+# The per-row risk level of the FRAX cleaning scripts the vectorized one replaced, kept as the reference
+def get_frax_risk_level_row(percentage):
+    result = ""
+    if percentage < 10:
+        result = "Low"
+    elif 10 <= percentage <= 20:
+        result = "Moderate"
+    elif percentage > 20:
+        result = "High"
+    return result
+
+
+# Both cut points and their neighbours, in both float dtypes
+PERCENTAGES = [0, 1.5, 9.99, 9.9999999, 10, 10.0000001, 15, 19.99, 20, 20.0000001, 20.01, 45, 100, np.nan]
+
+
+def test_risk_levels_are_the_per_row_levels():
+    for dtype in ('float32', 'float64'):
+        percentages = pd.Series(PERCENTAGES, dtype=dtype, index=range(10, 10 + len(PERCENTAGES)))
+        levels = risk_levels(percentages)
+
+        assert levels.dtype == FRAX_RISK_DTYPE
+        assert list(levels.index) == list(percentages.index)
+        # The per-row version gave "" for a missing percentage, which is written as the same empty cell
+        assert list(levels.astype(object).fillna('')) == [get_frax_risk_level_row(value) for value in percentages]
+        assert levels.to_csv(index=False) == pd.Series([get_frax_risk_level_row(value) for value in percentages],
+                                                       name=percentages.name).to_csv(index=False)
+
+
+def test_risk_level_codes():
+    codes = risk_level_codes(np.array([5, 10, 20, 25, np.nan]))
+
+    assert codes.dtype == 'int8'
+    assert list(codes) == [0, 1, 1, 2, MISSING_CODE]
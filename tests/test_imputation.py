@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.imputation import IMPUTER_FORMAT, apply_imputer, fit_imputer, load_imputer, save_imputer
+
+# A step of every method, the gender mean on a float32 column and the means on float32 and int columns
+STEPS = [('zero_then_mean', ['bmdtest_height']),
+         ('gender_mean', ['bmdtest_weight', 'PatientAge']),
+         ('mean', ['bmdtest_tscore_fn']),
+         ('mean_nan', ['bmi']),
+         ('mode', ['smoke', 'parentbreak']),
+         ('zero', ['hip'])]
+
+
+def _patients(rows=300, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def holes(values, missing=.15, zeros=.05):
+        values = values.astype('float64')
+        draw = rng.random(len(values))
+        values[draw < missing] = np.nan
+        values[(draw >= missing) & (draw < missing + zeros)] = 0
+        return values
+
+    return pd.DataFrame({
+        'PatientGender': rng.choice([1, 2, 3], rows, p=[.6, .35, .05]).astype('float32'),
+        'PatientAge': rng.integers(45, 95, rows),
+        'bmdtest_height': holes(rng.normal(165, 9, rows)).astype('float32'),
+        'bmdtest_weight': holes(rng.normal(72, 14, rows)).astype('float32'),
+        'bmdtest_tscore_fn': holes(rng.normal(-1.8, 1, rows)),
+        'bmi': holes(rng.normal(26, 4, rows)),
+        'smoke': holes(rng.integers(0, 2, rows), zeros=0).astype('float32'),
+        'parentbreak': holes(rng.integers(0, 3, rows), zeros=0).astype('float32'),
+        'hip': holes(rng.integers(0, 2, rows), zeros=0).astype('float32'),
+    })
+
+
+def test_saved_imputer_fills_the_frame_as_the_fitted_one(tmp_path):
+    df = _patients()
+    imputer = fit_imputer(df, STEPS)
+    save_imputer(imputer, tmp_path / 'clean.imputer.json')
+
+    loaded = load_imputer(tmp_path / 'clean.imputer.json')
+    imputed = apply_imputer(df, imputer)
+
+    pd.testing.assert_frame_equal(apply_imputer(df, loaded), imputed)
+    # New records are filled with the statistics of the fitted data, not their own
+    new = _patients(50, seed=1)
+    pd.testing.assert_frame_equal(apply_imputer(new, loaded), apply_imputer(new, imputer))
+    # Rows of other genders keep their missing gender mean columns
+    filled = imputed[df['PatientGender'] != 3]
+    assert filled[[column for _, columns in STEPS for column in columns if column != 'bmi']].notna().all().all()
+    assert imputed.loc[df['PatientGender'] == 3, 'bmdtest_weight'].isna().any()
+
+
+def test_imputers_of_another_format_are_rejected(tmp_path):
+    imputer = fit_imputer(_patients(), STEPS)
+    (tmp_path / 'old.imputer.json').write_text(json.dumps({**imputer, 'format': IMPUTER_FORMAT + 1}))
+    (tmp_path / 'unversioned.imputer.json').write_text(json.dumps({key: value for key, value in imputer.items()
+                                                                   if key != 'format'}))
+
+    for name in ('old', 'unversioned'):
+        with pytest.raises(ValueError, match='imputer format'):
+            load_imputer(tmp_path / f'{name}.imputer.json')
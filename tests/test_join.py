@@ -0,0 +1,46 @@
+import pandas as pd
+
+from pipeline.join import hash_join, join_in_memory, join_out_of_core
+
+# Patients 1 and 2 are in both families, 3 only has a CAROC row and 4 and 5 only have FRAX rows.
+# BaselineId and PatientAge have blanks, which made the in-memory join write the ids as floats (1652.0).
+CAROC = """BaselineId,PatientId,PatientAge,smoke,bmdtest_10yr_caroc,CarocBasalRiskLevel
+1652,1,67,,12.5,Low
+1653,2,,1,30,High
+1654,3,71,0,,Moderate
+1652,1,68,1,99,High
+"""
+
+FRAX = """BaselineId,PatientId,PatientAge,smoke,bmdtest_10yr_frax,FraxRiskLevel
+,1,,1,8.25,Low
+2001,2,74,,11,Moderate
+2002,4,59.5,0,,Low
+2003,5,,,4,Low
+"""
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return path
+
+
+def test_in_memory_and_out_of_core_joins_write_the_same_file(tmp_path):
+    caroc_path = _write(tmp_path, 'caroc.csv', CAROC)
+    frax_path = _write(tmp_path, 'frax.csv', FRAX)
+
+    join_in_memory(caroc_path, frax_path, tmp_path / 'in_memory.csv')
+    join_out_of_core(caroc_path, frax_path, tmp_path / 'out_of_core.csv', partitions=3, chunk_rows=2, max_workers=1)
+
+    assert (tmp_path / 'in_memory.csv').read_text() == (tmp_path / 'out_of_core.csv').read_text()
+
+
+def test_hash_join_keeps_integer_ids(tmp_path):
+    caroc = pd.read_csv(_write(tmp_path, 'caroc.csv', CAROC))
+    frax = pd.read_csv(_write(tmp_path, 'frax.csv', FRAX))
+
+    joined = hash_join(caroc, frax)
+
+    assert pd.api.types.is_integer_dtype(joined['BaselineId'].dtype)
+    assert joined.to_csv(index=False).splitlines()[1].startswith('1652,1,67.0,1.0,')
+    assert list(joined['PatientId']) == [1, 2, 3, 4, 5]
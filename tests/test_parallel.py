@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import pytest
+
+from pipeline import cache
+from pipeline.cleaning import pandas_backend
+from pipeline.imputation import IMPUTER_ATTR
+from pipeline.parallel import parallel_backend
+from pipeline.variants import VARIANTS
+
+ROOT = Path(__file__).resolve().parents[1]
+RAW_FILE = ROOT / '0-Merging_Raw_Data' / 'merging_results' / 'Raw_Not_Cleaned_Data.csv'
+
+
+# The exact sums merge into the serial statistics however the rows are split, so every partitioning gives
+# the imputer of the serial path, down to the last bit of the means
+@pytest.mark.parametrize('name', ['main', 'caroc', 'old'])
+def test_parallel_imputer_is_the_serial_one(name, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    variant = VARIANTS[name]
+    _, _, clean, _ = pandas_backend([name], RAW_FILE)
+    serial, _ = clean(variant)
+
+    for partitions in (1, 2, 3, 7, 16):
+        _, _, clean, _ = parallel_backend([name], RAW_FILE, workers=1, partitions=partitions)
+        parallel, _ = clean(variant)
+        assert parallel.attrs[IMPUTER_ATTR] == serial.attrs[IMPUTER_ATTR], partitions
+        assert parallel.to_csv(index=False) == serial.to_csv(index=False), partitions
@@ -0,0 +1,50 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from pipeline import reports
+from pipeline.reports import REPORT_KEYS, ReportPool, load_report_keys
+
+
+# Reports that stand in for the sweetviz ones: one is written, one raises and one logs its error and
+# returns False, as create_html_report does
+def written_report(data, save_path):
+    save_path.write_text(f'{len(data)} rows')
+    return True
+
+
+def raising_report(data, save_path):
+    raise RuntimeError('sweetviz broke')
+
+
+def failed_report(data, save_path):
+    return False
+
+
+def _jobs(report_dir, name):
+    return [(raising_report, report_dir / f'{name}_raising.html'),
+            (written_report, report_dir / f'{name}.html'),
+            (failed_report, report_dir / f'{name}_failed.html')]
+
+
+@pytest.mark.parametrize('mode', ['inline', 'background'])
+def test_a_failing_report_does_not_stop_the_others(mode, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(reports, 'report_jobs', _jobs)
+    df = pd.DataFrame({'PatientGender': [1, 2, 1], 'PatientAge': [60, 70, 80]})
+
+    with caplog.at_level(logging.ERROR):
+        with ReportPool(mode, max_workers=2) as report_pool:
+            report_pool.submit(df, tmp_path / 'main', 'analysis')
+            report_pool.submit(df, tmp_path / 'caroc', 'analysis')
+
+    for variant in ('main', 'caroc'):
+        assert (tmp_path / variant / 'analysis.html').read_text() == '3 rows'
+        # Only the written report is kept for the next run
+        assert list(load_report_keys(tmp_path / variant)) == ['analysis.html']
+        assert f'Report {tmp_path / variant / "analysis_raising.html"} failed: RuntimeError: sweetviz broke' \
+            in caplog.text
+    assert '4 reports failed' in caplog.text
+    assert sorted(report_pool.failed) == sorted(tmp_path / variant / name for variant in ('main', 'caroc')
+                                                for name in ('analysis_raising.html', 'analysis_failed.html'))
+    assert (tmp_path / 'main' / REPORT_KEYS).exists()
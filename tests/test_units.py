@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.units import bmi, lbs_to_kg, to_metric
+
+
+# The per-row conversions of the cleaning scripts the vectorized ones replaced, kept here as the reference
+
+def lbs_to_kg_row(weight_value):
+    if weight_value is not None:
+        return weight_value * 0.45359237
+
+
+def bmi_with_buff_row(height_value, weight_kg):
+    buffer = 30
+    if height_value <= 152.4 and weight_kg >= 56.7 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 152.4 < height_value <= 154.9 and weight_kg >= 56.7 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 152.4 < height_value <= 157.5 and weight_kg >= 59 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 157.5 < height_value <= 160 and weight_kg >= 61.2 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 160 < height_value <= 162.6 and weight_kg >= 63.5 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 162.6 < height_value <= 165.1 and weight_kg >= 65.8 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 165.1 < height_value <= 167.6 and weight_kg >= 68 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 167.6 < height_value <= 170.2 and weight_kg >= 70.3 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 170.2 < height_value <= 172.7 and weight_kg >= 72.6 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 172.7 < height_value <= 175.3 and weight_kg >= 74.8 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 175.3 < height_value <= 177.8 and weight_kg >= 77.1 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 177.8 < height_value <= 180.3 and weight_kg >= 79.4 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 180.3 < height_value <= 182.9 and weight_kg >= 81.6 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 182.9 < height_value <= 185.4 and weight_kg >= 83.9 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 185.4 < height_value <= 188 and weight_kg >= 86.2 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 188 < height_value <= 190.5 and weight_kg >= 88.5 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    elif 190.5 < height_value and weight_kg >= 90.7 + buffer:
+        weight_kg = lbs_to_kg_row(weight_kg)
+    return weight_kg
+
+
+def data_to_metric_row(height_value, weight_value, overweight_check):
+    height_cm = 0
+    is_metric = True
+    if 1 < height_value < 2.2:
+        height_cm = height_value * 100
+    elif 50 < height_value < 84:
+        height_cm = height_value * 2.54
+        is_metric = False
+    elif height_value > 125:
+        height_cm = height_value
+
+    if is_metric:
+        weight_kg = weight_value
+        if overweight_check:
+            weight_kg = bmi_with_buff_row(height_value, weight_kg)
+    else:
+        weight_kg = lbs_to_kg_row(weight_value)
+    return height_cm, weight_kg
+
+
+def calculate_bmi_row(height_value, weight_value):
+    return weight_value / ((height_value / 100) ** 2)
+
+
+# Heights on and around every unit boundary and height band edge, zero and missing, each with a light,
+# a borderline and a heavy weight, and a zero and a missing weight
+HEIGHTS = [0, 1, 1.0001, 1.62, 2.1999, 2.2, 2.5, 50, 50.5, 64, 83.99, 84, 100, 125, 125.5,
+           150, 152.4, 152.5, 154.9, 155, 157.5, 160, 162.6, 170.2, 180.3, 188, 190.5, 190.6, 210, np.nan]
+WEIGHTS = [0, 55, 86.7, 86.69, 89, 120.7, 150, 220, np.nan]
+
+
+def _grid(dtype):
+    heights, weights = np.meshgrid(np.array(HEIGHTS, dtype=dtype), np.array(WEIGHTS, dtype=dtype))
+    return heights.ravel(), weights.ravel()
+
+
+def _same(actual, expected):
+    np.testing.assert_array_equal(np.asarray(actual), np.asarray(expected, dtype=np.asarray(actual).dtype))
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+@pytest.mark.parametrize('overweight_check', [False, True])
+def test_to_metric_is_the_per_row_conversion(dtype, overweight_check):
+    heights, weights = _grid(dtype)
+    expected = [data_to_metric_row(height, weight, overweight_check) for height, weight in zip(heights, weights)]
+
+    height_cm, weight_kg = to_metric(heights, weights, overweight_check)
+
+    _same(height_cm, [row[0] for row in expected])
+    _same(weight_kg, [row[1] for row in expected])
+    assert weight_kg.dtype == dtype
+
+
+def test_to_metric_keeps_the_index_and_the_float64_heights_of_unmatched_rows():
+    heights = pd.Series([165, 0, 70], index=[3, 5, 8], dtype='float32')
+    weights = pd.Series([60, 60, 150], index=[3, 5, 8], dtype='float32')
+
+    height_cm, weight_kg = to_metric(heights, weights)
+
+    assert list(height_cm.index) == [3, 5, 8] and height_cm.dtype == 'float64'
+    assert weight_kg.dtype == 'float32'
+    assert to_metric(heights[[3, 8]], weights[[3, 8]])[0].dtype == 'float32'
+
+
+def test_lbs_to_kg_is_the_per_row_conversion():
+    weights = np.array(WEIGHTS, dtype='float32')
+
+    _same(lbs_to_kg(weights), [lbs_to_kg_row(weight) for weight in weights])
+
+
+# np.square rounds the square once where pow() on a float32 scalar could round it twice, so the float32
+# BMIs can differ from the per-row ones in their last bit
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_bmi_is_the_per_row_bmi(dtype):
+    heights, weights = _grid(dtype)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.array([calculate_bmi_row(height, weight) for height, weight in zip(heights, weights)])
+        actual = bmi(heights, weights)
+
+    if dtype == 'float64':
+        _same(actual, expected)
+    else:
+        np.testing.assert_array_max_ulp(actual, expected.astype(actual.dtype), maxulp=1)
+    assert np.isnan(actual[np.isnan(weights) | (heights == 0) & (weights == 0)]).all()
+    assert np.isinf(actual[(heights == 0) & (weights > 0)]).all()